@@ -28,7 +28,7 @@ setup(
     author_email='sbianamara@panopto.com',
     description=('A general application for connecting a panopto search index to an external source'),
     long_description=readme(),
-    keywords=['python', 'panopto', 'connector', 'attivio', 'coveo', 'microsoft_graph'],
+    keywords=['python', 'panopto', 'connector', 'attivio', 'coveo', 'microsoft_graph', 'opensearch'],
 
     install_requires=REQUIRES,
     package_data={
@@ -6,13 +6,19 @@ A prototype of the example connector app we will publish.
 
 # Standard Library Imports
 import argparse
+from collections import namedtuple
+from concurrent import futures
 from datetime import datetime, timedelta
 import glob
+import itertools
 import json
 import logging
 import os
+import queue
 import sys
+import threading
 import time
+import uuid
 
 # Third party
 import readline
@@ -21,8 +27,16 @@ from win32api import GetFileVersionInfo, LOWORD, HIWORD
 
 # Local
 from panoptoindexconnector.connector_config import ConnectorConfig, InvalidConfiguration
-from panoptoindexconnector.helpers import format_request_secure
-from panoptoindexconnector.target_handler import TargetHandler
+from panoptoindexconnector.helpers import format_request_secure, get_profile_state_filepath
+from panoptoindexconnector.panopto_sites import get_panopto_site
+from panoptoindexconnector.scheduler import get_schedule
+from panoptoindexconnector.spool import get_circuit_breaker, get_spool
+from panoptoindexconnector.state_store import get_state_store
+from panoptoindexconnector.sync_lanes import (
+    get_synced_principal_keys, record_synced_principals, record_synced_updates, SyncWindow)
+from panoptoindexconnector.target_handler import (
+    DELETED_STATE_NAMESPACE, FIELD_HASHES_STATE_NAMESPACE, has_drifted, TargetHandler)
+from panoptoindexconnector.trigger_server import start_trigger_server, SyncTriggers
 from panoptoindexconnector.custom_exceptions import CustomExceptions
 
 
@@ -30,6 +44,23 @@ from panoptoindexconnector.custom_exceptions import CustomExceptions
 EXPIRATION_GRACE_PERIOD = timedelta(minutes=2)
 LOG = logging.getLogger(__name__)
 MIN_DATETIME = datetime(2008, 1, 1)
+# State store entry marking a rebuild that has started but not yet synced everything
+REBUILD_STATE_NAMESPACE = 'connector'
+REBUILD_STATE_KEY = 'rebuild_in_progress'
+TARGET_BACKLOG_POLL_SECONDS = 0.1
+# Videos resynced by ID are fetched in pages of this many, like the pages of the updates API
+VIDEO_ID_PAGE_SIZE = 100
+# Spooled videos are pushed this many at a time
+SPOOL_DRAIN_VIDEOS = 100
+# State store entry holding the outcome of the last audit of a target, and the totals of all its audits
+AUDIT_STATE_NAMESPACE = 'connector'
+AUDIT_STATE_KEY = 'last_audit'
+# State store sets of the video ids in Panopto and in the target, compared by reconciliation
+RECONCILE_PANOPTO_NAMESPACE = 'connector:reconcile:panopto'
+RECONCILE_TARGET_NAMESPACE = 'connector:reconcile:target'
+
+# The outcome of a pass for a target
+SyncResult = namedtuple('SyncResult', ['last_update_time', 'exception', 'update_count', 'complete'])
 
 
 ###################################################################################################
@@ -51,7 +82,7 @@ def get_ids_to_update(oauth_token, panopto_site_address, from_date, next_token):
     }
     headers = {'Authorization': 'Bearer ' + oauth_token}
 
-    response = requests.get(url=url, params=params, headers=headers)
+    response = get_panopto_site(panopto_site_address).request('get', url=url, params=params, headers=headers)
 
     LOG.debug('Request was %s', format_request_secure(response.request))
     response.raise_for_status()
@@ -86,15 +117,6 @@ def get_last_update_time(profile_name):
     return last_update_time
 
 
-def get_profile_state_filepath(profile_name):
-    """
-    Gets the state file locatoin for the profile
-    """
-
-    home = os.path.expanduser('~')
-    return os.path.join(home, '.panopto-connector.' + profile_name)
-
-
 def get_oauth_token(panopto_site_address, panopto_oauth_credentials):
     """
     Get an oauth token from Panopto
@@ -114,7 +136,7 @@ def get_oauth_token(panopto_site_address, panopto_oauth_credentials):
         data['password'] = panopto_oauth_credentials['password']
 
     # sending get request and saving the response as response object
-    response = requests.post(url=url, data=data)
+    response = get_panopto_site(panopto_site_address).request('post', url=url, data=data)
     LOG.debug(response.content)
     response.raise_for_status()
 
@@ -130,7 +152,7 @@ def get_video_content(oauth_token, panopto_site_address, video_id):
     params = {'id': video_id}
     headers = {'Authorization': 'Bearer ' + oauth_token}
 
-    response = requests.get(url=url, params=params, headers=headers)
+    response = get_panopto_site(panopto_site_address).request('get', url=url, params=params, headers=headers)
     LOG.debug('Request was %s', format_request_secure(response.request))
 
     response.raise_for_status()
@@ -169,10 +191,17 @@ def renew_oauth_token_if_needed(panopto_site_address, panopto_oauth_credentials,
     :returns: oauth_token, expiration_date
     """
     if not oauth_token or not expiration_date or expiration_date <= datetime.utcnow():
-        now = datetime.utcnow()
-        oauth_token_response = get_oauth_token(panopto_site_address, panopto_oauth_credentials)
-        oauth_token = oauth_token_response['access_token']
-        expiration_date = now + timedelta(seconds=oauth_token_response['expires_in']) - EXPIRATION_GRACE_PERIOD
+        site = get_panopto_site(panopto_site_address)
+        credentials_key = panopto_oauth_credentials['client_id'], panopto_oauth_credentials.get('username')
+        with site.oauth_lock:
+            # Another profile syncing from the site with the same credentials may have renewed it already
+            oauth_token, expiration_date = site.oauth_tokens.get(credentials_key, (None, None))
+            if not oauth_token or expiration_date <= datetime.utcnow():
+                now = datetime.utcnow()
+                oauth_token_response = get_oauth_token(panopto_site_address, panopto_oauth_credentials)
+                oauth_token = oauth_token_response['access_token']
+                expiration_date = now + timedelta(seconds=oauth_token_response['expires_in']) - EXPIRATION_GRACE_PERIOD
+                site.oauth_tokens[credentials_key] = oauth_token, expiration_date
     return oauth_token, expiration_date
 
 
@@ -222,20 +251,232 @@ def should_push(video_content_response, config):
     return False
 
 
-def sync_video_by_id(handler, oauth_token, config, video_id):
+def convert_video_by_id(handler, oauth_token, config, video_id):
     """
-    Sync video metadata from Panopto to target by ID
+    Get video metadata from Panopto by ID and convert it to the target format
+    :returns: (video_id, target_content) where target_content is None if the video should be deleted,
+              or None if the video should not be synced
     """
 
     video_content_response = get_video_content(oauth_token, config.panopto_site_address, video_id)
+    return convert_video_content(handler, config, video_id, video_content_response)
+
+
+def convert_video_content(handler, config, video_id, video_content_response):
+    """
+    Convert video metadata fetched from Panopto to the target format
+    :returns: (video_id, target_content) where target_content is None if the video should be deleted,
+              or None if the video should not be synced
+    """
+
     if video_content_response['Deleted']:
-        handler.delete_from_target(video_content_response['Id'])
-    else:
-        if should_push(video_content_response, config):
-            target_content = handler.convert_to_target(video_content_response)
-            handler.push_to_target(target_content, config)
+        return video_content_response['Id'], None
+    if should_push(video_content_response, config):
+        return video_id, handler.convert_to_target(video_content_response)
+
+    LOG.info('Skipping update for video %s as it did not match principal allowlist', video_id)
+    return None
+
+
+def discard_spooled_videos(config, video_ids):
+    """
+    Drop what the target's spool holds for videos just pushed directly, so draining it later doesn't put back
+    older content
+    """
+    if config.spool:
+        get_spool(config).discard(video_ids)
+
+
+def sync_converted_videos(handler, config, converted_videos):
+    """
+    Resolve converted videos against the target together, then push or delete each of them in order
+    """
+
+    handler.resolve_to_target([target_content for _, target_content in converted_videos if target_content is not None])
+
+    for video_id, target_content in converted_videos:
+        if target_content is None:
+            handler.delete_from_target(video_id)
+        else:
+            handler.push_to_target(target_content, config, video_id=video_id)
+        # Sleep to avoid getting throttled by the API
+        time.sleep(config.sleep_seconds)
+
+
+def sync_videos_by_id(config, video_ids):
+    """
+    Sync videos from Panopto to each target of the profile by ID, fetching each video once.
+    This is outside of the sync passes, so does not move any target's last update time, but records the principals
+    the videos were synced with, as sync passes do.
+    """
+
+    LOG.info('Syncing %i videos on demand', len(video_ids))
+
+    try:
+        oauth_token, _ = renew_oauth_token_if_needed(
+            config.panopto_site_address, config.panopto_oauth_credentials, None, None)
+        video_content_responses = [
+            (video_id, get_video_content(oauth_token, config.panopto_site_address, video_id))
+            for video_id in video_ids
+        ]
+    except Exception as ex:  # pylint: disable=broad-except
+        log_sync_exception(ex)
+        return
+
+    for target_config in config.get_target_configs():
+        handler = None
+        try:
+            handler = TargetHandler(target_config)
+            handler.initialize()
+            converted_videos = [
+                converted_video for converted_video in (
+                    convert_video_content(handler, target_config, video_id, video_content_response)
+                    for video_id, video_content_response in video_content_responses)
+                if converted_video
+            ]
+            sync_converted_videos(handler, target_config, converted_videos)
+            handler.flush()
+            discard_spooled_videos(target_config, [video_id for video_id, _ in converted_videos])
+            record_synced_updates(get_state_store(target_config), [
+                (video_id, None, video_content_response) for video_id, video_content_response in video_content_responses])
+        except Exception as ex:  # pylint: disable=broad-except
+            log_sync_exception(ex)
+        finally:
+            if handler:
+                handler.teardown()
+
+
+def resync(config, video_ids=None, since_time=None, until_time=None):
+    """
+    Sync again, in full, the videos listed or else every update between the since and until times, to each target
+    of the profile. This runs through the same pipeline as sync passes, but does not move any last update time.
+    :returns: t/f whether every target synced everything
+    """
+
+    target_configs = config.get_target_configs()
+    from_time = since_time or MIN_DATETIME
+    results = sync_targets(
+        config, target_configs, {target_config.profile_name: from_time for target_config in target_configs},
+        until_time=until_time, video_ids=video_ids, resync=True)
+
+    for profile_name, result in results.items():
+        if result.complete:
+            LOG.info('Resynced %i updates to %s', result.update_count, profile_name)
         else:
-            LOG.info('Skipping update for video %s as it did not match principal allowlist', video_id)
+            LOG.error('Resync of %s did not complete after %i updates | %s',
+                      profile_name, result.update_count, result.exception)
+
+    return all(result.complete for result in results.values())
+
+
+def reconcile(config):
+    """
+    Compare every video id in Panopto with those in each target of the profile, deleting from the target what is
+    no longer in Panopto and syncing what the target is missing, without a rebuild. The target's ids are listed
+    by the implementation if it can, else taken from the local record of what was synced to it.
+    The sets are kept in the targets' state stores, so millions of ids are compared without holding them in memory.
+    :returns: t/f whether every target was reconciled
+    """
+
+    target_configs = config.get_target_configs()
+    state_stores = [get_state_store(target_config) for target_config in target_configs]
+    for state_store in state_stores:
+        state_store.clear(RECONCILE_PANOPTO_NAMESPACE)
+
+    # Ids only; anything missing is fetched later. Only a complete listing tells what is no longer in Panopto.
+    LOG.info('Listing every video id in %s', config.panopto_site_address)
+    panopto_count = 0
+    for page, is_last_page in get_update_pages(config, MIN_DATETIME, None, lambda _: False, max_pages=sys.maxsize):
+        video_ids = [video_id for video_id, _, _ in page]
+        for state_store in state_stores:
+            state_store.add(RECONCILE_PANOPTO_NAMESPACE, *video_ids)
+        panopto_count += len(video_ids)
+        if is_last_page:
+            break
+    else:
+        LOG.error('Could not list every video id in Panopto; not reconciling')
+        return False
+    LOG.info('Found %i updates in Panopto', panopto_count)
+
+    complete = True
+    for target_config, state_store in zip(target_configs, state_stores):
+        try:
+            complete = reconcile_target(config, target_config, state_store) and complete
+        except Exception as ex:  # pylint: disable=broad-except
+            log_sync_exception(ex)
+            complete = False
+        finally:
+            state_store.clear(RECONCILE_TARGET_NAMESPACE)
+
+    for state_store in state_stores:
+        state_store.clear(RECONCILE_PANOPTO_NAMESPACE)
+
+    return complete
+
+
+def reconcile_target(config, target_config, state_store):
+    """
+    Delete from one target the videos no longer in Panopto and sync those it is missing,
+    once the Panopto ids are in its state store
+    :returns: t/f whether the target was reconciled
+    """
+
+    handler = TargetHandler(target_config)
+    try:
+        handler.initialize()
+
+        target_video_ids = handler.list_target_ids()
+        if target_video_ids is None:
+            LOG.info('Taking the ids in %s from the record of what was synced to it', target_config.profile_name)
+            target_video_ids = state_store.keys(FIELD_HASHES_STATE_NAMESPACE)
+        target_video_ids = iter(target_video_ids)
+
+        state_store.clear(RECONCILE_TARGET_NAMESPACE)
+        for video_ids in iter(lambda: list(itertools.islice(target_video_ids, VIDEO_ID_PAGE_SIZE)), []):
+            state_store.add(RECONCILE_TARGET_NAMESPACE, *video_ids)
+        LOG.info('Found %i videos in %s', state_store.count(RECONCILE_TARGET_NAMESPACE), target_config.profile_name)
+
+        # Deleted videos stay in the updates listing, so a document left behind by one is in both sets;
+        # it is told apart by the delete recorded when the video was synced
+        orphaned_video_ids = itertools.chain(
+            state_store.difference(RECONCILE_TARGET_NAMESPACE, RECONCILE_PANOPTO_NAMESPACE),
+            (
+                video_id
+                for video_id in state_store.intersection(RECONCILE_TARGET_NAMESPACE, DELETED_STATE_NAMESPACE)
+                if state_store.contains(RECONCILE_PANOPTO_NAMESPACE, video_id)
+            ))
+        orphan_count = 0
+        for video_ids in iter(lambda: list(itertools.islice(orphaned_video_ids, VIDEO_ID_PAGE_SIZE)), []):
+            sync_converted_videos(handler, target_config, [(video_id, None) for video_id in video_ids])
+            handler.flush()
+            discard_spooled_videos(target_config, video_ids)
+            orphan_count += len(video_ids)
+        LOG.info('Deleted %i videos no longer in Panopto from %s', orphan_count, target_config.profile_name)
+    finally:
+        handler.teardown()
+
+    # Videos already synced as deleted are not missing
+    missing_video_ids = (
+        video_id
+        for video_id in state_store.difference(RECONCILE_PANOPTO_NAMESPACE, RECONCILE_TARGET_NAMESPACE)
+        if not state_store.contains(DELETED_STATE_NAMESPACE, video_id)
+    )
+    result = sync_targets(
+        config, [target_config], {target_config.profile_name: MIN_DATETIME}, video_ids=missing_video_ids,
+        resync=True)[target_config.profile_name]
+    LOG.info('Synced %i videos missing from %s', result.update_count, target_config.profile_name)
+
+    return result.complete
+
+
+def sync_video_by_id(handler, oauth_token, config, video_id):
+    """
+    Sync video metadata from Panopto to target by ID
+    """
+
+    converted_video = convert_video_by_id(handler, oauth_token, config, video_id)
+    if converted_video:
+        sync_converted_videos(handler, config, [converted_video])
 
 
 def trigger_rebuild(profile_name):
@@ -253,109 +494,657 @@ def trigger_rebuild(profile_name):
 ###################################################################################################
 
 
-def run(config, profile_name):
+def run(config):
     """
-    Run a sync given a config
+    Run a sync given a config, repeating each target's passes on its own schedule
     """
 
     assert isinstance(config, ConnectorConfig), 'config must be of type %s' % ConnectorConfig
 
-    # Get time to update from
-    last_update_time = get_last_update_time(profile_name)
+    last_update_times, next_sync_times = get_sync_schedule(config)
+
+    triggers = SyncTriggers()
+    if config.trigger_port:
+        start_trigger_server(config, triggers)
 
     while True:
-        LOG.info('Beginning search index sync')
+        sync_due_targets(config, last_update_times, next_sync_times, triggers=triggers)
+
+        # Between passes, sync triggered videos right away, ahead of anything else
+        while wait(min(next_sync_times.values()) - datetime.utcnow(), triggers):
+            video_ids, sync_now = triggers.take()
+            if video_ids:
+                sync_videos_by_id(config, video_ids)
+            if sync_now:
+                next_sync_times.update(dict.fromkeys(next_sync_times, datetime.utcnow()))
+                break
+
+
+def run_daemon(configs, workers):
+    """
+    Run the syncs of several profiles on a shared pool of workers, each profile on its own schedule.
+    Profiles syncing from the same Panopto site share its connections, oauth tokens and rate budget.
+    """
+
+    if not configs:
+        LOG.error('No profiles to sync')
+        return
+
+    schedules = {}
+    for config in configs:
+        get_panopto_site(config.panopto_site_address).limit_rate(config.panopto_requests_per_second)
+        schedules[config.profile_name] = (config,) + get_sync_schedule(config)
+
+    running = {}
+    with futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='profile') as executor:
+        while True:
+            # Start the passes of profiles which are due
+            now = datetime.utcnow()
+            for profile_name, (config, last_update_times, next_sync_times) in schedules.items():
+                if profile_name not in running.values() and min(next_sync_times.values()) <= now:
+                    future = executor.submit(sync_due_targets, config, last_update_times, next_sync_times)
+                    running[future] = profile_name
+
+            # Then wait for a pass to finish, or until the next profile is due
+            waiting_times = [
+                min(next_sync_times.values())
+                for profile_name, (_, _, next_sync_times) in schedules.items() if profile_name not in running.values()
+            ]
+            timeout = max((min(waiting_times) - datetime.utcnow()).total_seconds(), 0) if waiting_times else None
+            if not running:
+                time.sleep(timeout)
+                continue
+
+            done, _ = futures.wait(running, timeout=timeout, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                profile_name = running.pop(future)
+                if future.exception():
+                    config, _, next_sync_times = schedules[profile_name]
+                    LOG.error('Failed a sync pass of profile %s | %s', profile_name, future.exception())
+                    # From when the pass failed, not when it started, which may be long past
+                    next_sync_times.update(
+                        dict.fromkeys(next_sync_times, datetime.utcnow() + config.polling_retry_minimum))
+
+
+def get_sync_schedule(config):
+    """
+    Get the schedule of a profile's targets, by target profile name: the time each is up to date as of,
+    and when each is next due to sync (now)
+    """
+
+    # Get time to update from
+    last_update_times = {
+        target_config.profile_name: get_last_update_time(target_config.profile_name)
+        for target_config in config.get_target_configs()
+    }
+    next_sync_times = dict.fromkeys(last_update_times, datetime.utcnow())
+
+    return last_update_times, next_sync_times
 
-        start_time = datetime.utcnow()
-        last_update_time, exception = sync(config, last_update_time)
 
-        if exception:
+def sync_due_targets(config, last_update_times, next_sync_times, triggers=None):
+    """
+    Run a sync of the profile's targets which are due, saving how far each got and scheduling its next pass.
+    Videos triggered during the pass are synced ahead of the rest of it.
+    """
 
-            LOG.exception('Failed to sync the search index: current up to %s | %s', last_update_time, exception)
-            remaining_time = config.polling_retry_minimum
+    LOG.info('Beginning search index sync of %s', config.profile_name)
+
+    start_time = datetime.utcnow()
+    due_configs = [
+        target_config for target_config in config.get_target_configs()
+        if next_sync_times[target_config.profile_name] <= start_time
+    ]
+    results = sync_targets(config, due_configs, last_update_times, triggers=triggers)
+
+    for target_config in due_configs:
+        profile_name = target_config.profile_name
+        result = results[profile_name]
+        last_update_times[profile_name] = result.last_update_time
+
+        # Poll busy targets more often and idle ones less, and back off those failing
+        interval = get_schedule(target_config).get_next_interval(
+            result.exception, result.update_count, result.complete)
+
+        if result.exception:
+            LOG.error('Failed to sync the search index for %s: current up to %s | %s',
+                      profile_name, last_update_times[profile_name], result.exception)
+            next_sync_times[profile_name] = datetime.utcnow() + interval
 
         else:
-            remaining_time = start_time + config.polling_frequency - datetime.utcnow()
+            next_sync_times[profile_name] = start_time + interval
+
+        save_last_update_time(last_update_times[profile_name], profile_name)
 
-        save_last_update_time(last_update_time, profile_name)
+    # Between passes, check a sample of what was synced to targets due an audit
+    audit_due_targets(config)
 
-        wait(remaining_time)
+
+def audit_due_targets(config):
+    """
+    Audit the profile's targets not audited within the audit interval, if auditing is on
+    """
+
+    if not config.audit_sample_size:
+        return
+
+    for target_config in config.get_target_configs():
+        state_store = get_state_store(target_config)
+        last_audit = state_store.get(
+            AUDIT_STATE_NAMESPACE, AUDIT_STATE_KEY, max_age=target_config.audit_interval.total_seconds())
+        if last_audit is not None:
+            continue
+
+        audit = {'sampled': 0, 'drifted': 0}
+        try:
+            audit['sampled'], audit['drifted'] = audit_target(target_config)
+        except Exception as ex:  # pylint: disable=broad-except
+            log_sync_exception(ex)
+            audit['error'] = str(ex)
+
+        # Keep the totals of every audit, for the drift rate over time
+        previous_audit = state_store.get(AUDIT_STATE_NAMESPACE, AUDIT_STATE_KEY, default={})
+        audit['total_sampled'] = previous_audit.get('total_sampled', 0) + audit['sampled']
+        audit['total_drifted'] = previous_audit.get('total_drifted', 0) + audit['drifted']
+        state_store.set(AUDIT_STATE_NAMESPACE, AUDIT_STATE_KEY, audit)
+
+        if audit['total_sampled']:
+            LOG.info('Drift rate of %s over all audits is %.2f%% (%i of %i videos)', target_config.profile_name,
+                     100 * audit['total_drifted'] / audit['total_sampled'],
+                     audit['total_drifted'], audit['total_sampled'])
+
+
+def audit_target(config):
+    """
+    Check a random sample of the videos synced to a target against what the target holds for them,
+    converting each video as fetched from Panopto now, and push again or delete those which drifted
+    :returns: (number of videos sampled, number which drifted)
+    """
+
+    handler = TargetHandler(config, push_in_full=True)
+    if not handler.can_get_from_target:
+        LOG.warning('Not auditing %s; its implementation cannot read back what the target holds', config.profile_name)
+        return 0, 0
+
+    video_ids = get_state_store(config).sample_keys(FIELD_HASHES_STATE_NAMESPACE, config.audit_sample_size)
+    if not video_ids:
+        return 0, 0
+
+    try:
+        handler.initialize()
+        oauth_token, _ = renew_oauth_token_if_needed(
+            config.panopto_site_address, config.panopto_oauth_credentials, None, None)
+
+        # Videos now outside the principal allowlist are left alone, as sync passes leave them
+        converted_videos = [
+            converted_video for converted_video in (
+                convert_video_by_id(handler, oauth_token, config, video_id) for video_id in video_ids)
+            if converted_video
+        ]
+        handler.resolve_to_target([target_content for _, target_content in converted_videos if target_content])
+
+        # Content the implementation skips syncing is deleted if the target still holds it
+        drifted_videos = [
+            (video_id, None if target_content and target_content.get('skip_sync') else target_content)
+            for video_id, target_content in converted_videos
+            if has_drifted(target_content, handler.get_from_target(video_id))
+        ]
+        sync_converted_videos(handler, config, drifted_videos)
+        handler.flush()
+        discard_spooled_videos(config, [video_id for video_id, _ in drifted_videos])
+    finally:
+        handler.teardown()
+
+    LOG.info('Audited %i videos synced to %s: %i drifted (%.2f%%) and were synced again',
+             len(converted_videos), config.profile_name, len(drifted_videos),
+             100 * len(drifted_videos) / len(converted_videos) if converted_videos else 0)
+
+    return len(converted_videos), len(drifted_videos)
 
 
 def sync(config, last_update_time):
     """
     Query for updates and run a sync up to the current point in time
     """
-    LOG.info('Beginning incremental sync from %s to %s beginning at %s.',
-             config.panopto_site_address, config.target_address, last_update_time)
+    result = sync_targets(config, [config], {config.profile_name: last_update_time})[config.profile_name]
+    return result.last_update_time, result.exception
 
-    handler = TargetHandler(config)
 
-    start_time = datetime.utcnow()
-    oauth_token, expiration = None, None
+def sync_targets(config, target_configs, last_update_times, until_time=None, video_ids=None, resync=False,
+                 triggers=None):
+    """
+    Query for updates and sync them to each target up to the current point in time, fetching each video once.
+    Each target syncs on its own thread from its own last update time, so a slow or failing target doesn't hold
+    up the others. Between pages, videos triggered since the last are fetched and synced ahead of everything else.
 
-    next_token = None
+    A resync syncs again, in full, the updates up to the until time or the videos listed, leaving rebuilds alone;
+    its targets never fall behind, and its results are not last update times to save.
+    :returns: {target profile name: SyncResult}
+    """
+    LOG.info('Beginning %s from %s to %s', 'resync' if resync else 'incremental sync',
+             config.panopto_site_address, ', '.join(target_config.target_address for target_config in target_configs))
+
+    start_time = datetime.utcnow()
     exception = None
 
-    new_last_update_time = last_update_time
+    target_syncs = [
+        TargetSync(target_config, last_update_times[target_config.profile_name], resync=resync)
+        for target_config in target_configs
+    ]
+    for target_sync in target_syncs:
+        target_sync.start()
+
+    def needs_content(update_time):
+        """
+        T/f whether any target still syncing needs a video updated at the update time
+        """
+        return any(update_time > target_sync.last_update_time for target_sync in target_syncs if target_sync.active)
+
+    if video_ids is not None:
+        pages = get_video_id_pages(config, video_ids, start_time)
+    else:
+        # Fetch from the target furthest behind; targets further along skip what they already have
+        from_time = min(target_sync.last_update_time for target_sync in target_syncs)
+        pages = get_update_pages(config, from_time, until_time, needs_content)
 
     try:
-        handler.initialize()
+        for page, is_last_page in pages:
+            active_syncs = [target_sync for target_sync in target_syncs if target_sync.active]
+            if not active_syncs:
+                LOG.warning('No target is still syncing')
+                break
+
+            if triggers:
+                add_triggered_pages(config, target_syncs, triggers.take_video_ids())
+
+            for target_sync in active_syncs:
+                target_sync.add_page(page, is_last_page=is_last_page)
+
+            if not is_last_page:
+                wait_for_target_backlogs(target_syncs, wait_for_all=resync)
+    except Exception as ex:  # pylint: disable=broad-except
+        log_sync_exception(ex)
+        exception = ex
+    finally:
+        for target_sync in target_syncs:
+            target_sync.finish()
+
+    results = {}
+    for target_sync in target_syncs:
+        new_last_update_time = target_sync.last_update_time
+        target_exception = target_sync.exception
+
+        # When a target synced everything, we can take max of the new_last_update_time and the
+        # start time of the loop as the new base point
+        if target_sync.complete:
+            new_last_update_time = max(new_last_update_time, start_time)
+        elif target_exception is None:
+            target_exception = exception or CustomExceptions.SyncIncompleteError(
+                'Target %s did not sync everything this pass' % target_sync.config.profile_name)
+
+        results[target_sync.config.profile_name] = SyncResult(
+            new_last_update_time, target_exception, target_sync.update_count, target_sync.complete)
+
+    return results
+
+
+def add_triggered_pages(config, target_syncs, video_ids):
+    """
+    Fetch videos triggered during a pass and queue them for every target still syncing, ahead of its pages.
+    A video which can't be fetched is left out rather than stopping the pass.
+    """
+
+    if not video_ids:
+        return
+
+    LOG.info('Syncing %i triggered videos ahead of the rest of the pass', len(video_ids))
+    try:
+        for page, _ in get_video_id_pages(config, video_ids, datetime.utcnow()):
+            for target_sync in target_syncs:
+                if target_sync.exception is None:
+                    target_sync.add_triggered_page(page)
+    except Exception as ex:  # pylint: disable=broad-except
+        log_sync_exception(ex)
+
+
+def get_update_pages(config, from_time, until_time, needs_content, max_pages=1000):
+    """
+    Fetch the pages of updates since the from time, up to the until time if given, fetching the content of
+    the videos for which needs_content(update_time) holds
+    :returns: a generator of ([(video_id, update_time, video_content_response)], is_last_page)
+    """
+
+    oauth_token, expiration = None, None
+    next_token = None
+
+    for _ in range(max_pages):
+        # Renew the oauth token if needed
+        oauth_token, expiration = renew_oauth_token_if_needed(
+            config.panopto_site_address, config.panopto_oauth_credentials, oauth_token, expiration)
+        # Hack: The API is currently returning a second rounded next token which can lead to issues if there has
+        # been a bulk update on a site and more than 100 videos have the same update time rounded to the nearest
+        # second. So we'll workaround this here for now by always omitting the next token and favoring instead
+        # always using new_last_update_time; fix next token as None.
+        get_ids_response = get_ids_to_update(oauth_token, config.panopto_site_address, from_time, next_token)
+        next_token = get_ids_response['NextToken']
+
+        page = []
+        for update in get_ids_response['Updates']:
+            video_id = update['VideoId']
+            update_time = parse_api_update_time(update['UpdateTime'])
+
+            # Updates come in update time order, so the first past the until time ends the range
+            if until_time and update_time > until_time:
+                next_token = None
+                break
 
-        for _ in range(1000):
             # Renew the oauth token if needed
             oauth_token, expiration = renew_oauth_token_if_needed(
                 config.panopto_site_address, config.panopto_oauth_credentials, oauth_token, expiration)
-            # Hack: The API is currently returning a second rounded next token which can lead to issues if there has
-            # been a bulk update on a site and more than 100 videos have the same update time rounded to the nearest
-            # second. So we'll workaround this here for now by always omitting the next token and favoring instead
-            # always using new_last_update_time; fix next token as None.
-            get_ids_response = get_ids_to_update(oauth_token, config.panopto_site_address, last_update_time, next_token)
-            for update in get_ids_response['Updates']:
-                # Renew the oauth token if needed
-                oauth_token, expiration = renew_oauth_token_if_needed(
-                    config.panopto_site_address, config.panopto_oauth_credentials, oauth_token, expiration)
-
-                video_id = update['VideoId']
-
-                update_time = parse_api_update_time(update['UpdateTime'])
-                LOG.info('Syncing video last updated %s', update_time)
-
-                sync_video_by_id(handler, oauth_token, config, video_id)
-                new_last_update_time = update_time
-                # Sleep to avoid getting throttled by the API
-                time.sleep(config.sleep_seconds)
-            next_token = get_ids_response['NextToken']
-            if next_token:
-                LOG.info('Pagination continued at token: %s', next_token)
-            else:
-                LOG.info('Sync complete')
-                break
+
+            # Fetch the video once for all the targets which need it
+            video_content_response = None
+            if needs_content(update_time):
+                video_content_response = get_video_content(oauth_token, config.panopto_site_address, video_id)
+            page.append((video_id, update_time, video_content_response))
+
+        if next_token:
+            LOG.info('Pagination continued at token: %s', next_token)
+            yield page, False
         else:
-            LOG.warning('Did not complete a sync in 1000 passes')
-    except requests.exceptions.HTTPError as ex:
+            LOG.info('Sync fetch complete')
+            yield page, True
+            return
+
+    LOG.warning('Did not complete a sync in %i passes', max_pages)
+
+
+def get_video_id_pages(config, video_ids, update_time):
+    """
+    Fetch the content of videos by ID, in pages as the updates API would return them, all updated at the update time.
+    The ids may be any iterable, read a page at a time.
+    :returns: a generator of ([(video_id, update_time, video_content_response)], is_last_page)
+    """
+
+    oauth_token, expiration = None, None
+    video_ids = iter(video_ids)
+    page_video_ids = list(itertools.islice(video_ids, VIDEO_ID_PAGE_SIZE))
+    fetched_count = 0
+
+    while True:
+        page = []
+        for video_id in page_video_ids:
+            oauth_token, expiration = renew_oauth_token_if_needed(
+                config.panopto_site_address, config.panopto_oauth_credentials, oauth_token, expiration)
+            page.append((video_id, update_time, get_video_content(oauth_token, config.panopto_site_address, video_id)))
+        fetched_count += len(page)
+
+        page_video_ids = list(itertools.islice(video_ids, VIDEO_ID_PAGE_SIZE))
+        LOG.info('Fetched %i videos', fetched_count)
+        yield page, not page_video_ids
+        if not page_video_ids:
+            return
+
+
+def wait_for_target_backlogs(target_syncs, wait_for_all=False):
+    """
+    Wait until an active target has room for another page, or every one does if waiting for all. Targets with
+    a full backlog once another has room fall behind for the rest of the pass, so the others can go on.
+    """
+    has_room = all if wait_for_all else any
+    while True:
+        active_syncs = [target_sync for target_sync in target_syncs if target_sync.active]
+        if not active_syncs or has_room(not target_sync.backlog_full for target_sync in active_syncs):
+            break
+        time.sleep(TARGET_BACKLOG_POLL_SECONDS)
+
+    for target_sync in active_syncs:
+        if target_sync.backlog_full:
+            target_sync.fall_behind()
+
+
+def log_sync_exception(ex):
+    """
+    Log an exception which stopped a sync, from within the handler catching it
+    """
+    if isinstance(ex, requests.exceptions.HTTPError):
         LOG.exception('Received error response %s | %s', ex.response.status_code, ex.response.text)
-        exception = ex
-    except (CustomExceptions.ConfigurationError, CustomExceptions.QuotaLimitExceededError) as ex:
-        # No need to log here since it will be logged in caller method ("run" method)
-        exception = ex
-    except Exception as ex:  # pylint: disable=broad-except
+    elif not isinstance(ex, (CustomExceptions.ConfigurationError, CustomExceptions.QuotaLimitExceededError)):
         LOG.exception('Received general exception')
-        exception = ex
-    finally:
-        handler.teardown()
+    # No need to log the rest here since they will be logged in caller method ("run" method)
 
-    # When there is no exception, we can take max of the new_last_update_time and the
-    # start time of the loop as the new base point
-    if exception is None:
-        new_last_update_time = max(new_last_update_time, start_time)
 
-    return new_last_update_time, exception
+class TargetSync:
+    """
+    Syncs pages of fetched updates to one target on its own thread, from the target's own last update time
+    """
 
+    def __init__(self, config, last_update_time, resync=False):
+        """
+        Set up the sync of a target, up to date as of the last update time.
+        A resync pushes everything in full, and leaves rebuilds alone.
+        """
+
+        self.config = config
+        self.last_update_time = last_update_time
+        self.resync = resync
+
+        # Converted videos go through the target's spool if it has one. A resync, run alongside, pushes directly
+        # and has no circuit breaker, discarding what the spool holds for the videos it pushes.
+        self._spool = get_spool(config) if config.spool else None
+        self._circuit_breaker = get_circuit_breaker(config) if self._spool and not resync else None
+        self.exception = None
+        self.complete = False
+        self.behind = False
+        self.update_count = 0
+
+        self._pages = queue.Queue()
+        self._window_size = 0
+        self._thread = threading.Thread(target=self._run, name='sync-' + config.profile_name, daemon=True)
+
+    @property
+    def active(self):
+        """
+        T/f whether the target still takes pages this pass
+        """
+        return self.exception is None and not self.behind and self._thread.is_alive()
+
+    @property
+    def backlog_full(self):
+        """
+        T/f whether the target has as many pages fetched ahead as it may; past this, the target falls behind
+        if other targets are keeping up
+        """
+        return self._pages.qsize() + self._window_size >= self.config.lookahead_pages
+
+    def add_page(self, page, is_last_page):
+        """
+        Queue a page of (video id, update time, video content response) for the target
+        """
+        self._pages.put((page, is_last_page, False))
+
+    def add_triggered_page(self, page):
+        """
+        Queue a page of videos triggered on demand, to sync ahead of the pages before it without moving
+        the last update time
+        """
+        self._pages.put((page, False, True))
+
+    def fall_behind(self):
+        """
+        Take no more pages this pass; the pages already queued are still synced
+        """
+        LOG.warning('Target %s fell behind; it continues from where it gets to on its next pass',
+                    self.config.profile_name)
+        self.behind = True
+
+    def finish(self):
+        """
+        Wait for the target to sync the pages queued for it
+        """
+        self._pages.put(None)
+        self._thread.join()
+
+    def start(self):
+        """
+        Start syncing pages as they are queued
+        """
+        self._thread.start()
+
+    def _sync_updates(self, handler, state_store, updates):
+        """
+        Convert, resolve and push or delete updates together, or with a spool, spool them and push what it can
+        """
+
+        if updates and not handler.initialized and not self._circuit_breaker:
+            handler.initialize()
+
+        converted_videos = []
+        skipped_updates = []
+        for update in updates:
+            video_id, update_time, video_content_response = update
+            LOG.info('Syncing video last updated %s to %s', update_time, self.config.profile_name)
+            converted_video = convert_video_content(handler, self.config, video_id, video_content_response)
+            if converted_video:
+                converted_videos.append(converted_video + (
+                    None if video_content_response['Deleted'] else get_synced_principal_keys(video_content_response),))
+            else:
+                skipped_updates.append(update)
+
+        # Spooled updates have their principals recorded once the spool pushes them
+        if self._circuit_breaker:
+            if converted_videos and self._spool.size >= self.config.spool_max_bytes:
+                raise CustomExceptions.SpoolFullError(
+                    'The spool of %s is full; fetching stops until it drains' % self.config.profile_name)
+            self._spool.append(converted_videos)
+            record_synced_updates(state_store, skipped_updates)
+            self._drain_spool(handler, state_store)
+            return
+
+        sync_converted_videos(handler, self.config, [converted_video[:2] for converted_video in converted_videos])
+        handler.flush()
+        if self._spool:
+            self._spool.discard(video_id for video_id, _, _ in converted_videos)
+        record_synced_updates(state_store, updates)
+
+    def _drain_spool(self, handler, state_store):
+        """
+        Push what is spooled for as long as the target's circuit breaker allows, recording the principals of what
+        was pushed. A failure opens the breaker, leaving the rest spooled until it lets another attempt through.
+        """
+
+        while self._circuit_breaker.allows_attempt():
+            converted_videos, position = self._spool.read(SPOOL_DRAIN_VIDEOS)
+            if not converted_videos:
+                return
+
+            try:
+                if not handler.initialized:
+                    handler.initialize()
+                sync_converted_videos(handler, self.config, [converted_video[:2] for converted_video in converted_videos])
+                handler.flush()
+            except Exception as ex:  # pylint: disable=broad-except
+                self._circuit_breaker.record_failure(ex)
+                handler.reset()
+                return
+
+            self._spool.acknowledge(position)
+            self._circuit_breaker.record_success()
+            # Records spooled before they carried principals have none to record
+            record_synced_principals(state_store, [
+                (converted_video[0], converted_video[2]) for converted_video in converted_videos
+                if len(converted_video) == 3
+            ])
+
+    def _run(self):
+        """
+        Sync queued pages until finished, then tear down
+        """
+
+        handler = None
 
-def wait(remaining_time):
+        try:
+            # A pass from the beginning of time is a rebuild, which stays in progress across failed passes
+            # until one syncs everything
+            state_store = get_state_store(self.config)
+            if self.last_update_time == MIN_DATETIME and not self.resync:
+                state_store.set(REBUILD_STATE_NAMESPACE, REBUILD_STATE_KEY, True)
+            rebuild = not self.resync and state_store.get(REBUILD_STATE_NAMESPACE, REBUILD_STATE_KEY, default=False)
+
+            handler = TargetHandler(self.config, push_in_full=self.resync)
+
+            # Implementations which declare it safe are only initialized once there is an update to sync,
+            # so polls finding nothing cost nothing on the target. A rebuild always has its cleanup to do.
+            if rebuild or not (handler.lazy_initialization or self._circuit_breaker):
+                handler.initialize()
+            if rebuild:
+                LOG.info('Continuing rebuild of %s', self.config.profile_name)
+                handler.begin_rebuild()
+
+            # What was spooled in earlier passes goes first
+            if self._circuit_breaker and not self._spool.empty:
+                LOG.info('Pushing the updates spooled for %s', self.config.profile_name)
+                self._drain_spool(handler, state_store)
+
+            window = SyncWindow(state_store)
+            finished = False
+            while window or not finished:
+                # Take in the pages fetched so far, waiting for one only when there is nothing else to sync,
+                # and sync the deletes and permission removals among them ahead of everything else
+                while not finished:
+                    try:
+                        item = self._pages.get(block=not window)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        finished = True
+                        continue
+                    page, is_last_page, triggered = item
+                    if triggered:
+                        window.add_triggered_updates(page)
+                    else:
+                        window.add_page([update for update in page if update[1] > self.last_update_time], is_last_page)
+                self._window_size = len(window)
+
+                priority_updates = window.take_priority_updates()
+                if priority_updates:
+                    self._sync_updates(handler, state_store, priority_updates)
+
+                if not window:
+                    continue
+
+                # Then the rest of the first page, writing out anything the target buffered for it, or spooling it,
+                # before moving the watermark past it
+                updates, last_update_time, update_count, is_last_page = window.take_page()
+                self._sync_updates(handler, state_store, updates)
+                if last_update_time:
+                    self.last_update_time = last_update_time
+                    self.update_count += update_count
+                self._window_size = len(window)
+
+                # Everything fetched may still be waiting in the spool for the target to recover
+                if is_last_page and self._circuit_breaker and not self._spool.empty:
+                    LOG.warning('Fetched everything for %s; the rest of the updates are spooled until it recovers',
+                                self.config.profile_name)
+                elif is_last_page:
+                    LOG.info('Sync complete for %s', self.config.profile_name)
+                    if rebuild:
+                        handler.complete_rebuild()
+                        state_store.delete(REBUILD_STATE_NAMESPACE, REBUILD_STATE_KEY)
+                        LOG.info('Rebuild complete')
+                    self.complete = True
+        except Exception as ex:  # pylint: disable=broad-except
+            log_sync_exception(ex)
+            self.exception = ex
+        finally:
+            if handler:
+                handler.teardown()
+
+
+def wait(remaining_time, triggers=None):
     """
-    Wait the remaining time
+    Wait the remaining time, or until a sync is triggered
+    :returns: t/f whether a sync was triggered
     """
 
     wait_seconds = remaining_time.total_seconds()
@@ -363,7 +1152,10 @@ def wait(remaining_time):
         LOG.warning('Received a negative wait time. Continuing now')
     else:
         LOG.info('Waiting %s until next sync', remaining_time)
+        if triggers:
+            return triggers.wait(wait_seconds)
         time.sleep(wait_seconds)
+    return False
 
 
 ###################################################################################################
@@ -381,18 +1173,40 @@ def main():
     args = parse_args()
     set_logger(args.logging_level, args.log_file)
 
+    LOG.info('*** Connector File Version: %s ***', get_version_number("FileVersion"))
+    LOG.info('*** Connector Product Version: %s ***', get_version_number("ProductVersion"))
+
+    resyncing = args.resync_video_ids or args.since or args.until
+    video_ids = read_video_ids(args.resync_video_ids) if args.resync_video_ids else None
+
+    if args.profiles_directory:
+        configs = load_profile_configs(args.profiles_directory)
+        if args.reconcile:
+            sys.exit(0 if all([reconcile(config) for config in configs]) else 1)
+        if resyncing:
+            results = [resync(config, video_ids, args.since, args.until) for config in configs]
+            sys.exit(0 if all(results) else 1)
+        if args.rebuild:
+            for config in configs:
+                for target_config in config.get_target_configs():
+                    trigger_rebuild(target_config.profile_name)
+        run_daemon(configs, args.workers)
+        return
+
     if args.configuration_file:
         config = ConnectorConfig(args.configuration_file)
     else:
         # If config file wasn't passed in on CLI query for it
         config = prompt_user_configuration_file()
 
-    # Trim extension and folder to generate a unique profile name
-    profile_name = os.path.split(os.path.splitext(config.config_file_path)[0])[1]
-    LOG.info('*** Connector File Version: %s ***', get_version_number("FileVersion"))
-    LOG.info('*** Connector Product Version: %s ***', get_version_number("ProductVersion"))
+    profile_name = config.profile_name
     LOG.info('Starting connector profile %s with configuration \n%s', profile_name, config)
 
+    if args.reconcile:
+        sys.exit(0 if reconcile(config) else 1)
+    if resyncing:
+        sys.exit(0 if resync(config, video_ids, args.since, args.until) else 1)
+
     rebuild = args.rebuild
     # A little bit hacky; if we don't have a CLI arg, assume we are in interactive mode
     # and we should prompt the user whether to trigger a rebuild
@@ -400,13 +1214,14 @@ def main():
 
         # In interactive state, if rebuild was not passed on CLI, check with user
         # as we can't tell if they are running on CLI or double click packaged program
-        profile_name = os.path.split(os.path.splitext(config.config_file_path)[0])[1]
+        profile_name = config.profile_name
         rebuild = prompt_user_rebuild(profile_name)
 
     if rebuild:
-        trigger_rebuild(profile_name)
+        for target_config in config.get_target_configs():
+            trigger_rebuild(target_config.profile_name)
 
-    run(config, profile_name)
+    run(config)
 
 
 def parse_args():
@@ -424,9 +1239,73 @@ def parse_args():
     parser.add_argument('-c', '--configuration-file', required=False, help='Path to a config file')
     parser.add_argument('--rebuild', action='store_true', help='Trigger a rebuild by clearing the state file')
 
+    parser.add_argument('-d', '--profiles-directory', required=False,
+                        help='Run as a daemon syncing every config file in a directory')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='In daemon mode, the most profiles to sync at the same time')
+
+    # Resyncs run once and exit, leaving the last update time where it is
+    parser.add_argument('--resync-video-ids', required=False, metavar='FILE',
+                        help='Resync the video ids listed one per line in a file, or - for stdin, then exit')
+    parser.add_argument('--since', type=parse_cli_time, required=False,
+                        help='Resync the updates since a UTC time, e.g. 2024-01-31T12:00:00, then exit')
+    parser.add_argument('--until', type=parse_cli_time, required=False,
+                        help='Resync the updates until a UTC time, from --since or the beginning, then exit')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='Delete from the target what is no longer in Panopto and sync what it is missing, then exit')
+
     return parser.parse_args()
 
 
+def parse_cli_time(time_str):
+    """
+    Parse a UTC time given on the command line
+    """
+    try:
+        return datetime.fromisoformat(time_str.rstrip('Z'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Expected a time like 2024-01-31T12:00:00, received %s' % time_str) from None
+
+
+def read_video_ids(location):
+    """
+    Read video ids listed one per line in a file, or stdin for -, skipping blank lines and duplicates
+    """
+
+    with (sys.stdin if location == '-' else open(location)) as file_handle:
+        lines = [line.strip() for line in file_handle]
+
+    video_ids = []
+    for line in lines:
+        if not line:
+            continue
+        try:
+            video_ids.append(str(uuid.UUID(line)))
+        except ValueError:
+            LOG.error('Invalid video id %s in %s', line, location)
+            sys.exit(2)
+
+    return list(dict.fromkeys(video_ids))
+
+
+def load_profile_configs(directory):
+    """
+    Load every config file in a directory, skipping any which are not valid
+    """
+
+    configs = []
+    for location in sorted(glob.glob(os.path.join(directory, '*.yaml'))):
+        try:
+            config = ConnectorConfig(location)
+        except InvalidConfiguration as ice:
+            LOG.error('Skipping profile; the YAML was invalid in the configuration file %s: %s', location, ice)
+            continue
+        LOG.info('Loaded connector profile %s with configuration \n%s', config.profile_name, config)
+        configs.append(config)
+
+    return configs
+
+
 def prompt_user_configuration_file():
     """
     Get the profile to use from the user
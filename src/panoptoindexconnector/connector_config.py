@@ -4,6 +4,7 @@ The configuration object for the connector
 
 import io
 import copy
+import os
 from datetime import timedelta
 import ruamel.yaml
 
@@ -28,6 +29,24 @@ class ConnectorConfig:
         """
         return self._str
 
+    def get_target_configs(self):
+        """
+        Get the configs of the targets the profile syncs to: for each of its targets, the profile's own settings
+        with the target's settings over them, or just this config if it declares no targets
+        """
+
+        if not self._yaml_config.get('targets'):
+            return [self]
+
+        target_configs = []
+        for target in self._yaml_config['targets']:
+            target_config = copy.copy(self)
+            target_config._yaml_config = {key: value for key, value in self._yaml_config.items() if key != 'targets'}
+            target_config._yaml_config.update(target)
+            target_configs.append(target_config)
+
+        return target_configs
+
     @staticmethod
     def _get_yaml_config(config_file_path):
         """
@@ -56,15 +75,18 @@ class ConnectorConfig:
         yaml_config = copy.deepcopy(yaml_config)
         yaml = ruamel.yaml.YAML()
 
-        # Obfuscate passwords for printable string
-        for key in yaml_config:
-            if 'credentials' not in key:
-                continue
-            node = yaml_config[key]
-            for node_key in node:
-                # allowlist -- only username and client id should be shown
-                if node_key not in ('username', 'client_id', 'grant_type'):
-                    node[node_key] = '********'
+        # Obfuscate passwords for printable string, including those of each target
+        for node in [yaml_config] + list(yaml_config.get('targets') or []):
+            for key in node:
+                if 'credentials' not in key:
+                    continue
+                for node_key in node[key]:
+                    # allowlist -- only username and client id should be shown
+                    if node_key not in ('username', 'client_id', 'grant_type'):
+                        node[key][node_key] = '********'
+
+        if yaml_config.get('trigger_token'):
+            yaml_config['trigger_token'] = '********'
 
         # Save displayable config
         with io.StringIO() as buffer:
@@ -72,6 +94,40 @@ class ConnectorConfig:
             return buffer.getvalue()
 
     # pylint: disable=missing-docstring
+    @property
+    def audit_interval(self):
+        return timedelta(seconds=self._yaml_config.get('audit_interval_seconds', 3600))
+
+    @property
+    def audit_sample_size(self):
+        # Defaults to no auditing
+        return int(self._yaml_config.get('audit_sample_size', 0))
+
+    @property
+    def batch_size(self):
+        return int(self._yaml_config.get('batch_size', 1))
+
+    @property
+    def batch_max_bytes(self):
+        return self._yaml_config.get('batch_max_bytes', None)
+
+    @property
+    def change_detection(self):
+        # Defaults to on; "false" pushes every update in full
+        return str(self._yaml_config.get('change_detection', True)).lower() != 'false'
+
+    @property
+    def commit_documents(self):
+        return int(self._yaml_config.get('commit_documents', 1000))
+
+    @property
+    def commit_interval(self):
+        return timedelta(seconds=self._yaml_config.get('commit_interval_seconds', 300))
+
+    @property
+    def compressed_body_fields(self):
+        return self._yaml_config.get('compressed_body_fields') or []
+
     @property
     def config_file_path(self):
         return self._config_file_path
@@ -80,10 +136,18 @@ class ConnectorConfig:
     def field_mapping(self):
         return self._yaml_config['field_mapping']
 
+    @property
+    def lookahead_pages(self):
+        return int(self._yaml_config.get('lookahead_pages', 10))
+
     @property
     def panopto_oauth_credentials(self):
         return self._yaml_config['panopto_oauth_credentials']
 
+    @property
+    def panopto_requests_per_second(self):
+        return self._yaml_config.get('panopto_requests_per_second', None)
+
     @property
     def panopto_site_address(self):
         return self._yaml_config['panopto_site_address'].rstrip('/').rstrip('.')
@@ -105,10 +169,30 @@ class ConnectorConfig:
         # ensures that configuration value is parsed correctly
         return str(self._yaml_config.get('panopto_id_provider_is_unified')).lower() == 'true'
 
+    @property
+    def profile_name(self):
+        # Trim extension and folder to generate a unique profile name, and tell apart each target of the profile
+        profile_name = os.path.split(os.path.splitext(self._config_file_path)[0])[1]
+        return profile_name + '.' + self.target_name if self.target_name else profile_name
+
     @property
     def polling_frequency(self):
         return timedelta(seconds=self._yaml_config.get('polling_seconds', 3600))
 
+    @property
+    def polling_busy_updates(self):
+        return int(self._yaml_config.get('polling_busy_updates', 100))
+
+    @property
+    def polling_maximum(self):
+        polling_maximum_seconds = self._yaml_config.get('polling_maximum_seconds', None)
+        return timedelta(seconds=polling_maximum_seconds) if polling_maximum_seconds else self.polling_frequency
+
+    @property
+    def polling_minimum(self):
+        polling_minimum_seconds = self._yaml_config.get('polling_minimum_seconds', None)
+        return timedelta(seconds=polling_minimum_seconds) if polling_minimum_seconds else self.polling_frequency
+
     @property
     def polling_retry_minimum(self):
         return timedelta(seconds=self._yaml_config.get('polling_retry_minimum', 300))
@@ -117,16 +201,50 @@ class ConnectorConfig:
     def principal_allowlist(self):
         return self._yaml_config.get('principal_allowlist', None)
 
+    @property
+    def quota_headroom_reserve(self):
+        return int(self._yaml_config.get('quota_headroom_reserve', 0))
+
+    @property
+    def quota_refresh(self):
+        return timedelta(seconds=self._yaml_config.get('quota_refresh_seconds', 900))
+
+    @property
+    def resolve_workers(self):
+        return int(self._yaml_config.get('resolve_workers', 1))
+
     @property
     def sleep_seconds(self):
         return self._yaml_config.get('sleep_seconds', 1)
 
+    @property
+    def schema_registration_timeout(self):
+        return timedelta(seconds=self._yaml_config.get('schema_registration_timeout_seconds', 3600))
+
+    @property
+    def security_identity_ttl(self):
+        ttl_seconds = self._yaml_config.get('security_identity_ttl_seconds', None)
+        return timedelta(seconds=ttl_seconds) if ttl_seconds is not None else None
+
     @property
     def skip_permissions(self):
         # ensures that this is parsed correctly where interpreted as bool or string
         # since yaml flexible; maybe too flexible in this case :)
         return str(self._yaml_config.get('skip_permissions')).lower() == 'true'
 
+    @property
+    def spool(self):
+        # ensures that configuration value is parsed correctly
+        return str(self._yaml_config.get('spool')).lower() == 'true'
+
+    @property
+    def spool_max_bytes(self):
+        return int(self._yaml_config.get('spool_max_bytes', 1024 * 1024 * 1024))
+
+    @property
+    def spool_retry_seconds(self):
+        return self._yaml_config.get('spool_retry_seconds', 30)
+
     @property
     def target_address(self):
         return self._yaml_config['target_address']
@@ -139,6 +257,22 @@ class ConnectorConfig:
     def target_connection(self):
         return self._yaml_config['target_connection']
 
+    @property
+    def trigger_address(self):
+        return self._yaml_config.get('trigger_address', '127.0.0.1')
+
+    @property
+    def trigger_port(self):
+        return self._yaml_config.get('trigger_port', None)
+
+    @property
+    def trigger_token(self):
+        return self._yaml_config.get('trigger_token', None)
+
+    @property
+    def target_name(self):
+        return self._yaml_config.get('name')
+
     @property
     def target_implementation(self):
         return self._yaml_config['target_implementation']
@@ -13,4 +13,16 @@ class CustomExceptions:
 
     class ConfigurationError(Error):
         """Raised when configuration is not properly set"""
-        pass
\ No newline at end of file
+        pass
+
+    class ConnectionNotReadyError(Error):
+        """Raised when the target connection does not become ready for sync"""
+        pass
+
+    class SyncIncompleteError(Error):
+        """Raised when a target did not sync everything in a pass, e.g. after falling behind other targets"""
+        pass
+
+    class SpoolFullError(Error):
+        """Raised when the spool of a target which is not recovering reaches its size limit"""
+        pass
@@ -33,3 +33,12 @@ def format_headers_secure(headers):
             secure_headers[key] = value[0:2] + '****' + value[-2:]
 
     return secure_headers
+
+
+def get_profile_state_filepath(profile_name):
+    """
+    Gets the state file locatoin for the profile
+    """
+
+    home = os.path.expanduser('~')
+    return os.path.join(home, '.panopto-connector.' + profile_name)
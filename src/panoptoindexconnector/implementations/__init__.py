@@ -7,4 +7,5 @@ import panoptoindexconnector.implementations.coveo_implementation
 import panoptoindexconnector.implementations.debug_implementation
 import panoptoindexconnector.implementations.iterator_implementation
 import panoptoindexconnector.implementations.microsoft_graph_implementation
+import panoptoindexconnector.implementations.opensearch_implementation
 import panoptoindexconnector.implementations.template_implementation  # noqa
@@ -5,6 +5,7 @@ Implement these methods for the connector application
 """
 
 # Standard Library Imports
+from datetime import datetime
 import json
 import logging
 import os
@@ -16,6 +17,15 @@ import requests
 DIR = os.path.dirname(os.path.realpath(__file__))
 LOG = logging.getLogger(__name__)
 
+# Documents and delete ids waiting to be fed in the next batch
+PENDING = {'documents': [], 'deletes': []}
+
+# The ingest session kept open for the sync pass, with what was fed to it since its last commit
+SESSION = {'id': None, 'uncommitted': [], 'uncommitted_count': 0, 'last_commit': datetime.utcnow()}
+
+# Statuses of a session which expired or is no longer known, e.g. after attivio restarted
+SESSION_LOST_STATUS_CODES = (401, 403, 404, 410)
+
 
 #########################################################################
 #
@@ -68,61 +78,104 @@ def push_to_target(target_content, config):
     Implement this method to push converted content to the target
     """
 
-    target_address = config.target_address
-    target_credentials = config.target_credentials
+    document_id = target_content[config.field_mapping['Id']]
 
-    auth = requests.auth.HTTPBasicAuth(target_credentials['username'], target_credentials['password'])
+    # The document replaces any queued delete of it
+    PENDING['deletes'] = [video_id for video_id in PENDING['deletes'] if video_id != document_id]
+    PENDING['documents'].append(target_content)
 
-    # Connect
-    session = _connect_to_attivio(target_address, auth)
+    if len(PENDING['documents']) + len(PENDING['deletes']) >= config.batch_size:
+        feed_pending(config)
 
-    # Do the write
-    url = '{attivio}/rest/ingestApi/feedDocuments/{session}'.format(attivio=target_address, session=session)
-    data = json.dumps(target_content)
-    headers = {'Content-Type': 'application/json'}
 
-    response = requests.post(url=url, auth=auth, data=data, headers=headers)
+def delete_from_target(video_id, config):
+    """
+    Implement this method to push converted content to the target
+    """
 
-    if not response.ok:
-        LOG.error('Failed response: %s, %s', response, response.text)
-    response.raise_for_status()
+    id_field = config.field_mapping['Id']
 
-    # Commit
-    _commit_session_to_attivio(target_address, auth, session)
+    # The delete replaces any queued feed of the document
+    PENDING['documents'] = [document for document in PENDING['documents'] if document[id_field] != video_id]
+    PENDING['deletes'].append(video_id)
 
-    # Close
-    _disconnect_session_in_attivio(target_address, auth, session)
+    if len(PENDING['documents']) + len(PENDING['deletes']) >= config.batch_size:
+        feed_pending(config)
 
 
-def delete_from_target(video_id, config):
+def feed_pending(config):
     """
-    Implement this method to push converted content to the target
+    Feed the queued documents and deletes to the ingest session, committing if enough
+    documents or time have gone by since the last commit
     """
 
-    target_address = config.target_address
-    target_credentials = config.target_credentials
+    if PENDING['deletes']:
+        _send_session_request(config, 'delete', PENDING['deletes'])
+        SESSION['uncommitted'].append(('delete', PENDING['deletes']))
+    if PENDING['documents']:
+        _send_session_request(config, 'feedDocuments', PENDING['documents'])
+        SESSION['uncommitted'].append(('feedDocuments', PENDING['documents']))
 
-    auth = requests.auth.HTTPBasicAuth(target_credentials['username'], target_credentials['password'])
+    SESSION['uncommitted_count'] += len(PENDING['documents']) + len(PENDING['deletes'])
+    _clear_pending()
 
-    # Connect
-    session = _connect_to_attivio(target_address, auth)
+    if SESSION['uncommitted_count'] >= config.commit_documents \
+            or datetime.utcnow() - SESSION['last_commit'] >= config.commit_interval:
+        commit(config)
 
-    # Do the deletion
-    url = '{attivio}/rest/ingestApi/delete/{session}'.format(attivio=target_address, session=session)
-    data = json.dumps([video_id])
-    headers = {'Content-Type': 'application/json'}
 
-    response = requests.post(url=url, auth=auth, data=data, headers=headers)
+def commit(config):
+    """
+    Commit everything fed to the ingest session so far
+    """
 
-    if not response.ok:
-        LOG.error('Failed response: %s, %s', response, response.text)
-    response.raise_for_status()
+    if not SESSION['uncommitted']:
+        return
+
+    _send_session_request(config, 'commit')
+
+    LOG.info('Committed %i documents and deletes to attivio', SESSION['uncommitted_count'])
+    SESSION['uncommitted'] = []
+    SESSION['uncommitted_count'] = 0
+    SESSION['last_commit'] = datetime.utcnow()
 
-    # Commit
-    _commit_session_to_attivio(target_address, auth, session)
 
-    # Close
-    _disconnect_session_in_attivio(target_address, auth, session)
+def flush(config):
+    """
+    Feed and commit everything queued, so it is in the index before the connector records progress past it
+    """
+    feed_pending(config)
+    commit(config)
+
+
+#
+# Initialize and teardown steps here keep one ingest session open for a sync pass
+#
+
+def initialize(config):
+    """
+    Connect the ingest session for the sync pass
+    """
+    # Drop anything left queued by a failed sync attempt; it will be synced again
+    _clear_pending()
+    _connect_session(config)
+
+
+def teardown(config):
+    """
+    Disconnect the ingest session; anything not flushed is synced again by the next pass
+    """
+    _clear_pending()
+
+    session = SESSION['id']
+    SESSION.update(id=None, uncommitted=[], uncommitted_count=0)
+    if session is None:
+        return
+
+    try:
+        _disconnect_session_in_attivio(config.target_address, _get_auth(config), session)
+    except requests.exceptions.RequestException:
+        LOG.warning('Failed to disconnect attivio session %s', session, exc_info=True)
 
 
 #########################################################################
@@ -132,23 +185,85 @@ def delete_from_target(video_id, config):
 #########################################################################
 
 
-def _connect_to_attivio(target_address, auth):
+def _clear_pending():
     """
-    Connecto to attivio and return session id
+    Empty the queues of documents and deletes waiting for the next batch
     """
-    url = '{attivio}/rest/ingestApi/connect'.format(attivio=target_address)
-    response = requests.get(url=url, auth=auth)
+    PENDING['documents'] = []
+    PENDING['deletes'] = []
+
+
+def _connect_session(config):
+    """
+    Connect a new ingest session, feeding it again anything fed to a lost session and not committed
+    """
+    SESSION['id'] = _connect_to_attivio(config.target_address, _get_auth(config))
+    SESSION['last_commit'] = datetime.utcnow()
+    LOG.info('Connected attivio session %s', SESSION['id'])
+
+    for operation, data in SESSION['uncommitted']:
+        _post_to_session(config, operation, data).raise_for_status()
+
+
+def _get_auth(config):
+    """
+    Basic auth for the target credentials
+    """
+    target_credentials = config.target_credentials
+    return requests.auth.HTTPBasicAuth(target_credentials['username'], target_credentials['password'])
+
+
+def _is_session_lost(response):
+    """
+    T/f whether a failed response says the session is no longer known to attivio, or no longer authorized
+    """
+    return response.status_code in SESSION_LOST_STATUS_CODES
+
+
+def _post_to_session(config, operation, data=None):
+    """
+    Send an ingest api operation to the open session
+    """
+    url = '{attivio}/rest/ingestApi/{operation}/{session}'.format(
+        attivio=config.target_address, operation=operation, session=SESSION['id'])
+    auth = _get_auth(config)
+
+    if data is None:
+        return requests.get(url=url, auth=auth)
+
+    headers = {'Content-Type': 'application/json'}
+    return requests.post(url=url, auth=auth, data=json.dumps(data), headers=headers)
+
+
+def _send_session_request(config, operation, data=None):
+    """
+    Send an ingest api operation, connecting a session first if there is none
+    and reconnecting once if attivio lost the session
+    """
+    if SESSION['id'] is None:
+        _connect_session(config)
+
+    response = _post_to_session(config, operation, data)
+
+    if not response.ok and _is_session_lost(response):
+        LOG.warning('Lost attivio session %s, reconnecting: %s', SESSION['id'], response.text)
+        _connect_session(config)
+        response = _post_to_session(config, operation, data)
+
+    if not response.ok:
+        LOG.error('Failed response: %s, %s', response, response.text)
     response.raise_for_status()
-    return response.json()
+    return response
 
 
-def _commit_session_to_attivio(target_address, auth, session):
+def _connect_to_attivio(target_address, auth):
     """
-    Commit the changes in a session to attivio
+    Connecto to attivio and return session id
     """
-    url = '{attivio}/rest/ingestApi/commit/{session}'.format(attivio=target_address, session=session)
+    url = '{attivio}/rest/ingestApi/connect'.format(attivio=target_address)
     response = requests.get(url=url, auth=auth)
     response.raise_for_status()
+    return response.json()
 
 
 def _disconnect_session_in_attivio(target_address, auth, session):
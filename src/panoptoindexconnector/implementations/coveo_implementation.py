@@ -5,20 +5,40 @@ Start with this template to implement these methods for the connector applicatio
 """
 
 # Standard Library Imports
+import base64
 import json
 import logging
 import os
+import threading
+import time
+import zlib
 
 # Third party
 import requests
 
 # Home rolled
 from panoptoindexconnector.helpers import format_request_secure
+from panoptoindexconnector.state_store import get_state_store
 
 # Global constants
 DIR = os.path.dirname(os.path.realpath(__file__))
 LOG = logging.getLogger(__name__)
 
+# Coveo file containers hold at most 256 MB
+COVEO_FILE_CONTAINER_MAX_BYTES = 256 * 1024 * 1024
+
+# Documents waiting to be sent or deleted in the next batch, with the size in bytes of each document's entry and in total
+PENDING_BATCH = {'addOrUpdate': [], 'delete': [], 'sizes': {}, 'size': 0}
+
+# Security identities waiting to be registered with the next batch, by identity type and name
+PENDING_SECURITY_IDENTITIES = {}
+
+# Ordering ids handed out must only ever increase, including between threads
+ORDERING_ID_LOCK = threading.Lock()
+
+# Only set the push source status when a sync pass has updates to push
+LAZY_INITIALIZATION = True
+
 
 #########################################################################
 #
@@ -81,6 +101,8 @@ def convert_to_target(panopto_content, config):
     for key, target_field in field_mapping['Metadata'].items():
         if panopto_content['VideoContent'][key]:
             target_content[target_field] = panopto_content['VideoContent'][key]
+    if config.compressed_body_fields:
+        set_compressed_body(target_content, panopto_content, config)
 
     # Principals
     if not config.skip_permissions:
@@ -110,6 +132,24 @@ def convert_to_target(panopto_content, config):
     return target_content
 
 
+def set_compressed_body(target_content, panopto_content, config):
+    """
+    Move the content fields configured as the body into the document's compressed binary data,
+    which coveo indexes as the text of the document
+    """
+    texts = []
+    for key in config.compressed_body_fields:
+        target_content.pop(config.field_mapping['Metadata'].get(key), None)
+        if panopto_content['VideoContent'].get(key):
+            texts.append(panopto_content['VideoContent'][key])
+
+    if texts:
+        data = zlib.compress('\n\n'.join(texts).encode('utf-8'))
+        target_content['compressedBinaryData'] = base64.b64encode(data).decode('ascii')
+        target_content['compressionType'] = 'ZLIB'
+        target_content['fileExtension'] = '.txt'
+
+
 def push_to_target(target_content, config):
     """
     Implement this method to push converted content to the target
@@ -124,10 +164,88 @@ def push_content_data(target_content, config):
     Push the actual content
     """
     field_mapping = config.field_mapping
+    video_id = target_content[field_mapping['Id']]
+    document_id = target_content[field_mapping['Info']['Url']]
+
+    # A video pushed before under the other url form would otherwise be left behind as a second document
+    previous_document_id = get_state_store(config).get(_get_document_namespace(config), video_id)
+    if previous_document_id and previous_document_id != document_id:
+        delete_document(previous_document_id, config)
 
-    url = '{coveourl}/push/v1/organizations/{org}/sources/{source}/documents?documentId=%s' % (
-        target_content[field_mapping['Info']['Url']])
+    if config.batch_size > 1:
+        queue_content_data(target_content, config)
+        return
+
+    url = '{coveourl}/push/v1/organizations/{org}/sources/{source}/documents?documentId=%s&orderingId=%i' % (
+        document_id, _next_ordering_id(config))
     _ = _send_coveo_request(config, url, 'put', json=target_content)
+    record_document_id(config, video_id, document_id)
+
+
+def queue_content_data(target_content, config):
+    """
+    Queue the content for the next batch, sending the batch first if the content would not fit its file container
+    and after if the batch is full
+    """
+    document = dict(target_content, documentId=target_content[config.field_mapping['Info']['Url']])
+
+    _queue_batch_entry('addOrUpdate', document, config)
+
+
+def queue_document_delete(document_id, config):
+    """
+    Queue the delete of a document for the next batch
+    """
+    _queue_batch_entry('delete', {'documentId': document_id}, config)
+
+
+def _queue_batch_entry(operation, entry, config):
+    """
+    Queue an entry under an operation of the next batch in place of any queued entry of the same document,
+    sending the batch first if the entry would not fit its file container and after if the batch is full
+    """
+    document_id = entry['documentId']
+    for queued_operation in ('addOrUpdate', 'delete'):
+        PENDING_BATCH[queued_operation] = [
+            queued_entry for queued_entry in PENDING_BATCH[queued_operation] if queued_entry['documentId'] != document_id]
+    PENDING_BATCH['size'] -= PENDING_BATCH['sizes'].pop(document_id, 0)
+
+    entry_size = len(json.dumps(entry).encode('utf-8')) + 1
+
+    if _get_pending_batch_count() and PENDING_BATCH['size'] + entry_size > _get_batch_max_bytes(config):
+        flush(config)
+
+    PENDING_BATCH[operation].append(entry)
+    PENDING_BATCH['sizes'][document_id] = entry_size
+    PENDING_BATCH['size'] += entry_size
+
+    if _get_pending_batch_count() >= config.batch_size:
+        flush(config)
+
+
+def flush(config):
+    """
+    Send the queued documents and deletes as one batch through a file container,
+    after registering the security identities they use
+    """
+    push_security_mappings_batch(config)
+
+    if not _get_pending_batch_count():
+        return
+
+    body = {'addOrUpdate': PENDING_BATCH['addOrUpdate'], 'delete': PENDING_BATCH['delete']}
+    _clear_pending_batch()
+
+    file_id = _upload_to_file_container(config, body)
+
+    url = '{coveourl}/push/v1/organizations/{org}/sources/{source}/documents/batch?fileId=%s&orderingId=%i' % (
+        file_id, _next_ordering_id(config))
+    _ = _send_coveo_request(config, url, 'put')
+
+    for document in body['addOrUpdate']:
+        record_document_id(config, document[config.field_mapping['Id']], document['documentId'])
+
+    LOG.info('Pushed batch of %i documents and %i deletes', len(body['addOrUpdate']), len(body['delete']))
 
 
 def push_needed_security_mappings(target_content, config):
@@ -141,12 +259,45 @@ def push_needed_security_mappings(target_content, config):
     if principal.get('allowAnonymous', False):
         return
     allow_permissions = principal['allowedPermissions']
-    needed_permissions = [p for p in allow_permissions if should_map_security(p['identity'])]
+    needed_permissions = [p for p in allow_permissions if should_map_security(config, p)]
+    if config.batch_size > 1:
+        queue_security_mappings(needed_permissions)
+        return
     if needed_permissions:
         ensure_each_security_mapping(target_content, config, needed_permissions)
     LOG.info('Pushed %i new security identities', len(needed_permissions))
 
 
+def queue_security_mappings(needed_permissions):
+    """
+    Queue identities to be registered with the next batch, once each however many documents use them
+    """
+    for permission in needed_permissions:
+        PENDING_SECURITY_IDENTITIES[(permission['identityType'], permission['identity'])] = permission
+
+
+def push_security_mappings_batch(config):
+    """
+    Register all queued identities with the security provider through one file container
+    """
+    if not PENDING_SECURITY_IDENTITIES:
+        return
+
+    permissions = list(PENDING_SECURITY_IDENTITIES.values())
+    PENDING_SECURITY_IDENTITIES.clear()
+
+    file_id = _upload_to_file_container(config, permissions_to_batch_body(permissions))
+
+    provider_id = config.target_credentials.get('security_provider')
+    url = '{coveourl}/push/v1/organizations/{org}/providers/%s/permissions/batch?fileId=%s' % (provider_id, file_id)
+    _ = _send_coveo_request(config, url, 'put')
+
+    for permission in permissions:
+        record_security_mapping(config, permission)
+
+    LOG.info('Pushed batch of %i new security identities', len(permissions))
+
+
 def ensure_each_security_mapping(target_content, config, needed_permissions):
     """
     1 x 1
@@ -163,6 +314,7 @@ def ensure_each_security_mapping(target_content, config, needed_permissions):
         }
         uri = '{coveourl}/push/v1/organizations/{org}/providers/%s/permissions' % provider_id
         _send_coveo_request(config, uri, 'put', json=body)
+        record_security_mapping(config, permission)
 
 
 def delete_from_target(video_id, config):
@@ -170,12 +322,24 @@ def delete_from_target(video_id, config):
     Implement this method to push converted content to the target
     """
 
-    for idtype in ['id', 'pid']:
-        video_url = '{site}/Panopto/Pages/Viewer.aspx?{idtype}={id}'.format(
-            site=config.panopto_site_address, idtype=idtype, id=video_id)
-        url = '{coveourl}/push/v1/organizations/{org}/sources/{source}/documents?documentId=' + \
-            video_url
-        _ = _send_coveo_request(config, url, 'delete')
+    # Even during a rebuild: its cleanup only removes documents older than the rebuild, not those it pushed since
+    for document_id in _get_document_ids(config, video_id):
+        delete_document(document_id, config)
+
+    get_state_store(config).delete(_get_document_namespace(config), video_id)
+
+
+def delete_document(document_id, config):
+    """
+    Delete a document by its id, in the next batch when batching
+    """
+    if config.batch_size > 1:
+        queue_document_delete(document_id, config)
+        return
+
+    url = '{coveourl}/push/v1/organizations/{org}/sources/{source}/documents?documentId=%s&orderingId=%i' % (
+        document_id, _next_ordering_id(config))
+    _ = _send_coveo_request(config, url, 'delete')
 
 
 #
@@ -186,6 +350,9 @@ def initialize(config):
     """
     Set the coveo push source status
     """
+    # Drop anything left queued by a failed sync attempt; it will be synced again
+    _clear_pending_batch()
+
     _set_status('INCREMENTAL', config)
 
 
@@ -196,6 +363,34 @@ def teardown(config):
     _set_status('IDLE', config)
 
 
+def begin_rebuild(config):
+    """
+    Set the coveo push source status for a rebuild, remembering the ordering id it started from
+    so a rebuild resumed after a failed pass still cleans up everything older
+    """
+    if _get_rebuild_ordering_id(config) is None:
+        get_state_store(config).set(_get_ordering_namespace(config), 'rebuild', _next_ordering_id(config))
+
+    _set_status('REBUILD', config)
+
+
+def complete_rebuild(config):
+    """
+    Delete every document the rebuild did not push again, i.e. those older than the rebuild's first ordering id
+    """
+    flush(config)
+
+    ordering_id = _get_rebuild_ordering_id(config)
+    if ordering_id is None:
+        return
+
+    url = '{coveourl}/push/v1/organizations/{org}/sources/{source}/documents/olderthan?orderingId=%i' % ordering_id
+    _ = _send_coveo_request(config, url, 'delete')
+
+    get_state_store(config).delete(_get_ordering_namespace(config), 'rebuild')
+    LOG.info('Deleted documents older than the rebuild, ordering id %i', ordering_id)
+
+
 ##############################################
 #
 # Helpers
@@ -236,25 +431,129 @@ def _send_coveo_request(config, url_format, requesttype, additional_headers=None
     return response
 
 
-SECURITY_IDS_MAPPED_TO_PROVIDER = set()
-"""
-Keeps a record of users pushed to the provider;
-just a per process lifespan to get unblocked.
-"""
+def _get_security_mapping_key(config, permission):
+    """
+    The state store namespace and key recording that an identity was pushed to the security provider
+    """
+    namespace = 'coveo:identities:%s' % config.target_credentials.get('security_provider')
+    return namespace, '%s:%s' % (permission['identityType'].upper(), permission['identity'])
+
+
+def record_security_mapping(config, permission):
+    """
+    Keeps a record of identities pushed to the provider in the local state store, so they persist across restarts
+    """
+    get_state_store(config).set(*_get_security_mapping_key(config, permission), True)
+
+
+def should_map_security(config, permission):
+    """
+    T/f whether the identity needs to be pushed to the provider; it does if it was never pushed,
+    or if it was pushed longer than the security identity ttl ago and should be asserted again
+    """
+    ttl = config.security_identity_ttl
+    max_age = ttl.total_seconds() if ttl is not None else None
+    return not get_state_store(config).get(*_get_security_mapping_key(config, permission), max_age=max_age)
+
+
+def _get_document_namespace(config):
+    """
+    The state store namespace recording the document id each video was pushed to the source under
+    """
+    return 'coveo:documents:%s' % config.target_credentials['source']
+
+
+def _get_document_ids(config, video_id):
+    """
+    The ids a video's document may have in the source: the one it was last pushed under,
+    or both forms of its viewer url if it was pushed before those were recorded
+    """
+    document_id = get_state_store(config).get(_get_document_namespace(config), video_id)
+    if document_id:
+        return [document_id]
+
+    return [
+        '{site}/Panopto/Pages/Viewer.aspx?{idtype}={id}'.format(
+            site=config.panopto_site_address, idtype=idtype, id=video_id)
+        for idtype in ['id', 'pid']
+    ]
+
+
+def record_document_id(config, video_id, document_id):
+    """
+    Keeps a record of the document id the video was pushed under in the local state store, so deletes hit only it
+    """
+    get_state_store(config).set(_get_document_namespace(config), video_id, document_id)
+
+
+def _get_ordering_namespace(config):
+    """
+    The state store namespace for the ordering ids of the push source
+    """
+    return 'coveo:ordering:%s' % config.target_credentials['source']
+
+
+def _get_rebuild_ordering_id(config):
+    """
+    The ordering id the rebuild in progress started from, or None if there is no rebuild in progress
+    """
+    return get_state_store(config).get(_get_ordering_namespace(config), 'rebuild')
+
+
+def _next_ordering_id(config):
+    """
+    Get the next ordering id for the source: the current time in milliseconds,
+    bumped past the last one handed out so they always increase, even across restarts or a clock set back
+    """
+    namespace = _get_ordering_namespace(config)
+    state_store = get_state_store(config)
 
+    with ORDERING_ID_LOCK:
+        ordering_id = max(int(time.time() * 1000), state_store.get(namespace, 'last', default=0) + 1)
+        state_store.set(namespace, 'last', ordering_id)
 
-def record_security_mapping(key):
+    return ordering_id
+
+
+def _clear_pending_batch():
     """
-    Just cheap way to ensure we've defined the mappings
+    Empty the queues of documents and identities waiting for the next batch
     """
-    SECURITY_IDS_MAPPED_TO_PROVIDER.add(key)
+    PENDING_BATCH['addOrUpdate'] = []
+    PENDING_BATCH['delete'] = []
+    PENDING_BATCH['sizes'] = {}
+    PENDING_BATCH['size'] = 0
+    PENDING_SECURITY_IDENTITIES.clear()
 
 
-def should_map_security(key):
+def _get_pending_batch_count():
     """
-    T/f whether the user needs to be mapped
+    The number of documents and deletes waiting for the next batch
     """
-    return key not in SECURITY_IDS_MAPPED_TO_PROVIDER
+    return len(PENDING_BATCH['addOrUpdate']) + len(PENDING_BATCH['delete'])
+
+
+def _get_batch_max_bytes(config):
+    """
+    The most a batch may hold, capped at the file container limit
+    """
+    return min(config.batch_max_bytes or COVEO_FILE_CONTAINER_MAX_BYTES, COVEO_FILE_CONTAINER_MAX_BYTES)
+
+
+def _upload_to_file_container(config, body):
+    """
+    Create a file container, upload the json body to it and return its file id
+    """
+    url = '{coveourl}/push/v1/organizations/{org}/files'
+    file_container = _send_coveo_request(config, url, 'post').json()
+
+    # The upload goes to the container's own storage, which only accepts the headers it requires
+    _ = _send_coveo_request(
+        config, file_container['uploadUri'], 'put',
+        additional_headers=file_container['requiredHeaders'], skip_default_headers=True,
+        data=json.dumps(body).encode('utf-8'))
+
+    return file_container['fileId']
 
 
 def _get_default_headers(api_key):
@@ -269,37 +568,19 @@ def _get_default_headers(api_key):
 
 def permissions_to_batch_body(permissions):
     """
-    Maps a coveo allow permission to a coveo security identity
+    Maps coveo allow permissions to a security identity batch body,
+    with the same identities ensure_each_security_mapping registers one by one
     """
-    members, mappings = [], []
-    for permission in permissions:
-        if permission['identityType'].lower() == 'group':
-            members.append({
-                'name': permission['identity'],
-                'type': 'GROUP',  # UPPER strict here
-                'members': [],
-                'wellKnowns': [],
-            })
-        if permission['identityType'].lower() == 'user':
-            mappings.append({
-                'identity': {
-                    'name': permission['identity'],
-                    'type': 'USER',  # UPPER strict here
-                },
-                'mappings': [{
-                    'name': permission['identity'],
-                    'type': 'USER',
-                    'provider': 'Email Security Provider'
-                }],
-                'wellKnowns': []
-            })
-            members.append({
+    members = [
+        {
+            'identity': {
                 'name': permission['identity'],
-                'type': 'USER',  # UPPER strict here
-            })
-        else:
-            LOG.warning('Permission %s could not be mapped to an identity', permission)
-    return {'members': members, 'mappings': mappings, 'delete': []}
+                'type': permission['identityType'].upper(),  # UPPER strict here
+            },
+        }
+        for permission in permissions
+    ]
+    return {'members': members, 'mappings': [], 'deleted': []}
 
 
 def _set_status(status, config):
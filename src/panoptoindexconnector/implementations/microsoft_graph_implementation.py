@@ -3,12 +3,17 @@ Methods for the connector application to convert and sync content to the target
 
 Implement these methods for the connector application
 """
+# pylint: disable=too-many-lines
 
 # Standard Library Imports
+from collections import namedtuple
+import hashlib
 import json
 import logging
 import os
+import threading
 import time
+from urllib.parse import quote, urlsplit
 
 # Third party
 import requests
@@ -17,12 +22,12 @@ import msal
 # Local
 from panoptoindexconnector.custom_exceptions import CustomExceptions
 from panoptoindexconnector.enums import UserGroupMapping, UsernameMapping
+from panoptoindexconnector.state_store import get_state_store
 
 # Global constants
 DIR = os.path.dirname(os.path.realpath(__file__))
 LOG = logging.getLogger(__name__)
 APP_TEMP_DIR = str.lower(DIR).replace("panoptoindexconnector\implementations", "")
-TOKEN_CACHE = os.path.join(APP_TEMP_DIR, 'token_cache.bin')
 
 # Stored users to prevent unnecessary API calls to get id
 USERS = {}
@@ -30,6 +35,45 @@ USERS = {}
 # Stored user groups to prevent unnecessary API calls to get id
 USER_GROUPS = {}
 
+# Microsoft Graph JSON batching accepts at most 20 requests per batch
+GRAPH_BATCH_LIMIT = 20
+
+# Number of times throttled requests within a batch are resent before giving up
+GRAPH_BATCH_MAX_RETRIES = 5
+
+# Item PUT and DELETE requests waiting to be sent in the next JSON batch
+PENDING_BATCH_REQUESTS = []
+PENDING_BATCH_REQUESTS_LOCK = threading.RLock()
+
+# Ids of items the target rejected since the last flush
+FAILED_CONTENT_IDS = set()
+
+# Status codes of throttled requests within a batch
+GRAPH_BATCH_THROTTLED_STATUS_CODES = (429, 503, 504)
+
+# Serializes access to the profile's token cache file across resolve workers
+TOKEN_CACHE_LOCK = threading.Lock()
+
+# Key of the users and user groups of converted content that still need to be resolved against the directory
+UNRESOLVED_PRINCIPALS = "unresolvedPrincipals"
+
+# Principals of a video classified and deduplicated in a single pass by normalize_principals
+NormalizedPrincipals = namedtuple(
+    "NormalizedPrincipals", ["has_public_or_all_users", "usernames", "user_group_identifiers"])
+
+# State store namespace for values of this implementation
+STATE_NAMESPACE = "microsoft_graph"
+
+# Schema registration operation polling starts at 3 seconds and backs off up to a minute between checks
+SCHEMA_OPERATION_POLL_SECONDS = 3
+SCHEMA_OPERATION_MAX_POLL_SECONDS = 60
+
+# Most items deferred for lack of quota read from the local state store at a time
+DEFERRED_ITEMS_PAGE_SIZE = 100
+
+# Hash of the schema file, kept with the modification time it was read at so it is only read again once changed
+SCHEMA_HASH = {"mtime": None, "hash": None}
+
 #########################################################################
 #
 # Exported methods to implement
@@ -39,7 +83,8 @@ USER_GROUPS = {}
 
 def convert_to_target(panopto_content, config):
     """
-    Convert Panopto content to target format
+    Convert Panopto content to target format.
+    This makes no requests; users and user groups are resolved against the directory by resolve_to_target.
     """
 
     field_mapping = config.field_mapping
@@ -52,31 +97,71 @@ def convert_to_target(panopto_content, config):
     set_properties(field_mapping, panopto_content, target_content)
 
     # Set acl (account controll list)
-    principals_are_set = set_principals(config, panopto_content, target_content)
-
-    # If none of principals are set to content
-    #   1. If content is already synced, remove it from target since nobody should be able to get it in search result
-    #   2. Set skip_sync property to skip pushing content to target
-    if not principals_are_set:
-        delete_content_from_target_if_exists(target_content, config)
-        target_content["skip_sync"] = True
+    set_principals(config, panopto_content, target_content)
 
     LOG.debug('Converted document is %s', json.dumps(target_content, indent=2))
 
     return target_content
 
 
+def resolve_to_target(target_contents, config):
+    """
+    Resolve converted content against the target before it is pushed.
+    Looks up the directory ids of user and user group principals, then handles content without any applied principals.
+    """
+
+    usernames, user_group_identifiers = set(), set()
+    for target_content in target_contents:
+        unresolved_principals = target_content.get(UNRESOLVED_PRINCIPALS)
+        if unresolved_principals:
+            usernames.update(unresolved_principals["users"])
+            user_group_identifiers.update(unresolved_principals["user_groups"])
+
+    # Look up everything not yet cached at once, so lookups can be batched
+    resolve_directory_ids(config, "users", usernames)
+    resolve_directory_ids(config, "groups", user_group_identifiers)
+
+    for target_content in target_contents:
+        unresolved_principals = target_content.pop(UNRESOLVED_PRINCIPALS, None)
+        if unresolved_principals:
+            set_principals_to_user(unresolved_principals["users"], target_content)
+            set_principals_to_user_group(unresolved_principals["user_groups"], target_content)
+
+        # If none of principals are set to content
+        #   1. If content is already synced, remove it from target since nobody should be able to get it in search result
+        #   2. Set skip_sync property to skip pushing content to target
+        if not target_content.get("acl") and not target_content.get("skip_sync"):
+            LOG.warn("Content will be skipped to push to target since none of principals have applied!")
+            delete_content_from_target_if_exists(target_content, config)
+            target_content["skip_sync"] = True
+
+
 def push_to_target(target_content, config):
     """
     Push converted Panopto content to the target
     """
 
+    # Content converted but not resolved yet, e.g. when synced outside of a sync pass
+    if UNRESOLVED_PRINCIPALS in target_content or not target_content.get("acl"):
+        resolve_to_target([target_content], config)
+
     if target_content.get("skip_sync"):
         LOG.warn("Content has been skipped for sync to target!")
         return
 
     content_id = target_content.get("id")
 
+    # Items which are not in the connection yet count against the tenant quota, so they are only
+    # admitted while there is quota headroom left; the rest are deferred until quota is freed
+    if is_item_in_target(config, content_id) is not True and not admit_new_item(config):
+        defer_item(config, target_content)
+        return
+
+    # Queue the item for the next JSON batch if batching is enabled
+    if config.batch_size > 1:
+        queue_batch_request(config, "PUT", content_id, target_content)
+        return
+
     LOG.info("Pushing content (%s) to target...", content_id)
 
     # Get token
@@ -95,20 +180,8 @@ def push_to_target(target_content, config):
 
     response = requests.put(url, headers=headers, json=target_content)
 
-    if response.status_code == 200:
-        LOG.info(f"Content ({content_id}) has been pushed to target!")
-    # If request is forbidden
-    elif response.status_code == 403:
-        error = response.json()["error"]
-
-        if error and error.get("innerError"):
-            innerError = error.get("innerError")
-            if innerError.get('code') == "TenantQuotaExceeded":
-                raise CustomExceptions.QuotaLimitExceededError(innerError.get("message"))
-
-        log_error_for_not_pushed_content(content_id, target_content, response.text)
-    else:
-        log_error_for_not_pushed_content(content_id, target_content, response.text)
+    handle_push_response(
+        config, content_id, target_content, response.status_code, get_response_json(response), response.text)
 
 
 def delete_from_target(content_id, config):
@@ -116,6 +189,14 @@ def delete_from_target(content_id, config):
     Delete Panopto content from the target
     """
 
+    # A deferred push of the content is obsolete once it is deleted
+    get_state_store(config).delete(get_deferred_items_namespace(config), content_id)
+
+    # Queue the item for the next JSON batch if batching is enabled
+    if config.batch_size > 1:
+        queue_batch_request(config, "DELETE", content_id)
+        return
+
     LOG.info(f"Deleting content from target by id: {content_id}...")
 
     # Get token
@@ -132,10 +213,43 @@ def delete_from_target(content_id, config):
 
     response = requests.delete(url, headers=headers)
 
-    if response.status_code == 200:
-        LOG.info(f"Content ({content_id}) has been deleted from target!")
-    elif response.status_code == 404:
-        LOG.info(f"Content ({content_id}) not found to be delete from target!")
+    handle_delete_response(config, content_id, response.status_code, response.text)
+
+
+def flush(config):
+    """
+    Send all queued item requests to the target as JSON batches
+    Returns: Ids of items the target rejected since the last flush, so they are not recorded as synced
+    """
+
+    with PENDING_BATCH_REQUESTS_LOCK:
+        batch = list(PENDING_BATCH_REQUESTS)
+        PENDING_BATCH_REQUESTS.clear()
+
+        if batch:
+            send_batch(config, batch)
+
+        failed_content_ids = sorted(FAILED_CONTENT_IDS)
+        FAILED_CONTENT_IDS.clear()
+
+    return failed_content_ids
+
+
+def get_from_target(content_id, config):
+    """
+    Get the item the connection holds for a video, without the annotations Graph adds, or None if it is not there
+    """
+
+    content_from_target = get_content_from_target(content_id, config)
+    if content_from_target is None:
+        return None
+
+    content_from_target = {key: value for key, value in content_from_target.items() if not key.startswith("@odata")}
+    if isinstance(content_from_target.get("properties"), dict):
+        content_from_target["properties"] = {
+            key: value for key, value in content_from_target["properties"].items() if "@odata" not in key
+        }
+    return content_from_target
 
 
 #
@@ -154,11 +268,19 @@ def initialize(config):
         # Clear user groups list before each sync attempt to keep up to date AAD user groups info
         USER_GROUPS.clear()
 
+        # Drop any requests left queued by a failed sync attempt; they will be synced again
+        PENDING_BATCH_REQUESTS.clear()
+        FAILED_CONTENT_IDS.clear()
+
         # Validate microsoft_graph.yaml configuration file
         validate_configuration(config)
 
-        # Ensure connection for sync
-        ensure_connection_availability(config)
+        # Ensure connection for sync, unless it was already verified with the current schema
+        ensure_connection_availability_if_changed(config)
+
+        # Check how many items the connection can still take, and retry items deferred for lack of quota
+        refresh_connection_quota(config)
+        push_deferred_items(config)
     except (CustomExceptions.ConfigurationError, CustomExceptions.QuotaLimitExceededError):
         # No need to log here since it will be logged in caller method ("run" method)
         raise
@@ -172,8 +294,9 @@ def teardown(config):
     Delete token cache file
     """
 
-    if os.path.exists(TOKEN_CACHE):
-        os.remove(TOKEN_CACHE)
+    with TOKEN_CACHE_LOCK:
+        if os.path.exists(get_token_cache_path(config)):
+            os.remove(get_token_cache_path(config))
 
 
 #########################################################################
@@ -220,127 +343,62 @@ def set_properties(field_mapping, panopto_content, target_content):
 def set_principals(config, panopto_content, target_content):
     """
     Set principals - Everyone (in tenant), User or Group.
-    Returns: True if any of principals are set, otherwise False
+    Users and user groups are set as unresolved principals until resolve_to_target looks up their directory ids.
     """
 
-    principals_are_set = False
-
-    set_public_or_all_users_principals = has_public_or_all_users_principals(panopto_content)
-    set_user_principals = has_user_principals(config, panopto_content)
-    set_user_group_principals = has_user_group_principals(config, panopto_content)
-
-    if not config.skip_permissions:
-        # Set public or all users grant principals if exist
-        if set_public_or_all_users_principals:
-            set_principals_to_all(config, target_content)
-        # Set user and/or user group grant principals if exist
-        elif set_user_principals or set_user_group_principals:
-            target_content["acl"] = []
-
-            if set_user_principals:
-                set_principals_to_user(config, panopto_content, target_content)
-            if set_user_group_principals:
-                set_principals_to_user_group(config, panopto_content, target_content)
-    else:
+    if config.skip_permissions:
         set_principals_to_all(config, target_content)
+        return
 
-    if target_content.get("acl"):
-        principals_are_set = True
-    else:
-        LOG.warn("Content will be skipped to push to target since none of principals have applied!")
-
-    return principals_are_set
-
-
-def get_unique_principals(panopto_content):
-    """
-    Get unique principals to avoid duplicate principals on synced item
-    """
-
-    unique_content_principals = []
-
-    for principal in panopto_content['VideoContent']['Principals']:
-        if principal not in unique_content_principals:
-            unique_content_principals.append(principal)
-
-    return unique_content_principals
-
-
-def get_unique_external_user_principals(config, panopto_content):
-    """
-    Get unique external Panopto principals to avoid duplicate principals on synced item.
-    Identity provider will be matched with configured id provider instance name.
-    """
-
-    unique_external_user_principals = []
-
-    for p in panopto_content['VideoContent']['Principals']:
-        if (p not in unique_external_user_principals and
-                p.get('Username') and
-                p.get('IdentityProvider') and
-                p.get('IdentityProvider').lower() ==
-                ("unified" if config.panopto_id_provider_is_unified else config.panopto_id_provider_instance_name.lower())):
-
-            unique_external_user_principals.append(p)
-
-    return unique_external_user_principals
-
-
-def get_unique_user_group_external_contexts(config, panopto_content):
-    """
-    Get unique user group external contexts to avoid duplicate principals on synced item.
-    Identity provider will be matched with configured identity provider instance name.
-    """
-
-    unique_user_group_external_contexts = []
-
-    # Get user group principals that contains ExternalContexts
-    user_group_principals = [
-        p for p in panopto_content['VideoContent']['Principals']
-        if p.get('Groupname') and p.get('ExternalContexts')
-    ]
-
-    for p in user_group_principals:
-        for ec in p.get('ExternalContexts'):
-            if (ec not in unique_user_group_external_contexts and
-                ec.get("ExternalId") and
-                ec.get("IdentityProviderName") and
-                ec.get("IdentityProviderName").lower() == config.panopto_id_provider_instance_name.lower()):
-
-                unique_user_group_external_contexts.append(ec)
+    principals = normalize_principals(config, panopto_content)
 
-    return unique_user_group_external_contexts
+    # Set public or all users grant principals if exist
+    if principals.has_public_or_all_users:
+        set_principals_to_all(config, target_content)
+    # Set user and/or user group grant principals if exist
+    elif principals.usernames or principals.user_group_identifiers:
+        target_content["acl"] = []
+        target_content[UNRESOLVED_PRINCIPALS] = {
+            "users": principals.usernames,
+            "user_groups": principals.user_group_identifiers,
+        }
 
 
-def has_public_or_all_users_principals(panopto_content):
+def normalize_principals(config, panopto_content):
     """
-    Check if session contains Public or All Users group permission
-    Returns: True or False
+    Classify the principals of a session in a single pass.
+    Users and user group external contexts count only if their identity provider matches the configured
+    identity provider instance name, and are deduplicated by Panopto username and external id.
+    Returns: NormalizedPrincipals
     """
 
-    return any(
-        principal.get('Groupname') == 'Public'
-        or principal.get('Groupname') == 'All Users'
-        for principal in get_unique_principals(panopto_content)
-    )
+    instance_name = config.panopto_id_provider_instance_name.lower()
+    user_identity_provider = "unified" if config.panopto_id_provider_is_unified else instance_name
 
+    has_public_or_all_users = False
+    # Dictionaries keep the first seen order while deduplicating by hashed key
+    usernames = {}
+    user_group_identifiers = {}
 
-def has_user_principals(config, panopto_content):
-    """
-    Check is session contains user non Panopto permission
-    Returns: True or False
-    """
+    for principal in panopto_content['VideoContent']['Principals']:
+        groupname = principal.get('Groupname')
 
-    return bool(get_unique_external_user_principals(config, panopto_content))
+        if groupname in ('Public', 'All Users'):
+            has_public_or_all_users = True
 
+        elif groupname:
+            for ec in principal.get('ExternalContexts') or []:
+                if (ec.get("ExternalId") and
+                        ec.get("IdentityProviderName") and
+                        ec["IdentityProviderName"].lower() == instance_name):
+                    user_group_identifiers[ec["ExternalId"]] = None
 
-def has_user_group_principals(config, panopto_content):
-    """
-    Check is session contains user group permissions
-    Returns: True or False
-    """
+        elif (principal.get('Username') and
+                principal.get('IdentityProvider') and
+                principal['IdentityProvider'].lower() == user_identity_provider):
+            usernames[get_panopto_username(principal)] = None
 
-    return bool(get_unique_user_group_external_contexts(config, panopto_content))
+    return NormalizedPrincipals(has_public_or_all_users, list(usernames), list(user_group_identifiers))
 
 
 def set_principals_to_all(config, target_content):
@@ -355,29 +413,14 @@ def set_principals_to_all(config, target_content):
     }]
 
 
-def set_principals_to_user(config, panopto_content, target_content):
+def set_principals_to_user(panopto_usernames, target_content):
     """
-    Set session permission to user
+    Set session permission to users resolved in the users dictionary
     """
 
-    for principal in get_unique_external_user_principals(config, panopto_content):
+    for panopto_username in panopto_usernames:
 
-        panopto_username = get_panopto_username(principal)
-        user_id = None
-
-        # Try to get user id from users dictionary
-        if panopto_username in USERS:
-            user_id = USERS.get(panopto_username)
-        # If user doesn't exist in dictionary, try to get from AAD calling API
-        else:
-            # Get user from AAD
-            aad_user_info = get_aad_user_info(config, panopto_username)
-
-            if aad_user_info:
-                user_id = aad_user_info["id"]
-
-            # Add user to list to prevent further API calls for the same user
-            USERS[panopto_username] = user_id
+        user_id = USERS.get(panopto_username)
 
         if user_id:
             acl = {
@@ -388,34 +431,15 @@ def set_principals_to_user(config, panopto_content, target_content):
             target_content["acl"].append(acl)
 
 
-def set_principals_to_user_group(config, panopto_content, target_content):
+def set_principals_to_user_group(panopto_user_group_identifiers, target_content):
     """
-    Set session permission to user group
+    Set session permission to user groups resolved in the user groups dictionary
     """
 
-    for ec in get_unique_user_group_external_contexts(config, panopto_content):
-
-        # Set External Id from Group External Context
-        panopto_user_group_identifier = ec.get("ExternalId")
+    for panopto_user_group_identifier in panopto_user_group_identifiers:
 
         # Azure Active Directory Group Id
-        aad_group_id = None
-
-        # Try to get user group id from user_groups list
-        if panopto_user_group_identifier in USER_GROUPS:
-            aad_group_id = USER_GROUPS.get(panopto_user_group_identifier)
-        # If user group doesn't exist in list, try to get from AAD calling API
-        else:
-            # Get user group from Azure Active Directory
-            aad_user_group_info = get_aad_user_group_info(config, panopto_user_group_identifier)
-
-            # If Azure Active Directory group has been retrieved by group identifier,
-            # set Group Id and use it to grant group permission
-            if aad_user_group_info:
-                aad_group_id = aad_user_group_info["id"]
-
-            # Add user group to USER_GROUPS list to prevent further API calls for the same user group
-            USER_GROUPS[panopto_user_group_identifier] = aad_group_id
+        aad_group_id = USER_GROUPS.get(panopto_user_group_identifier)
 
         if aad_group_id:
             acl = {
@@ -426,6 +450,51 @@ def set_principals_to_user_group(config, panopto_content, target_content):
             target_content["acl"].append(acl)
 
 
+def resolve_directory_ids(config, collection, identifiers):
+    """
+    Get Azure Active Directory ids of users or user groups which are not in the users or user groups dictionary yet.
+    Identifiers which are not found are stored as None to prevent further API calls for them.
+    """
+
+    cache, mapping_attribute, get_aad_info = {
+        "users": (USERS, config.panopto_username_mapping, get_aad_user_info),
+        "groups": (USER_GROUPS, config.panopto_user_group_mapping, get_aad_user_group_info),
+    }[collection]
+
+    unknown_identifiers = sorted(identifier for identifier in identifiers if identifier not in cache)
+
+    # Look up one at a time unless batching is enabled and there is more than one to look up
+    if config.batch_size <= 1 or len(unknown_identifiers) <= 1:
+        for identifier in unknown_identifiers:
+            aad_info = get_aad_info(config, identifier)
+            cache[identifier] = aad_info["id"] if aad_info else None
+        return
+
+    batch_requests = [
+        {
+            "method": "GET",
+            "url": f"/{collection}?$filter=" + quote(f"{mapping_attribute} eq '{identifier}'"),
+        }
+        for identifier in unknown_identifiers
+    ]
+
+    for identifier, (status_code, response_json) in zip(
+            unknown_identifiers, send_batch_requests(config, batch_requests)):
+
+        aad_info = None
+
+        if status_code == 200:
+            # Filtered response returns list of values, but only one value can match the mapping attribute
+            response_value = (response_json or {}).get("value")
+            if response_value:
+                aad_info = response_value[0]
+        else:
+            LOG.warn("Unable to get aad %s info by: %s eq %s. Response: %s.",
+                     collection, mapping_attribute, identifier, response_json)
+
+        cache[identifier] = aad_info["id"] if aad_info else None
+
+
 def get_panopto_username(principal):
     """
     Get Panopto username from principal
@@ -561,11 +630,70 @@ def validate_configuration(config):
         )
 
 
+def ensure_connection_availability_if_changed(config):
+    """
+    Ensure that connection is ready for syncing, unless it has been verified ready before with the same schema.
+    The verified state is kept in the local state store by connection id, along with a hash of the schema file.
+    """
+
+    schema_hash = get_schema_hash()
+    connection_ready_key = get_connection_ready_key(config)
+    state_store = get_state_store(config)
+
+    if state_store.get(STATE_NAMESPACE, connection_ready_key) == schema_hash:
+        LOG.info("Connection has already been verified as Ready with the current schema.")
+        return
+
+    # Only a connection reported ready is remembered; one still in draft or over its limit is checked again
+    if ensure_connection_availability(config):
+        state_store.set(STATE_NAMESPACE, connection_ready_key, schema_hash)
+
+
+def get_connection_ready_key(config):
+    """
+    Get the state store key which holds the schema hash the configured connection was verified ready with
+    """
+
+    return f"connection_ready:{config.target_connection['id']}"
+
+
+def invalidate_connection_availability(config):
+    """
+    Forget that the connection was verified ready, so it is verified again on the next sync
+    """
+
+    LOG.warning("Connection will be verified again on the next sync.")
+    get_state_store(config).delete(STATE_NAMESPACE, get_connection_ready_key(config))
+
+
+def get_schema_path():
+    """
+    Get the location of the schema registered for the connection
+    """
+
+    return os.path.join(APP_TEMP_DIR, 'microsoft_graph_schema.json')
+
+
+def get_schema_hash():
+    """
+    Get a hash of the schema file, to notice when the schema changes.
+    The file is only read and hashed again once its modification time changes.
+    """
+
+    mtime = os.stat(get_schema_path()).st_mtime_ns
+    if SCHEMA_HASH["mtime"] != mtime:
+        with open(get_schema_path(), "rb") as schema_file:
+            SCHEMA_HASH.update(mtime=mtime, hash=hashlib.sha256(schema_file.read()).hexdigest())
+
+    return SCHEMA_HASH["hash"]
+
+
 def ensure_connection_availability(config):
     """
     Ensure that connection is ready for syncing.
     If connection is not created, create connection.
     If connection is created but schema is not registered, register schema.
+    Returns: True if the connection is ready, False if it is not ready yet or over its limit
     """
 
     # Get connection if exists
@@ -576,16 +704,17 @@ def ensure_connection_availability(config):
         # If connection is ready (contains already schema) return from methon
         if connection_response.json()["state"] == "ready":
             LOG.info("Connection is already created and Ready!")
-            return
+            return True
 
-        # If connection limit exceeded inform user and stop further processing by raising error
+        # If connection limit exceeded inform user and stop admitting new items until quota is freed.
+        # Updates of items already in the connection and deletes are still processed.
         if connection_response.json()["state"] == "limitExceeded":
-            LOG.error("Connection is already created but LIMIT EXCEEDED!")
+            LOG.error("Connection is already created but LIMIT EXCEEDED! " +
+                      "To continue adding items to the connection the tenant admin must contact Microsoft " +
+                      "or delete some content.")
 
-            raise CustomExceptions.QuotaLimitExceededError(
-                "Tenant quota has been reached! " +
-                "To continue adding items to the connection the tenant admin must contact Microsoft or delete some content."
-            )
+            set_items_remaining(config, 0)
+            return False
 
         if connection_response.json()["state"] == "draft":
             LOG.info("Connection is already created but not ready (Schema is not registered).")
@@ -607,7 +736,7 @@ def ensure_connection_availability(config):
         connection_response.raise_for_status()
 
     # Check if schema is registered for connection and register it if not
-    ensure_schema_for_connection(config)
+    return ensure_schema_for_connection(config)
 
 
 def get_access_token(config):
@@ -623,49 +752,59 @@ def get_access_token(config):
     tenant_id = target_credentials["tenant_id"]
     scopes = target_credentials["scopes"]
 
-    # Load access token from cache file
-    token_cache = load_token_cache()
+    with TOKEN_CACHE_LOCK:
+        # Load access token from cache file
+        token_cache = load_token_cache(config)
 
-    auth_app = msal.ConfidentialClientApplication(
-        client_id=client_id,
-        client_credential=client_secret,
-        authority=f"{authority_url}/{tenant_id}",
-        token_cache=token_cache)
+        auth_app = msal.ConfidentialClientApplication(
+            client_id=client_id,
+            client_credential=client_secret,
+            authority=f"{authority_url}/{tenant_id}",
+            token_cache=token_cache)
 
-    # Try to get a token from cache
-    response = auth_app.acquire_token_silent(scopes, account=None)
+        # Try to get a token from cache
+        response = auth_app.acquire_token_silent(scopes, account=None)
 
-    # No cached token found. Create a new one
-    if not response:
-        response = auth_app.acquire_token_for_client(scopes)
+        # No cached token found. Create a new one
+        if not response:
+            response = auth_app.acquire_token_for_client(scopes)
 
-    # Save token to cache file if modified
-    save_token_cache(token_cache)
+        # Save token to cache file if modified
+        save_token_cache(config, token_cache)
 
     return response['access_token']
 
 
-def load_token_cache():
+def get_token_cache_path(config):
+    """
+    Get the location of the token cache file of the profile. Each profile has its own, so profiles syncing at the same
+    time never read a cache another is writing or removing.
+    """
+
+    return os.path.join(APP_TEMP_DIR, f'token_cache.{config.profile_name}.bin')
+
+
+def load_token_cache(config):
     """
     Load token from cache file
     """
 
     cache = msal.SerializableTokenCache()
 
-    if os.path.exists(TOKEN_CACHE):
-        with open(TOKEN_CACHE, "r") as tc:
+    if os.path.exists(get_token_cache_path(config)):
+        with open(get_token_cache_path(config), "r") as tc:
             cache.deserialize(tc.read())
 
     return cache
 
 
-def save_token_cache(cache: msal.token_cache.SerializableTokenCache):
+def save_token_cache(config, cache: msal.token_cache.SerializableTokenCache):
     """
     Save token to cache file
     """
 
     if cache.has_state_changed:
-        with open(TOKEN_CACHE, "w") as tc:
+        with open(get_token_cache_path(config), "w") as tc:
             tc.write(cache.serialize())
 
 
@@ -727,12 +866,17 @@ def create_connection(config):
 
     LOG.info("Connection has been created!")
 
+    # The new connection is empty, so the local item index knows about every item that will be in it
+    get_state_store(config).set(STATE_NAMESPACE, get_item_index_complete_key(config), True)
+
     return response.json()
 
 
 def ensure_schema_for_connection(config):
     """
     Ensure schema for connection
+    Returns: True if the schema was registered and the connection is ready,
+             False if a schema is found but the connection was not reported ready
     """
 
     schema_response = get_schema_for_connection(config)
@@ -740,6 +884,10 @@ def ensure_schema_for_connection(config):
     # Register schema if not found
     if schema_response.status_code == 404:
         register_schema_for_connection(config)
+        return True
+
+    LOG.info("Schema is found but the connection is not ready yet. It will be checked again on the next sync.")
+    return False
 
 
 def get_schema_for_connection(config):
@@ -784,9 +932,7 @@ def register_schema_for_connection(config):
         'Content-Type': 'application/json'
     }
 
-    schema_path = os.path.join(APP_TEMP_DIR, 'microsoft_graph_schema.json')
-
-    with open(schema_path, "r") as schema_file:
+    with open(get_schema_path(), "r") as schema_file:
         schema_json = json.load(schema_file)
 
         response = requests.post(url, headers=headers, json=schema_json)
@@ -811,18 +957,23 @@ def check_connection_operation_status(config, operation_url):
     """
     Registering schema may take time so we need to wait
     until the schema is registered and connection is ready for sync.
+    Checks back off exponentially, and give up once the configured schema registration timeout has passed.
     """
 
     LOG.info("Checking connection operation status...It may take time until the schema is registered.")
 
-    access_token = get_access_token(config)
-
-    # Set headers
-    headers = {
-        'Authorization': f'Bearer {access_token}'
-    }
+    deadline = time.monotonic() + config.schema_registration_timeout.total_seconds()
+    poll_seconds = SCHEMA_OPERATION_POLL_SECONDS
 
     while True:
+        # Get token, which may be renewed while waiting
+        access_token = get_access_token(config)
+
+        # Set headers
+        headers = {
+            'Authorization': f'Bearer {access_token}'
+        }
+
         response = requests.get(operation_url, headers=headers)
         response.raise_for_status()
 
@@ -831,17 +982,206 @@ def check_connection_operation_status(config, operation_url):
             LOG.info("Connection is ready!")
             break
 
-        # Wait 3 seconds until next check
-        time.sleep(3)
+        if response_json["status"] == "failed":
+            raise CustomExceptions.ConnectionNotReadyError(
+                f"Schema registration has failed! {response_json.get('error')}")
+
+        if time.monotonic() + poll_seconds > deadline:
+            raise CustomExceptions.ConnectionNotReadyError(
+                f"Schema registration has not completed within {config.schema_registration_timeout}! "
+                "It will be checked again on the next sync.")
+
+        # Wait until next check
+        time.sleep(poll_seconds)
+        poll_seconds = min(poll_seconds * 2, SCHEMA_OPERATION_MAX_POLL_SECONDS)
+
+
+def handle_push_response(config, content_id, target_content, status_code, response_json, response_text):
+    """
+    Handle the target response of a single item push
+    """
+
+    if status_code == 200:
+        LOG.info(f"Content ({content_id}) has been pushed to target!")
+        record_item_presence(config, content_id, True)
+    # If the connection is missing, it needs to be verified (and created) again
+    elif status_code == 404:
+        log_error_for_not_pushed_content(content_id, target_content, response_text)
+        invalidate_connection_availability(config)
+    # If request is forbidden
+    elif status_code == 403:
+        error = (response_json or {}).get("error")
+
+        if error and error.get("innerError"):
+            innerError = error.get("innerError")
+            if innerError.get('code') == "TenantQuotaExceeded":
+                # Stop admitting new items until quota is freed, and push this one later
+                LOG.error(f"Tenant quota has been reached! {innerError.get('message')}")
+                set_items_remaining(config, 0)
+                defer_item(config, target_content)
+                return
+
+        log_error_for_not_pushed_content(content_id, target_content, response_text)
+    else:
+        log_error_for_not_pushed_content(content_id, target_content, response_text)
+
+
+def handle_delete_response(config, content_id, status_code, response_text):
+    """
+    Handle the target response of a single item delete
+    """
+
+    if status_code == 200:
+        LOG.info(f"Content ({content_id}) has been deleted from target!")
+        # Deleting an item that was in the connection frees quota for a new one
+        if is_item_in_target(config, content_id):
+            adjust_items_remaining(config, 1)
+        record_item_presence(config, content_id, False)
+    elif status_code == 404:
+        LOG.info(f"Content ({content_id}) not found to be delete from target!")
+        record_item_presence(config, content_id, False)
+    else:
+        LOG.error(f"Content ({content_id}) has NOT been deleted from target! Response: {response_text}")
+        FAILED_CONTENT_IDS.add(content_id)
+
+
+def get_response_json(response):
+    """
+    Get the json body of a response, or None if the body is not json
+    """
+
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def queue_batch_request(config, method, content_id, target_content=None):
+    """
+    Queue an item request for the next JSON batch, sending the batch once it is full
+    """
+
+    LOG.info("Queueing %s of content (%s) for batch request...", method, content_id)
+
+    with PENDING_BATCH_REQUESTS_LOCK:
+        PENDING_BATCH_REQUESTS.append({
+            "method": method,
+            "content_id": content_id,
+            "target_content": target_content,
+        })
+
+        if len(PENDING_BATCH_REQUESTS) >= min(config.batch_size, GRAPH_BATCH_LIMIT):
+            flush(config)
+
+
+def get_batch_addresses(config):
+    """
+    Get the JSON batch endpoint and the connection path relative to the Graph version root
+    Returns: (batch url, connection path)
+    """
+
+    target_address = urlsplit(config.target_address)
+    version, _, connections_path = target_address.path.strip("/").partition("/")
+    connection_id = config.target_connection["id"]
+
+    batch_url = f"{target_address.scheme}://{target_address.netloc}/{version}/$batch"
+    connection_path = f"/{connections_path}/{connection_id}"
+
+    return batch_url, connection_path
+
+
+def send_batch_requests(config, batch_requests):
+    """
+    Send requests to the target as JSON batches. Throttled requests are resent after the requested delay.
+    Returns: List of (status code, response json) in the order of the requests
+    """
+
+    batch_url, _ = get_batch_addresses(config)
+    batch_limit = max(1, min(config.batch_size, GRAPH_BATCH_LIMIT))
+
+    responses = [None] * len(batch_requests)
+    pending_indexes = list(range(len(batch_requests)))
+
+    for attempt in range(GRAPH_BATCH_MAX_RETRIES + 1):
+
+        throttled_indexes, retry_after = [], 1
+
+        for start in range(0, len(pending_indexes), batch_limit):
+            batch_indexes = pending_indexes[start:start + batch_limit]
+
+            LOG.info("Sending batch of %i requests to target...", len(batch_indexes))
+
+            # Get token
+            access_token = get_access_token(config)
+
+            # Set headers
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+
+            body_data = {"requests": [dict(batch_requests[index], id=str(index)) for index in batch_indexes]}
+
+            response = requests.post(batch_url, headers=headers, json=body_data)
+            response.raise_for_status()
+
+            for item_response in response.json()["responses"]:
+                index = int(item_response["id"])
+                status_code = item_response["status"]
+                responses[index] = (status_code, item_response.get("body"))
+
+                # Throttled requests are resent in the next attempt
+                if status_code in GRAPH_BATCH_THROTTLED_STATUS_CODES and attempt < GRAPH_BATCH_MAX_RETRIES:
+                    throttled_indexes.append(index)
+                    item_headers = {key.lower(): value for key, value in (item_response.get("headers") or {}).items()}
+                    retry_after = max(retry_after, int(item_headers.get("retry-after", 2 ** attempt)))
+
+        if not throttled_indexes:
+            break
+
+        LOG.warning("%i batched requests were throttled, retrying in %i seconds", len(throttled_indexes), retry_after)
+        time.sleep(retry_after)
+        pending_indexes = throttled_indexes
+
+    return responses
+
+
+def send_batch(config, batch):
+    """
+    Send queued item requests as JSON batches and handle the response of each item
+    """
+
+    _, connection_path = get_batch_addresses(config)
+
+    batch_requests = []
+    for item in batch:
+        batch_request = {
+            "method": item["method"],
+            "url": f"{connection_path}/items/{item['content_id']}",
+        }
+        if item["target_content"] is not None:
+            batch_request["headers"] = {'Content-Type': 'application/json'}
+            batch_request["body"] = item["target_content"]
+        batch_requests.append(batch_request)
+
+    for item, (status_code, response_json) in zip(batch, send_batch_requests(config, batch_requests)):
+        response_text = json.dumps(response_json)
+
+        if item["method"] == "DELETE":
+            handle_delete_response(config, item["content_id"], status_code, response_text)
+        else:
+            handle_push_response(config, item["content_id"], item["target_content"], status_code,
+                                 response_json, response_text)
 
 
 def log_error_for_not_pushed_content(content_id, target_content, response_text):
     """
-    Logs error for not pushed content to target
+    Logs error for not pushed content to target, and remembers it failed until the next flush
     """
 
     LOG.error(f"Content ({content_id}) has NOT been pushed to target! " +
               f"Target Content: {target_content}. Response: {response_text}")
+    FAILED_CONTENT_IDS.add(content_id)
 
 
 def delete_content_from_target_if_exists(target_content, config):
@@ -854,13 +1194,213 @@ def delete_content_from_target_if_exists(target_content, config):
     LOG.info(f"Checking if content ({content_id}) is already synced in order to delete from target "
               "since none of principals are applied to content...")
 
-    content_from_target = get_content_from_target(content_id, config)
+    item_is_in_target = is_item_in_target(config, content_id)
 
-    if content_from_target:
+    # Only ask the target about items the local index has not seen yet
+    if item_is_in_target is None:
+        item_is_in_target = bool(get_content_from_target(content_id, config))
+        record_item_presence(config, content_id, item_is_in_target)
+
+    if item_is_in_target:
         LOG.info(f"Content ({content_id}) is already synced and we will proceed with deleting from target!")
         delete_from_target(content_id, config)
 
 
+def get_item_index_namespace(config, name):
+    """
+    Get the state store namespace of a part of the local item index of the configured connection
+    """
+
+    return f"{STATE_NAMESPACE}:items:{config.target_connection['id']}:{name}"
+
+
+def get_item_index_complete_key(config):
+    """
+    Get the state store key which flags that the local item index of the configured connection is complete
+    """
+
+    return f"item_index_complete:{config.target_connection['id']}"
+
+
+def is_item_in_target(config, content_id):
+    """
+    Check the local index of items pushed to the connection
+    Returns: True or False if the item is known to be present or absent, None if the item is unknown
+    """
+
+    state_store = get_state_store(config)
+
+    if state_store.contains(get_item_index_namespace(config, "present"), content_id):
+        return True
+
+    # The index is complete if it has tracked the connection since it was created
+    if (state_store.contains(get_item_index_namespace(config, "absent"), content_id) or
+            state_store.get(STATE_NAMESPACE, get_item_index_complete_key(config), False)):
+        return False
+
+    return None
+
+
+def record_item_presence(config, content_id, is_present):
+    """
+    Record in the local item index whether an item is present in the connection
+    """
+
+    state_store = get_state_store(config)
+    present_namespace = get_item_index_namespace(config, "present")
+    absent_namespace = get_item_index_namespace(config, "absent")
+
+    if is_present:
+        state_store.add(present_namespace, content_id)
+        state_store.discard(absent_namespace, content_id)
+    else:
+        state_store.discard(present_namespace, content_id)
+        state_store.add(absent_namespace, content_id)
+
+
+def get_quota_key(config):
+    """
+    Get the state store key which holds the quota headroom estimate of the configured connection
+    """
+
+    return f"quota:{config.target_connection['id']}"
+
+
+def get_items_remaining(config):
+    """
+    Get the estimated number of items the connection can still take
+    Returns: The estimate, or None if it is unknown
+    """
+
+    return get_state_store(config).get(STATE_NAMESPACE, get_quota_key(config), {}).get("items_remaining")
+
+
+def set_items_remaining(config, items_remaining, refreshed=None):
+    """
+    Set the estimated number of items the connection can still take
+    """
+
+    state_store = get_state_store(config)
+    quota = state_store.get(STATE_NAMESPACE, get_quota_key(config), {})
+    quota["items_remaining"] = items_remaining
+    if refreshed is not None:
+        quota["refreshed"] = refreshed
+    state_store.set(STATE_NAMESPACE, get_quota_key(config), quota)
+
+
+def adjust_items_remaining(config, delta):
+    """
+    Adjust the local estimate of the number of items the connection can still take, if there is one
+    """
+
+    items_remaining = get_items_remaining(config)
+    if items_remaining is not None:
+        set_items_remaining(config, max(items_remaining + delta, 0))
+
+
+def refresh_connection_quota(config, force=False):
+    """
+    Refresh the local quota headroom estimate from the connection quota,
+    unless it has been refreshed within the configured quota refresh interval
+    """
+
+    quota = get_state_store(config).get(STATE_NAMESPACE, get_quota_key(config), {})
+    now = time.time()
+
+    if not force and now - quota.get("refreshed", 0) < config.quota_refresh.total_seconds():
+        return
+
+    LOG.info("Getting connection quota: %s", config.target_connection["id"])
+
+    # Get token
+    access_token = get_access_token(config)
+
+    # Set headers
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+
+    url = f"{config.target_address}/{config.target_connection['id']}/quota"
+
+    response = requests.get(url, headers=headers)
+
+    if response.status_code == 200 and response.json().get("itemsRemaining") is not None:
+        items_remaining = response.json()["itemsRemaining"]
+        LOG.info("Connection can take %i more items.", items_remaining)
+    else:
+        # Without quota info fall back to probing with pushes again,
+        # which will find out if the tenant quota is still exhausted
+        LOG.info("Unable to get connection quota. Response: %s", response.text)
+        items_remaining = None
+
+    set_items_remaining(config, items_remaining, refreshed=now)
+
+
+def admit_new_item(config):
+    """
+    Check whether a new item may be pushed to the connection, and count it against the quota headroom if so
+    Returns: True or False
+    """
+
+    refresh_connection_quota(config)
+
+    items_remaining = get_items_remaining(config)
+
+    if items_remaining is not None and items_remaining <= config.quota_headroom_reserve:
+        return False
+
+    adjust_items_remaining(config, -1)
+    return True
+
+
+def get_deferred_items_namespace(config):
+    """
+    Get the state store namespace of items deferred while the connection had no quota headroom
+    """
+
+    return f"{STATE_NAMESPACE}:deferred:{config.target_connection['id']}"
+
+
+def defer_item(config, target_content):
+    """
+    Keep converted content locally to push it once the connection has quota headroom again
+    """
+
+    LOG.warning(f"Content ({target_content.get('id')}) has been deferred until the tenant quota allows new items.")
+    get_state_store(config).set(get_deferred_items_namespace(config), target_content["id"], target_content)
+
+
+def push_deferred_items(config):
+    """
+    Push items deferred while the connection had no quota headroom, as far as the headroom allows now.
+    Deferred items are read a page at a time, each page no larger than the headroom left, so a large backlog
+    is never held in memory at once.
+    """
+
+    state_store = get_state_store(config)
+    namespace = get_deferred_items_namespace(config)
+
+    while True:
+        items_remaining = get_items_remaining(config)
+        page_size = DEFERRED_ITEMS_PAGE_SIZE
+        if items_remaining is not None:
+            page_size = min(page_size, items_remaining - config.quota_headroom_reserve)
+            if page_size <= 0:
+                if state_store.entries(namespace, limit=1):
+                    LOG.warning("Tenant quota still has no room for deferred items.")
+                return
+
+        deferred_items = state_store.entries(namespace, limit=page_size)
+        if not deferred_items:
+            return
+
+        LOG.info("Retrying %i items deferred until the tenant quota allowed new items...", len(deferred_items))
+
+        for content_id, target_content in deferred_items:
+            state_store.delete(namespace, content_id)
+            push_to_target(target_content, config)
+
+
 def get_content_from_target(content_id, config):
     """
     Get content from target
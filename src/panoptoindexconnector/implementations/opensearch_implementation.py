@@ -0,0 +1,384 @@
+"""
+Methods for the connector application to convert and sync content to the target endpoint
+
+Implement these methods for the connector application
+"""
+
+# Standard Library Imports
+import json
+import logging
+import os
+import time
+
+# Third party
+import requests
+
+# Home rolled
+from panoptoindexconnector.helpers import format_request_secure
+from panoptoindexconnector.state_store import get_state_store
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+# Bulk items rejected for load are sent again, waiting twice as long each time
+OPENSEARCH_BULK_MAX_RETRIES = 5
+OPENSEARCH_BULK_RETRY_SECONDS = 1
+OPENSEARCH_RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+# Document ids listed per scroll request when reconciling, and how long each scroll is kept open between requests
+OPENSEARCH_SCROLL_SIZE = 1000
+OPENSEARCH_SCROLL_KEEPALIVE = '2m'
+
+# Index, update and delete actions waiting to be sent in the next bulk request, as (document id, lines, size in bytes),
+# with their total size, the full documents of the updates among them by document id, and the ids of documents whose
+# actions failed since the last flush
+PENDING_BULK = {'actions': [], 'size': 0, 'full_documents': {}}
+FAILED_DOCUMENT_IDS = set()
+
+
+#########################################################################
+#
+# Exported methods to implement
+#
+#########################################################################
+
+
+def convert_to_target(panopto_content, config):
+    """
+    Implement this method to convert to target format
+    """
+
+    field_mapping = config.field_mapping
+
+    target_content = {field_mapping['Id']: panopto_content['Id']}
+
+    for key, field in field_mapping['Info'].items():
+        target_content[field] = panopto_content['VideoContent'][key]
+    for key, field in field_mapping['Metadata'].items():
+        if panopto_content['VideoContent'][key]:
+            target_content[field] = panopto_content['VideoContent'][key]
+
+    # Principals, in the same <User|Group>:<IdProvider>:<Name> form as the principal allowlist,
+    # to filter searches by the principals of the user searching
+    if not config.skip_permissions:
+        target_content[_get_principals_field(config)] = [
+            '{type}:{provider}:{name}'.format(
+                type='User' if principal.get('Username') else 'Group',
+                provider=principal.get('IdentityProvider') or 'Panopto',
+                name=principal.get('Username') or principal.get('Groupname'))
+            for principal in panopto_content['VideoContent']['Principals']
+            if principal.get('Username') or principal.get('Groupname')
+        ]
+
+    LOG.debug('Converted document is %s', json.dumps(target_content, indent=2))
+
+    return target_content
+
+
+def push_to_target(target_content, config):
+    """
+    Implement this method to push converted content to the target
+    """
+
+    document_id = target_content[config.field_mapping['Id']]
+    action = {'index': {'_index': _get_index(config), '_id': document_id}}
+
+    _queue_bulk_action(document_id, [action, target_content], config)
+
+
+def push_partial_to_target(target_content, changed_fields, config):
+    """
+    Update just the fields of a document which changed since it was last synced, e.g. only its principals.
+    Fields no longer in the content are cleared. Only the changed fields are sent; a document no longer in the index
+    is indexed in full in its place.
+    """
+
+    document_id = target_content[config.field_mapping['Id']]
+    action = {'update': {'_index': _get_index(config), '_id': document_id}}
+    partial_document = {field: target_content.get(field) for field in changed_fields}
+
+    _queue_bulk_action(document_id, [action, {'doc': partial_document}], config, full_document=target_content)
+
+
+def delete_from_target(video_id, config):
+    """
+    Implement this method to push converted content to the target
+    """
+
+    action = {'delete': {'_index': _get_index(config), '_id': video_id}}
+
+    _queue_bulk_action(video_id, [action], config)
+
+
+def flush(config):
+    """
+    Send the queued actions in one bulk request, sending again the items rejected for load until they succeed
+    :returns: the ids of documents whose actions failed since the last flush, so they aren't recorded as synced
+    """
+
+    _send_pending_bulk(config)
+
+    failed_document_ids = sorted(FAILED_DOCUMENT_IDS)
+    FAILED_DOCUMENT_IDS.clear()
+    return failed_document_ids
+
+
+def get_from_target(video_id, config):
+    """
+    Get the document the index holds for a video, or None if it is not there
+    """
+
+    response = _send_opensearch_request(
+        config, '{target}/{index}/_doc/' + requests.utils.quote(video_id, safe=''), 'get', allowed_status_codes=(404,))
+    return response.json().get('_source') if response.status_code != 404 else None
+
+
+def list_target_ids(config):
+    """
+    Scroll through the ids of every document in the index, without their content
+    """
+
+    body = {'size': OPENSEARCH_SCROLL_SIZE, '_source': False, 'sort': ['_doc']}
+    response = _send_opensearch_request(
+        config, '{target}/{index}/_search?scroll=' + OPENSEARCH_SCROLL_KEEPALIVE, 'post', json=body).json()
+
+    try:
+        while response['hits']['hits']:
+            for hit in response['hits']['hits']:
+                yield hit['_id']
+            body = {'scroll': OPENSEARCH_SCROLL_KEEPALIVE, 'scroll_id': response['_scroll_id']}
+            response = _send_opensearch_request(config, '{target}/_search/scroll', 'post', json=body).json()
+    finally:
+        # A search which failed or found nothing may have no scroll to clear
+        if response.get('_scroll_id'):
+            _ = _send_opensearch_request(
+                config, '{target}/_search/scroll', 'delete', allowed_status_codes=(404,),
+                json={'scroll_id': response['_scroll_id']})
+
+
+#
+# Initialize and rebuild steps here set up the index and defer refreshes while rebuilding
+#
+
+def initialize(config):
+    """
+    Create the index if it does not exist yet, with the principals field mapped for filtering
+    """
+    # Drop anything left queued by a failed sync attempt; it will be synced again
+    _clear_pending_bulk()
+    FAILED_DOCUMENT_IDS.clear()
+
+    index_url = '{target}/{index}'
+    if _send_opensearch_request(config, index_url, 'head', allowed_status_codes=(404,)).status_code != 404:
+        return
+
+    mappings = {'properties': {_get_principals_field(config): {'type': 'keyword'}}}
+    _ = _send_opensearch_request(config, index_url, 'put', json={'mappings': mappings})
+
+    LOG.info('Created index %s', _get_index(config))
+
+
+def begin_rebuild(config):
+    """
+    Stop refreshing the index while it is rebuilt, remembering the refresh interval to restore
+    """
+    state_store = get_state_store(config)
+    namespace = _get_state_namespace(config)
+
+    # A rebuild resumed after a failed pass already holds the interval to restore
+    if not state_store.get(namespace, 'rebuilding', default=False):
+        url = '{target}/{index}/_settings/index.refresh_interval'
+        settings = _send_opensearch_request(config, url, 'get').json()
+        refresh_interval = settings.get(_get_index(config), {}).get('settings', {}).get('index', {}).get(
+            'refresh_interval')
+        state_store.set(namespace, 'refresh_interval', refresh_interval)
+        state_store.set(namespace, 'rebuilding', True)
+
+    _set_refresh_interval(config, '-1')
+
+
+def complete_rebuild(config):
+    """
+    Restore the refresh interval the index had before the rebuild, and refresh it
+    """
+    _send_pending_bulk(config)
+
+    state_store = get_state_store(config)
+    namespace = _get_state_namespace(config)
+
+    # No previous interval means the index default, which setting null restores
+    _set_refresh_interval(config, state_store.get(namespace, 'refresh_interval'))
+    _ = _send_opensearch_request(config, '{target}/{index}/_refresh', 'post')
+
+    state_store.delete(namespace, 'rebuilding')
+    state_store.delete(namespace, 'refresh_interval')
+    LOG.info('Restored refreshes of index %s', _get_index(config))
+
+
+##############################################
+#
+# Helpers
+#
+##############################################
+
+
+def _send_opensearch_request(config, url_format, requesttype, allowed_status_codes=(), request_summary=None, **kwargs):
+    """
+    Internal helper to send a request to opensearch, logging the summary of a failed request in place of it if given
+    """
+
+    requesttype = requesttype.lower()
+
+    if requesttype not in ('get', 'head', 'put', 'delete', 'post'):
+        raise ValueError('Unexpected rest request type: %s' % requesttype)
+
+    url = url_format.format(target=config.target_address.rstrip('/'), index=_get_index(config))
+
+    handler = requests.__dict__[requesttype]
+
+    response = handler(url=url, auth=_get_auth(config), **kwargs)
+    if not response.ok and response.status_code not in allowed_status_codes:
+        LOG.error('Failed response %s\n%s', response.text, request_summary or format_request_secure(response.request))
+        response.raise_for_status()
+    return response
+
+
+def _send_pending_bulk(config):
+    """
+    Send the queued actions in one bulk request, sending again the items rejected for load until they succeed
+    """
+
+    if not PENDING_BULK['actions']:
+        return
+
+    actions = [lines for _, lines, _ in PENDING_BULK['actions']]
+    full_documents = PENDING_BULK['full_documents']
+    _clear_pending_bulk()
+
+    for attempt in range(OPENSEARCH_BULK_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(OPENSEARCH_BULK_RETRY_SECONDS * 2 ** (attempt - 1))
+            LOG.info('Sending %i bulk items again, attempt %i', len(actions), attempt + 1)
+        actions = _send_bulk(config, actions, full_documents)
+        if not actions:
+            return
+
+    raise RuntimeError('%i bulk items were still rejected after %i attempts' % (
+        len(actions), OPENSEARCH_BULK_MAX_RETRIES + 1))
+
+
+def _send_bulk(config, actions, full_documents):
+    """
+    Send actions as one bulk request, and return those which should be sent again:
+    those rejected for load, and in place of updates of documents missing from the index, their full documents
+    """
+    body = ''.join(json.dumps(line) + '\n' for lines in actions for line in lines)
+    headers = {'Content-Type': 'application/x-ndjson'}
+
+    response = _send_opensearch_request(
+        config, '{target}/_bulk', 'post', allowed_status_codes=OPENSEARCH_RETRY_STATUS_CODES,
+        request_summary='bulk request of %i items' % len(actions), data=body.encode('utf-8'), headers=headers)
+
+    # The whole request was rejected for load
+    if response.status_code in OPENSEARCH_RETRY_STATUS_CODES:
+        LOG.warning('Bulk request of %i items rejected with %i', len(actions), response.status_code)
+        return actions
+
+    result = response.json()
+    if not result.get('errors'):
+        LOG.info('Sent bulk request of %i items', len(actions))
+        return []
+
+    retry_actions = []
+    for lines, item in zip(actions, result['items']):
+        operation, item_result = next(iter(item.items()))
+        status = item_result.get('status', 200)
+        if status in OPENSEARCH_RETRY_STATUS_CODES:
+            retry_actions.append(lines)
+        elif operation == 'update' and status == 404 and item_result.get('_id') in full_documents:
+            LOG.info('Document %s is no longer in the index; indexing it in full', item_result['_id'])
+            action = {'index': {'_index': _get_index(config), '_id': item_result['_id']}}
+            retry_actions.append([action, full_documents[item_result['_id']]])
+        elif status >= 300 and not (operation == 'delete' and status == 404):
+            # Not worth sending again; these fail the same way every time
+            LOG.error('Failed to %s %s: %s', operation, item_result.get('_id'), item_result.get('error'))
+            FAILED_DOCUMENT_IDS.add(item_result.get('_id'))
+
+    LOG.info('Sent bulk request of %i items; %i to send again', len(actions), len(retry_actions))
+    return retry_actions
+
+
+def _queue_bulk_action(document_id, lines, config, full_document=None):
+    """
+    Queue an action for the next bulk request in place of any queued action on the same document,
+    sending the request first if the action would not fit it and after if it is full.
+    An update is given the full document, to index in its place if the document is missing; it is kept in memory
+    until the request is sent, but not sent otherwise.
+    """
+    PENDING_BULK['size'] -= sum(
+        queued_size for queued_id, _, queued_size in PENDING_BULK['actions'] if queued_id == document_id)
+    PENDING_BULK['actions'] = [
+        queued_action for queued_action in PENDING_BULK['actions'] if queued_action[0] != document_id]
+    PENDING_BULK['full_documents'].pop(document_id, None)
+
+    size = sum(len(json.dumps(line).encode('utf-8')) + 1 for line in lines)
+
+    if PENDING_BULK['actions'] and config.batch_max_bytes and PENDING_BULK['size'] + size > config.batch_max_bytes:
+        _send_pending_bulk(config)
+
+    PENDING_BULK['actions'].append((document_id, lines, size))
+    PENDING_BULK['size'] += size
+    if full_document is not None:
+        PENDING_BULK['full_documents'][document_id] = full_document
+
+    if len(PENDING_BULK['actions']) >= config.batch_size:
+        _send_pending_bulk(config)
+
+
+def _clear_pending_bulk():
+    """
+    Empty the queue of actions waiting for the next bulk request
+    """
+    PENDING_BULK['actions'] = []
+    PENDING_BULK['size'] = 0
+    PENDING_BULK['full_documents'] = {}
+
+
+def _get_auth(config):
+    """
+    Basic auth for the target credentials, if there is a username
+    """
+    target_credentials = config.target_credentials
+    if not target_credentials.get('username'):
+        return None
+    return requests.auth.HTTPBasicAuth(target_credentials['username'], target_credentials['password'])
+
+
+def _get_index(config):
+    """
+    The name of the index videos are synced to
+    """
+    return config.target_credentials['index']
+
+
+def _get_principals_field(config):
+    """
+    The field holding the principals allowed to see a video
+    """
+    return config.field_mapping.get('Principals', 'principals')
+
+
+def _get_state_namespace(config):
+    """
+    The state store namespace for the index
+    """
+    return 'opensearch:%s' % _get_index(config)
+
+
+def _set_refresh_interval(config, refresh_interval):
+    """
+    Set how often the index refreshes; None restores the default
+    """
+    body = {'index': {'refresh_interval': refresh_interval}}
+    _ = _send_opensearch_request(config, '{target}/{index}/_settings', 'put', json=body)
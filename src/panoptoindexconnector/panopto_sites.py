@@ -0,0 +1,92 @@
+"""
+What is shared by every profile syncing from the same Panopto site in a process:
+a pool of connections, the oauth tokens of each set of credentials, and a budget of requests
+"""
+
+# Standard Library Imports
+import logging
+import threading
+import time
+
+# Third party
+import requests
+
+# Global constants
+LOG = logging.getLogger(__name__)
+
+# Sites by address, shared by everything in the process syncing from them
+PANOPTO_SITES = {}
+PANOPTO_SITES_LOCK = threading.Lock()
+
+
+class PanoptoSite:
+    """
+    Sends the requests to a Panopto site through one session, within the site's rate budget
+    """
+
+    def __init__(self, site_address):
+        """
+        Set up the site with its own session and no rate limit yet
+        """
+
+        self._site_address = site_address
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._requests_per_second = None
+        self._next_request_time = 0
+
+        # Oauth tokens and their expiration, by credentials; renewing a token holds the lock
+        self.oauth_tokens = {}
+        self.oauth_lock = threading.Lock()
+
+    @property
+    def requests_per_second(self):
+        """
+        The most requests per second sent to the site, or None if unlimited
+        """
+        return self._requests_per_second
+
+    def limit_rate(self, requests_per_second):
+        """
+        Limit the requests sent to the site; with several profiles limiting it, the lowest limit holds
+        """
+        if not requests_per_second:
+            return
+        with self._lock:
+            if self._requests_per_second is None or requests_per_second < self._requests_per_second:
+                self._requests_per_second = requests_per_second
+                LOG.info('Limiting requests to %s to %s per second', self._site_address, requests_per_second)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request to the site once the rate budget allows
+        """
+        self.wait_for_budget()
+        return self._session.request(method, url, **kwargs)
+
+    def wait_for_budget(self):
+        """
+        Wait for the next slot in the site's rate budget, if it has one
+        """
+        with self._lock:
+            if not self._requests_per_second:
+                return
+            now = time.monotonic()
+            request_time = max(now, self._next_request_time)
+            self._next_request_time = request_time + 1 / self._requests_per_second
+
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+def get_panopto_site(site_address):
+    """
+    Get the shared site for an address, setting it up on first use
+    """
+
+    site_address = site_address.rstrip('/').lower()
+
+    with PANOPTO_SITES_LOCK:
+        if site_address not in PANOPTO_SITES:
+            PANOPTO_SITES[site_address] = PanoptoSite(site_address)
+        return PANOPTO_SITES[site_address]
@@ -0,0 +1,91 @@
+"""
+Adaptive scheduling of sync passes
+
+Targets are polled more often while passes keep finding many updates, less often while they find none,
+and after failures with a jittered exponential backoff; always within the configured bounds.
+"""
+
+# Standard Library Imports
+from datetime import timedelta
+import logging
+import random
+import threading
+
+# Local
+from panoptoindexconnector.custom_exceptions import CustomExceptions
+
+# Global constants
+LOG = logging.getLogger(__name__)
+
+# Schedules by target profile name, kept for as long as the process runs
+SCHEDULES = {}
+SCHEDULES_LOCK = threading.Lock()
+
+# How much passes finding many or no updates shorten or lengthen the interval
+POLLING_INTERVAL_FACTOR = 2
+# Backoffs vary by up to this fraction either way, so targets failing together don't retry together
+POLLING_BACKOFF_JITTER = 0.2
+
+
+class AdaptiveSchedule:
+    """
+    Picks the wait before a target's next pass from how its recent passes went
+    """
+
+    def __init__(self, config):
+        """
+        Start at the configured polling frequency, within the configured bounds
+        """
+
+        self._config = config
+        self._interval = min(max(config.polling_frequency, config.polling_minimum), config.polling_maximum)
+        self._failures = 0
+
+    @property
+    def interval(self):
+        """
+        The current wait between passes which do not fail
+        """
+        return self._interval
+
+    def get_next_interval(self, exception, update_count, complete):
+        """
+        Get the wait before the next pass, given the outcome of the last one:
+        the exception it failed with if any, the number of updates it synced, and t/f whether it synced everything
+        """
+
+        config = self._config
+
+        # A pass which did not get through everything, e.g. falling behind other targets, is busy rather than failing
+        if exception is not None and not isinstance(exception, CustomExceptions.SyncIncompleteError):
+            self._failures += 1
+            backoff = min(config.polling_retry_minimum * 2 ** (self._failures - 1), config.polling_maximum)
+            backoff *= random.uniform(1 - POLLING_BACKOFF_JITTER, 1 + POLLING_BACKOFF_JITTER)
+            LOG.info('Backing off %s after %i failed passes', backoff, self._failures)
+            return max(backoff, timedelta(0))
+
+        self._failures = 0
+
+        if not complete or update_count >= config.polling_busy_updates:
+            self._interval = max(self._interval / POLLING_INTERVAL_FACTOR, config.polling_minimum)
+            LOG.info('Found %i updates; polling every %s', update_count, self._interval)
+        elif not update_count:
+            self._interval = min(self._interval * POLLING_INTERVAL_FACTOR, config.polling_maximum)
+            LOG.info('Found no updates; polling every %s', self._interval)
+
+        # Come back soon to what a pass did not get through
+        if not complete:
+            return min(self._interval, config.polling_retry_minimum)
+
+        return self._interval
+
+
+def get_schedule(config):
+    """
+    Get the schedule of the config's target, starting it on first use
+    """
+
+    with SCHEDULES_LOCK:
+        if config.profile_name not in SCHEDULES:
+            SCHEDULES[config.profile_name] = AdaptiveSchedule(config)
+        return SCHEDULES[config.profile_name]
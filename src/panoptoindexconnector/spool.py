@@ -0,0 +1,435 @@
+"""
+A durable spool of converted videos between fetching from Panopto and pushing to a target
+
+While a target is down, throttled or out of quota, its circuit breaker pauses pushing, and converted videos and
+deletes go on to the spool on disk instead; fetching carries on. Once the target recovers, the spool drains in order.
+
+The spool is a directory of append-only segment files of json lines, with a cursor file holding the position of
+the first record not yet pushed. Segments behind the cursor are deleted, and while the spool grows, its segments are
+compacted into one keeping only the latest record of each video. Videos pushed some other way, such as by a resync,
+are discarded from the spool, so that it never puts back older content once it drains.
+"""
+
+# Standard Library Imports
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+# Locking files is done differently on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Local
+from panoptoindexconnector.helpers import get_profile_state_filepath
+
+# Global constants
+LOG = logging.getLogger(__name__)
+
+# Segments are started once the last one reaches this size, and compacted once this many have been added since
+SPOOL_SEGMENT_BYTES = 16 * 1024 * 1024
+SPOOL_COMPACT_SEGMENTS = 4
+SPOOL_CURSOR_FILE = 'cursor.json'
+SPOOL_SEGMENT_PATTERN = re.compile(r'segment-(\d+)\.jsonl')
+
+# Spools opened, by directory, kept for as long as the process runs
+SPOOLS = {}
+SPOOLS_LOCK = threading.Lock()
+
+# Circuit breakers by target profile name, kept for as long as the process runs
+CIRCUIT_BREAKERS = {}
+CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+# The longest a circuit breaker stays open, however many failures in a row
+CIRCUIT_BREAKER_MAX_OPEN_SECONDS = 600
+
+
+class Spool:
+    """
+    A durable queue of (video id, target content, principal keys) to push to a target, target content being None
+    for a delete. The principal keys are those the video is synced with, recorded once it is pushed.
+
+    A resync or reconcile may use the spool from another process while the connector runs, so every operation
+    holds a lock file next to the spool's directory and reads the segments and cursor from disk again first.
+    """
+
+    def __init__(self, directory, segment_bytes=SPOOL_SEGMENT_BYTES):
+        """
+        Open the spool, creating its directory if it does not exist yet
+        """
+
+        self._directory = directory
+        self._segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._lock_path = directory.rstrip(os.sep) + '.lock'
+        self._segments = []
+        self._cursor = None
+
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            self._segments_since_compaction = len(self._segments)
+
+            # Segments behind the cursor were pushed; a compaction may have stopped before deleting them
+            if self._cursor:
+                for segment in [segment for segment in self._segments if segment < self._cursor[0]]:
+                    self._delete_segment(segment)
+
+    @property
+    def empty(self):
+        """
+        T/f whether everything spooled has been pushed
+        """
+        with self._locked():
+            return not self._segments
+
+    @property
+    def size(self):
+        """
+        The bytes spooled and not pushed yet
+        """
+        with self._locked():
+            size = sum(os.path.getsize(self._get_segment_path(segment)) for segment in self._segments)
+            return size - self._cursor[1] if self._cursor and self._segments else size
+
+    def append(self, converted_videos):
+        """
+        Add converted videos to the end of the spool, on disk before returning
+        """
+
+        if not converted_videos:
+            return
+
+        data = ''.join(json.dumps(list(converted_video)) + '\n' for converted_video in converted_videos)
+
+        with self._locked():
+            if not self._segments or os.path.getsize(self._get_segment_path(self._segments[-1])) >= self._segment_bytes:
+                self._start_segment()
+
+            with open(self._get_segment_path(self._segments[-1]), 'a', encoding='utf-8') as file_handle:
+                file_handle.write(data)
+                file_handle.flush()
+                os.fsync(file_handle.fileno())
+
+    def read(self, count):
+        """
+        Read up to count converted videos from the front of the spool, without removing them
+        :returns: (converted videos, the position to acknowledge once they are pushed)
+        """
+
+        with self._locked():
+            converted_videos = []
+            if not self._segments:
+                return converted_videos, None
+            position = self._cursor or (self._segments[0], 0)
+
+            for segment in self._segments:
+                if segment < position[0]:
+                    continue
+                with open(self._get_segment_path(segment), 'rb') as file_handle:
+                    file_handle.seek(position[1] if segment == position[0] else 0)
+                    while len(converted_videos) < count:
+                        line = file_handle.readline()
+                        if not line:
+                            break
+                        converted_videos.append(tuple(json.loads(line)))
+                    position = (segment, file_handle.tell())
+                if len(converted_videos) >= count:
+                    break
+
+        return converted_videos, position
+
+    def acknowledge(self, position):
+        """
+        Remove everything up to a position returned by read, once pushed. If the spool was rewritten since the read,
+        by a compaction or a discard, what was read stays spooled, to be pushed again.
+        """
+
+        with self._locked():
+            segment, offset = position
+            if segment not in self._segments:
+                LOG.debug('Spool %s was rewritten since it was read; pushing what was read again', self._directory)
+                return
+
+            # All pushed; start over
+            if segment == self._segments[-1] and offset >= os.path.getsize(self._get_segment_path(segment)):
+                for spooled_segment in list(self._segments):
+                    self._delete_segment(spooled_segment)
+                self._write_cursor(None)
+                self._segments_since_compaction = 0
+                return
+
+            self._write_cursor(position)
+            for spooled_segment in [spooled_segment for spooled_segment in self._segments if spooled_segment < segment]:
+                self._delete_segment(spooled_segment)
+
+    def discard(self, video_ids):
+        """
+        Drop what is spooled for videos, once they are pushed some other way
+        """
+
+        video_ids = set(video_ids)
+        with self._locked():
+            if not self._segments or not video_ids:
+                return
+
+            discarded_lines = {
+                index for index, line in enumerate(self._iterate_lines()) if json.loads(line)[0] in video_ids}
+            if discarded_lines:
+                self._rewrite(lambda index: index not in discarded_lines)
+                LOG.info('Discarded %i records pushed since they were spooled from %s',
+                         len(discarded_lines), self._directory)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the spool against other threads and processes, with its segments and cursor read from disk
+        """
+
+        with self._lock, open(self._lock_path, 'a+b') as lock_handle:
+            _lock_file(lock_handle)
+            try:
+                self._load()
+                yield
+            finally:
+                _unlock_file(lock_handle)
+
+    def _load(self):
+        """
+        Read the segments and cursor from disk, as another process may have changed them
+        """
+
+        self._segments = sorted(
+            int(match.group(1))
+            for match in map(SPOOL_SEGMENT_PATTERN.fullmatch, os.listdir(self._directory)) if match)
+
+        self._cursor = None
+        cursor_path = os.path.join(self._directory, SPOOL_CURSOR_FILE)
+        if os.path.exists(cursor_path):
+            with open(cursor_path) as file_handle:
+                self._cursor = tuple(json.load(file_handle))
+
+        # A write cut short leaves a partial last line, which was never acknowledged to the caller
+        if self._segments:
+            self._truncate_partial_line(self._segments[-1])
+
+    def _start_segment(self):
+        """
+        Start a new segment to append to, compacting the spool first if it has grown by enough segments
+        """
+
+        if self._segments_since_compaction >= SPOOL_COMPACT_SEGMENTS:
+            self._compact()
+
+        self._segments.append(self._segments[-1] + 1 if self._segments else 0)
+        self._segments_since_compaction += 1
+
+    def _compact(self):
+        """
+        Rewrite what is left to push as one segment holding only the latest record of each video
+        """
+
+        # Find the last record of each video first, so only the ids are held in memory
+        last_lines = {}
+        for index, line in enumerate(self._iterate_lines()):
+            last_lines[json.loads(line)[0]] = index
+
+        self._rewrite(set(last_lines.values()).__contains__)
+        LOG.info('Compacted spool %s to %i videos', self._directory, len(last_lines))
+
+    def _iterate_lines(self):
+        """
+        The lines left to push, in order
+        """
+        for segment in self._segments:
+            with open(self._get_segment_path(segment), 'rb') as file_handle:
+                if self._cursor and segment == self._cursor[0]:
+                    file_handle.seek(self._cursor[1])
+                yield from file_handle
+
+    def _rewrite(self, keep_line):
+        """
+        Rewrite what is left to push as one segment holding the lines for whose index keep_line holds,
+        or as nothing if it holds for none
+        """
+
+        rewritten_segment = self._segments[-1] + 1
+        rewritten_path = self._get_segment_path(rewritten_segment)
+        kept_count = 0
+        with open(rewritten_path + '.tmp', 'wb') as file_handle:
+            for index, line in enumerate(self._iterate_lines()):
+                if keep_line(index):
+                    file_handle.write(line)
+                    kept_count += 1
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+
+        if not kept_count:
+            os.remove(rewritten_path + '.tmp')
+            self._write_cursor(None)
+        else:
+            os.replace(rewritten_path + '.tmp', rewritten_path)
+            self._write_cursor((rewritten_segment, 0))
+
+        for segment in list(self._segments):
+            self._delete_segment(segment)
+        self._segments = [rewritten_segment] if kept_count else []
+        self._segments_since_compaction = 0
+
+    def _delete_segment(self, segment):
+        """
+        Delete a segment file
+        """
+        os.remove(self._get_segment_path(segment))
+        if segment in self._segments:
+            self._segments.remove(segment)
+
+    def _get_segment_path(self, segment):
+        """
+        The path of a segment file
+        """
+        return os.path.join(self._directory, 'segment-%08i.jsonl' % segment)
+
+    def _truncate_partial_line(self, segment):
+        """
+        Cut a segment back to its last complete line
+        """
+        with open(self._get_segment_path(segment), 'rb+') as file_handle:
+            # Only the last byte needs reading when the segment ends in a complete line, as it almost always does
+            if file_handle.seek(0, os.SEEK_END) == 0:
+                return
+            file_handle.seek(-1, os.SEEK_END)
+            if file_handle.read(1) == b'\n':
+                return
+            file_handle.seek(0)
+            data = file_handle.read()
+            LOG.warning('Dropping a partly written record from spool %s', self._directory)
+            file_handle.truncate(data.rfind(b'\n') + 1)
+
+    def _write_cursor(self, position):
+        """
+        Save the position of the first record not pushed yet, or remove it when the spool is empty
+        """
+
+        self._cursor = position
+        cursor_path = os.path.join(self._directory, SPOOL_CURSOR_FILE)
+        if position is None:
+            if os.path.exists(cursor_path):
+                os.remove(cursor_path)
+            return
+
+        with open(cursor_path + '.tmp', 'w') as file_handle:
+            json.dump(list(position), file_handle)
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+        os.replace(cursor_path + '.tmp', cursor_path)
+
+
+class CircuitBreaker:
+    """
+    Pauses pushing to a target after a failure: the breaker opens for a while, twice as long with each failure in
+    a row, then lets one attempt through; a success closes it again
+    """
+
+    def __init__(self, name, open_seconds):
+        """
+        Start closed
+        """
+
+        self._name = name
+        self._open_seconds = open_seconds
+        self._failures = 0
+        self._open_until = None
+
+    @property
+    def closed(self):
+        """
+        T/f whether pushing goes ahead as usual
+        """
+        return self._open_until is None
+
+    def allows_attempt(self):
+        """
+        T/f whether to try pushing now: the breaker is closed, or has been open long enough to try again
+        """
+        return self._open_until is None or time.monotonic() >= self._open_until
+
+    def record_failure(self, exception):
+        """
+        Open the breaker after a failed attempt
+        """
+
+        self._failures += 1
+        open_seconds = min(self._open_seconds * 2 ** (self._failures - 1), CIRCUIT_BREAKER_MAX_OPEN_SECONDS)
+        self._open_until = time.monotonic() + open_seconds
+        LOG.warning('Pausing pushes to %s for %i seconds after %i failures in a row | %s',
+                    self._name, open_seconds, self._failures, exception)
+
+    def record_success(self):
+        """
+        Close the breaker after a successful attempt
+        """
+
+        if self._open_until is not None:
+            LOG.info('Resuming pushes to %s', self._name)
+        self._failures = 0
+        self._open_until = None
+
+
+def _lock_file(file_handle):
+    """
+    Wait for an exclusive lock of an open file, held against other processes
+    """
+
+    if fcntl:
+        fcntl.flock(file_handle.fileno(), fcntl.LOCK_EX)
+        return
+
+    # Windows gives up on a lock after 10 seconds, so keep waiting
+    file_handle.seek(0)
+    while True:
+        try:
+            msvcrt.locking(file_handle.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            LOG.debug('Still waiting for the lock of %s', file_handle.name)
+
+
+def _unlock_file(file_handle):
+    """
+    Release the lock of a file taken by _lock_file
+    """
+
+    if fcntl:
+        fcntl.flock(file_handle.fileno(), fcntl.LOCK_UN)
+    else:
+        file_handle.seek(0)
+        msvcrt.locking(file_handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def get_circuit_breaker(config):
+    """
+    Get the circuit breaker of the config's target, starting it closed on first use
+    """
+
+    with CIRCUIT_BREAKERS_LOCK:
+        if config.profile_name not in CIRCUIT_BREAKERS:
+            CIRCUIT_BREAKERS[config.profile_name] = CircuitBreaker(config.profile_name, config.spool_retry_seconds)
+        return CIRCUIT_BREAKERS[config.profile_name]
+
+
+def get_spool(config):
+    """
+    Get the spool of the config's target, next to its other local state, opening it on first use
+    """
+
+    directory = get_profile_state_filepath(config.profile_name) + '.spool'
+    with SPOOLS_LOCK:
+        if directory not in SPOOLS:
+            SPOOLS[directory] = Spool(directory)
+        return SPOOLS[directory]
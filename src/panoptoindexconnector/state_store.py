@@ -0,0 +1,253 @@
+"""
+Local state kept between sync passes for a connector profile
+
+The state lives in a sqlite database next to the profile's last update time file, and holds
+compact sets of members (e.g. the ids of items known to be in the target) and json values.
+"""
+
+# Standard Library Imports
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+# Local
+from panoptoindexconnector.helpers import get_profile_state_filepath
+
+# Global constants
+LOG = logging.getLogger(__name__)
+
+# Open stores by file path, shared by everything in the process using the same profile
+STATE_STORES = {}
+STATE_STORES_LOCK = threading.Lock()
+
+# Leads the 16 raw bytes of a GUID member. Other members are stored as utf-8, which never starts with a NUL byte.
+GUID_TAG = b'\x00'
+
+
+class StateStore:
+    """
+    A sqlite backed store of sets and values which persists between sync passes
+    """
+
+    def __init__(self, file_path):
+        """
+        Open the store, creating it if it does not exist yet
+        """
+
+        self._file_path = file_path
+        self._lock = threading.RLock()
+
+        self._connection = sqlite3.connect(file_path, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS members ('
+            'namespace TEXT NOT NULL, member BLOB NOT NULL, '
+            'PRIMARY KEY (namespace, member)) WITHOUT ROWID')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT, updated REAL NOT NULL, '
+            'PRIMARY KEY (namespace, key)) WITHOUT ROWID')
+
+        LOG.debug('Opened state store %s', file_path)
+
+    @property
+    def file_path(self):
+        """
+        The location of the store on disk
+        """
+        return self._file_path
+
+    #
+    # Sets
+    #
+
+    def add(self, namespace, *members):
+        """
+        Add members to the set in a namespace
+        """
+        with self._lock:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO members (namespace, member) VALUES (?, ?)',
+                ((namespace, _to_blob(member)) for member in members))
+
+    def discard(self, namespace, *members):
+        """
+        Remove members from the set in a namespace if present
+        """
+        with self._lock:
+            self._connection.executemany(
+                'DELETE FROM members WHERE namespace = ? AND member = ?',
+                ((namespace, _to_blob(member)) for member in members))
+
+    def contains(self, namespace, member):
+        """
+        T/f whether the member is in the set in a namespace
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM members WHERE namespace = ? AND member = ?',
+                (namespace, _to_blob(member))).fetchone()
+        return row is not None
+
+    def count(self, namespace):
+        """
+        The number of members in the set in a namespace
+        """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM members WHERE namespace = ?', (namespace,)).fetchone()[0]
+
+    def difference(self, namespace, other_namespace, batch_size=1000):
+        """
+        Iterate over the members of the set in a namespace which are not in the set in another, in sorted order.
+        Members are read in batches, so sets of millions of ids can be compared without holding them in memory.
+        """
+        last_member = b''
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    'SELECT member FROM members WHERE namespace = ? AND member > ? AND member NOT IN '
+                    '(SELECT member FROM members WHERE namespace = ?) ORDER BY member LIMIT ?',
+                    (namespace, last_member, other_namespace, batch_size)).fetchall()
+            for row in rows:
+                yield _from_blob(row[0])
+            if len(rows) < batch_size:
+                return
+            last_member = rows[-1][0]
+
+    def intersection(self, namespace, other_namespace, batch_size=1000):
+        """
+        Iterate over the members of the set in a namespace which are also in the set in another, in sorted order,
+        reading them in batches as difference does
+        """
+        last_member = b''
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    'SELECT member FROM members WHERE namespace = ? AND member > ? AND member IN '
+                    '(SELECT member FROM members WHERE namespace = ?) ORDER BY member LIMIT ?',
+                    (namespace, last_member, other_namespace, batch_size)).fetchall()
+            for row in rows:
+                yield _from_blob(row[0])
+            if len(rows) < batch_size:
+                return
+            last_member = rows[-1][0]
+
+    def clear(self, namespace):
+        """
+        Remove all members and values in a namespace
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM members WHERE namespace = ?', (namespace,))
+            self._connection.execute('DELETE FROM entries WHERE namespace = ?', (namespace,))
+
+    #
+    # Values
+    #
+
+    def get(self, namespace, key, default=None, max_age=None):
+        """
+        Get the json value of a key in a namespace, or the default if it is missing
+        or was last set more than max_age seconds ago
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value, updated FROM entries WHERE namespace = ? AND key = ?',
+                (namespace, key)).fetchone()
+        if row is None or (max_age is not None and row[1] < time.time() - max_age):
+            return default
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value):
+        """
+        Set the json value of a key in a namespace
+        """
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO entries (namespace, key, value, updated) VALUES (?, ?, ?, ?)',
+                (namespace, key, json.dumps(value), time.time()))
+
+    def entries(self, namespace, limit=None):
+        """
+        Get the (key, json value) pairs in a namespace in key order, all of them or the first limit
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT key, value FROM entries WHERE namespace = ? ORDER BY key LIMIT ?',
+                (namespace, -1 if limit is None else limit)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def keys(self, namespace, batch_size=1000):
+        """
+        Iterate over the keys in a namespace in sorted order, reading them in batches
+        """
+        last_key = ''
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    'SELECT key FROM entries WHERE namespace = ? AND key > ? ORDER BY key LIMIT ?',
+                    (namespace, last_key, batch_size)).fetchall()
+            for row in rows:
+                yield row[0]
+            if len(rows) < batch_size:
+                return
+            last_key = rows[-1][0]
+
+    def sample_keys(self, namespace, count):
+        """
+        Get up to count keys of a namespace at random
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT key FROM entries WHERE namespace = ? ORDER BY RANDOM() LIMIT ?', (namespace, count)).fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, namespace, key):
+        """
+        Remove a key from a namespace if present
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def close(self):
+        """
+        Close the underlying database
+        """
+        with self._lock:
+            self._connection.close()
+
+
+def get_state_store(config):
+    """
+    Get the state store of the config's profile, opening it on first use
+    """
+
+    file_path = get_profile_state_filepath(config.profile_name) + '.db'
+
+    with STATE_STORES_LOCK:
+        if file_path not in STATE_STORES:
+            STATE_STORES[file_path] = StateStore(file_path)
+        return STATE_STORES[file_path]
+
+
+def _to_blob(member):
+    """
+    Store GUIDs as their 16 raw bytes, tagged, to keep sets of millions of ids compact; anything else as utf-8
+    """
+    try:
+        return GUID_TAG + uuid.UUID(member).bytes
+    except ValueError:
+        return member.encode('utf-8')
+
+
+def _from_blob(blob):
+    """
+    Read a member back, by its tag rather than its length
+    """
+    if blob[:1] == GUID_TAG:
+        return str(uuid.UUID(bytes=blob[1:]))
+    return blob.decode('utf-8')
@@ -0,0 +1,171 @@
+"""
+Priority lanes for the updates a target has fetched ahead
+
+Updates arrive in update time order, so a delete or a permission removal behind a large backlog would otherwise
+wait for every content update before it. Updates which take content away from people - deleted videos, and videos
+which lost principals since last synced to the target - are taken out of every page fetched ahead and synced first.
+Everything else is synced page by page, and a target's last update time only moves past pages with nothing left to do.
+Videos triggered on demand while a pass is under way go ahead of all of them.
+"""
+
+# Standard Library Imports
+from collections import deque
+import logging
+
+# Global constants
+LOG = logging.getLogger(__name__)
+
+# State store namespace holding the principals each video was last synced to the target with
+PRINCIPALS_STATE_NAMESPACE = 'connector:principals'
+
+
+class SyncWindow:
+    """
+    The pages of updates fetched ahead for a target and not synced yet, each update being
+    (video id, update time, video content response)
+    """
+
+    def __init__(self, state_store):
+        """
+        Start with no pages, judging principal changes by what the state store recorded
+        """
+
+        self._state_store = state_store
+        self._pages = deque()
+        self._triggered_updates = []
+
+    def __len__(self):
+        """
+        The number of pages with updates left to sync, counting triggered updates as one
+        """
+        return len(self._pages) + bool(self._triggered_updates)
+
+    def add_page(self, updates, is_last_page):
+        """
+        Add the next page of updates, picking out its priority updates. An update supersedes those of the same
+        video before it still waiting, so that syncing out of order never leaves older content in the target.
+        """
+
+        latest_updates = self._supersede(updates)
+
+        page = {
+            'priority_updates': [],
+            'updates': [],
+            'last_update_time': updates[-1][1] if updates else None,
+            'update_count': len(updates),
+            'is_last_page': is_last_page,
+        }
+        for update in updates:
+            if latest_updates[update[0]] is not update:
+                continue
+            page['priority_updates' if is_priority_update(self._state_store, update) else 'updates'].append(update)
+        self._pages.append(page)
+
+    def add_triggered_updates(self, updates):
+        """
+        Add updates fetched on demand, to sync ahead of every page without moving the watermark.
+        They supersede the updates of the same videos still waiting, as a page would.
+        """
+        latest_updates = self._supersede(updates)
+        self._triggered_updates.extend(latest_updates.values())
+
+    def take_priority_updates(self):
+        """
+        Take the triggered updates, then the priority updates of every page not taken yet, in update time order
+        """
+
+        if self._triggered_updates:
+            LOG.info('Syncing %i triggered videos ahead of other updates', len(self._triggered_updates))
+        priority_updates, self._triggered_updates = self._triggered_updates, []
+        triggered_count = len(priority_updates)
+        for page in self._pages:
+            priority_updates.extend(page['priority_updates'])
+            page['priority_updates'] = []
+
+        if len(priority_updates) > triggered_count:
+            LOG.info('Syncing %i deletes and permission removals ahead of other updates',
+                     len(priority_updates) - triggered_count)
+        return priority_updates
+
+    def take_page(self):
+        """
+        Take the first page, once its priority updates are taken
+        :returns: (updates left to sync, the page's last update time or None, its number of updates, t/f is last page)
+        """
+
+        page = self._pages.popleft()
+        assert not page['priority_updates'], 'Priority updates must be taken before their page'
+        return page['updates'], page['last_update_time'], page['update_count'], page['is_last_page']
+
+    def _supersede(self, updates):
+        """
+        Drop the updates still waiting for the videos of newer updates
+        :returns: {video id: the latest of the newer updates of the video}
+        """
+
+        latest_updates = {update[0]: update for update in updates}
+        self._triggered_updates = [update for update in self._triggered_updates if update[0] not in latest_updates]
+        for page in self._pages:
+            for lane in ('priority_updates', 'updates'):
+                page[lane] = [update for update in page[lane] if update[0] not in latest_updates]
+        return latest_updates
+
+
+def get_principal_keys(video_content_response):
+    """
+    Get the principals of a video, formatted as <User|Group>:<IdProvider>:<Name>
+    """
+
+    principal_keys = set()
+    for principal in (video_content_response.get('VideoContent') or {}).get('Principals') or []:
+        principal_type = 'User' if principal.get('Username') else 'Group'
+        principal_keys.add('%s:%s:%s' % (
+            principal_type,
+            principal.get('IdentityProvider') or 'Panopto',
+            principal.get(principal_type + 'name')))
+    return principal_keys
+
+
+def is_priority_update(state_store, update):
+    """
+    T/f whether an update takes content away from people: a deleted video,
+    or one missing principals it was last synced to the target with
+    """
+
+    video_id, _, video_content_response = update
+    if video_content_response['Deleted']:
+        return True
+
+    synced_principal_keys = state_store.get(PRINCIPALS_STATE_NAMESPACE, video_id)
+    return synced_principal_keys is not None and \
+        not set(synced_principal_keys) <= get_principal_keys(video_content_response)
+
+
+def record_synced_updates(state_store, updates):
+    """
+    Record the principals of updates synced to the target, to tell when they lose some
+    """
+    record_synced_principals(state_store, [
+        (video_id, None if video_content_response['Deleted'] else get_synced_principal_keys(video_content_response))
+        for video_id, _, video_content_response in updates
+    ])
+
+
+def get_synced_principal_keys(video_content_response):
+    """
+    Get the principals of a video as recorded once it is synced
+    """
+    return sorted(get_principal_keys(video_content_response))
+
+
+def record_synced_principals(state_store, synced_principals):
+    """
+    Record the principal keys videos were synced to the target with, given as (video id, principal keys),
+    the principal keys being None for a deleted video
+    """
+
+    for video_id, principal_keys in synced_principals:
+        if principal_keys is None:
+            state_store.delete(PRINCIPALS_STATE_NAMESPACE, video_id)
+        else:
+            state_store.set(PRINCIPALS_STATE_NAMESPACE, video_id, principal_keys)
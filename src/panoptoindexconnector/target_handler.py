@@ -5,27 +5,43 @@ Implement these methods for the connector application
 """
 
 # Standard Library Imports
-from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import importlib.util
 import inspect
+import json
 import logging
+import math
 import os
+import threading
 
 # Local
 from panoptoindexconnector.connector_config import ConnectorConfig
+from panoptoindexconnector.state_store import get_state_store
 
 # Global constants
 DIR = os.path.dirname(os.path.realpath(__file__))
 LOG = logging.getLogger(__name__)
 
+# Implementation modules loaded for each profile and each target of profiles which sync to several, by profile name
+TARGET_IMPLEMENTATION_MODULES = {}
+TARGET_IMPLEMENTATION_MODULES_LOCK = threading.Lock()
+
+# State store namespaces holding hashes of each field of the content last synced for each video,
+# and the set of videos last synced as deleted
+FIELD_HASHES_STATE_NAMESPACE = 'connector:field_hashes'
+DELETED_STATE_NAMESPACE = 'connector:deleted'
+
 
 class TargetHandler:
     """
     Handle target conversions, reads, and writes
     """
 
-    def __init__(self, config):
+    def __init__(self, config, push_in_full=False):
         """
-        Initialize the TargetHandler based on the ConnectorConfig
+        Initialize the TargetHandler based on the ConnectorConfig.
+        Pushing in full skips change detection, pushing every update whole whether it changed or not.
         """
         assert isinstance(config, ConnectorConfig), 'config should be a ConnectorConfig object; got %s' % type(config)
 
@@ -39,15 +55,51 @@ class TargetHandler:
 
         # Inject the dependency
         try:
-            self._implementation_module = import_module(
-                'panoptoindexconnector.implementations.%s' % config.target_implementation
-            )
+            self._implementation_module = _import_implementation(config)
         except ImportError:
             LOG.exception(
                 'Failed to import implementation module panoptoindexconnector.%s', config.target_implementation)
             raise
         LOG.debug('Implementation module = %s', self._implementation_module)
 
+        self._initialized = False
+        self._push_in_full = push_in_full
+
+        # Field hashes of content pushed or deleted (None) since the last flush, recorded once flushed
+        self._pending_field_hashes = {}
+
+    @property
+    def initialized(self):
+        """
+        T/f whether initialization has been run
+        """
+        return self._initialized
+
+    @property
+    def lazy_initialization(self):
+        """
+        T/f whether the implementation declares it safe to initialize only once there is an update to sync
+        """
+        return getattr(self._implementation_module, 'LAZY_INITIALIZATION', False)
+
+    def begin_rebuild(self):
+        """
+        Take custom actions at the start of each sync pass of a rebuild, if needed.
+        A rebuild pushes everything in full, changed or not.
+        """
+        self._push_in_full = True
+        function = self._get_function_by_implementation('begin_rebuild')
+        if function:
+            function(self._config)
+
+    def complete_rebuild(self):
+        """
+        Take custom actions once a rebuild has synced everything, if needed
+        """
+        function = self._get_function_by_implementation('complete_rebuild')
+        if function:
+            function(self._config)
+
     def convert_to_target(self, panopto_video_content):
         """
         Implement this method to convert to target format
@@ -59,6 +111,8 @@ class TargetHandler:
         """
         Take custom initialization actions if needed
         """
+        # Teardown follows even if initialization fails partway
+        self._initialized = True
         function = self._get_function_by_implementation('initialize')
         if function:
             function(self._config)
@@ -69,20 +123,136 @@ class TargetHandler:
         """
         self._implementation_module.delete_from_target(
             video_id, self._config)
+        self._pending_field_hashes[video_id] = None
 
-    def push_to_target(self, target_content, config):
+    def flush(self):
         """
-        Implement this method to push converted content to the target
+        Write out any content the implementation has buffered, if it buffers content,
+        then record what was synced for change detection and reconciliation.
+
+        Implementations may return the ids of the videos the target rejected since the last flush. Those are not
+        recorded as synced, and a rejected push is pushed in full the next time the video is synced.
+        """
+        function = self._get_function_by_implementation('flush')
+        failed_video_ids = None
+        if function and self._initialized:
+            failed_video_ids = function(self._config)
+
+        if failed_video_ids:
+            state_store = get_state_store(self._config)
+            LOG.warning('Not recording %i videos the target rejected as synced', len(failed_video_ids))
+            for video_id in failed_video_ids:
+                if self._pending_field_hashes.pop(video_id, None) is not None:
+                    state_store.delete(FIELD_HASHES_STATE_NAMESPACE, video_id)
+
+        if self._pending_field_hashes:
+            state_store = get_state_store(self._config)
+            for video_id, field_hashes in self._pending_field_hashes.items():
+                if field_hashes is None:
+                    state_store.delete(FIELD_HASHES_STATE_NAMESPACE, video_id)
+                    state_store.add(DELETED_STATE_NAMESPACE, video_id)
+                else:
+                    state_store.set(FIELD_HASHES_STATE_NAMESPACE, video_id, field_hashes)
+                    state_store.discard(DELETED_STATE_NAMESPACE, video_id)
+            self._pending_field_hashes = {}
+
+    def get_from_target(self, video_id):
+        """
+        Get what the target holds for a video, in the form of converted content, if the implementation can read it
+        :returns: the content, or None if the video is not in the target
+        """
+        return self._get_function_by_implementation('get_from_target')(video_id, self._config)
+
+    @property
+    def can_get_from_target(self):
+        """
+        T/f whether the implementation can read back what the target holds for a video
+        """
+        return self._get_function_by_implementation('get_from_target') is not None
+
+    def list_target_ids(self):
+        """
+        Get the ids of the videos in the target, if the implementation can list them
+        :returns: an iterable of video ids, or None
         """
-        self._implementation_module.push_to_target(
-            target_content, config)
+        function = self._get_function_by_implementation('list_target_ids')
+        return function(self._config) if function else None
+
+    def push_to_target(self, target_content, config, video_id=None):
+        """
+        Implement this method to push converted content to the target.
+
+        Given the video id, only what changed since the video was last synced is pushed: nothing if nothing changed,
+        and just the changed fields if the implementation supports partial updates.
+        """
+        if video_id is None or not isinstance(target_content, dict):
+            self._implementation_module.push_to_target(
+                target_content, config)
+            return
+
+        field_hashes = get_field_hashes(target_content)
+        synced_field_hashes = None
+        if config.change_detection and not self._push_in_full and video_id not in self._pending_field_hashes:
+            synced_field_hashes = get_state_store(config).get(FIELD_HASHES_STATE_NAMESPACE, video_id)
+        self._pending_field_hashes[video_id] = field_hashes
+
+        if synced_field_hashes is None:
+            self._implementation_module.push_to_target(
+                target_content, config)
+            return
+
+        changed_fields = sorted(
+            field for field in set(field_hashes) | set(synced_field_hashes)
+            if field_hashes.get(field) != synced_field_hashes.get(field))
+        partial_function = self._get_function_by_implementation('push_partial_to_target')
+
+        if not changed_fields:
+            LOG.info('Skipping push of video %s, unchanged since last synced', video_id)
+        elif partial_function and len(changed_fields) < len(field_hashes):
+            LOG.info('Pushing changed fields %s of video %s', changed_fields, video_id)
+            partial_function(target_content, changed_fields, config)
+        else:
+            self._implementation_module.push_to_target(
+                target_content, config)
+
+    def resolve_to_target(self, target_contents):
+        """
+        Resolve converted contents against the target before they are pushed, if the implementation needs to.
+        Contents are split across the configured number of resolve workers.
+        """
+        function = self._get_function_by_implementation('resolve_to_target')
+        if not function or not target_contents:
+            return
+
+        workers = min(self._config.resolve_workers, len(target_contents))
+        if workers <= 1:
+            function(target_contents, self._config)
+            return
+
+        chunk_size = math.ceil(len(target_contents) / workers)
+        chunks = [target_contents[start:start + chunk_size] for start in range(0, len(target_contents), chunk_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Consume the results so any worker exception is raised here
+            list(executor.map(lambda chunk: function(chunk, self._config), chunks))
+
+    def reset(self):
+        """
+        Tear down and drop what was pending after a failure, so the implementation is initialized again
+        before the next push
+        """
+        try:
+            self.teardown()
+        except Exception as ex:  # pylint: disable=broad-except
+            LOG.warning('Failed to tear down %s after a failure | %s', self._config.profile_name, ex)
+        self._initialized = False
+        self._pending_field_hashes = {}
 
     def teardown(self):
         """
         Take custom initialization actions if needed
         """
         function = self._get_function_by_implementation('teardown')
-        if function:
+        if function and self._initialized:
             function(self._config)
 
     def _get_function_by_implementation(self, name):
@@ -96,3 +266,51 @@ class TargetHandler:
                 and m[0] == name
             ),
             None)
+
+
+def get_field_hashes(target_content):
+    """
+    Hash each top level field of converted content, to tell which fields changed between syncs
+    """
+    return {
+        field: hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+        for field, value in target_content.items()
+    }
+
+
+def has_drifted(target_content, content_from_target):
+    """
+    T/f whether what the target holds for a video differs from the video's converted content, counting a video
+    missing from the target or left in it when it should be gone. Only the fields the target returns are compared.
+    Content the implementation skips syncing, e.g. with none of its principals resolved, should be gone.
+    """
+    if target_content is not None and target_content.get('skip_sync'):
+        target_content = None
+
+    if target_content is None or content_from_target is None:
+        return (target_content is None) != (content_from_target is None)
+
+    field_hashes = get_field_hashes(target_content)
+    target_field_hashes = get_field_hashes(
+        {field: value for field, value in content_from_target.items() if field in field_hashes})
+    return any(field_hashes[field] != field_hash for field, field_hash in target_field_hashes.items())
+
+
+def _import_implementation(config):
+    """
+    Import the implementation module of the config. Each profile, and each target of a profile which syncs to
+    several, gets its own instance of the module, so what implementations keep in module globals - pending batches,
+    sessions, cached ids - isn't shared between profiles syncing at the same time or between targets.
+    """
+
+    module_name = 'panoptoindexconnector.implementations.%s' % config.target_implementation
+
+    with TARGET_IMPLEMENTATION_MODULES_LOCK:
+        if config.profile_name not in TARGET_IMPLEMENTATION_MODULES:
+            spec = importlib.util.find_spec(module_name)
+            if spec is None:
+                raise ImportError('No implementation module %s' % module_name)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            TARGET_IMPLEMENTATION_MODULES[config.profile_name] = module
+        return TARGET_IMPLEMENTATION_MODULES[config.profile_name]
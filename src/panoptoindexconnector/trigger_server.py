@@ -0,0 +1,154 @@
+"""
+A local HTTP listener to trigger syncs on demand
+
+Other systems which know when a video changed (e.g. its permissions in an LMS) can have it synced right away,
+or ask for a sync pass now, instead of waiting for the next poll:
+
+    POST /videos  with a json list of video ids, or {"videoIds": [...]}
+    POST /sync
+"""
+
+# Standard Library Imports
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import json
+import logging
+import threading
+import uuid
+
+# Global constants
+LOG = logging.getLogger(__name__)
+
+# Requests with larger bodies are refused
+TRIGGER_MAX_BODY_BYTES = 1024 * 1024
+
+
+class SyncTriggers:
+    """
+    The video ids and sync now signals received, waiting for the run loop, or a pass under way, to act on them
+    """
+
+    def __init__(self):
+        """
+        Start with nothing triggered
+        """
+        self._condition = threading.Condition()
+        self._video_ids = {}
+        self._sync_now = False
+
+    def add_video_ids(self, video_ids):
+        """
+        Queue videos to sync right away, each once however often it is triggered
+        """
+        with self._condition:
+            self._video_ids.update(dict.fromkeys(video_ids))
+            self._condition.notify_all()
+
+    def request_sync(self):
+        """
+        Ask for a sync pass right away
+        """
+        with self._condition:
+            self._sync_now = True
+            self._condition.notify_all()
+
+    def take(self):
+        """
+        Take what was triggered so far
+        :returns: (video_ids, sync_now)
+        """
+        with self._condition:
+            triggered = list(self._video_ids), self._sync_now
+            self._video_ids = {}
+            self._sync_now = False
+        return triggered
+
+    def take_video_ids(self):
+        """
+        Take the video ids triggered so far, leaving any sync now signal for the run loop
+        """
+        with self._condition:
+            video_ids = list(self._video_ids)
+            self._video_ids = {}
+        return video_ids
+
+    def wait(self, timeout_seconds):
+        """
+        Wait up to the timeout for something to be triggered
+        :returns: t/f whether something was triggered
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._video_ids or self._sync_now, timeout=timeout_seconds)
+
+
+class TriggerRequestHandler(BaseHTTPRequestHandler):
+    """
+    Accepts triggers, checking the bearer token if the server has one
+    """
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        LOG.debug('Trigger request from %s: ' + format, self.client_address[0], *args)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Queue the video ids or sync now signal posted
+        """
+
+        token = self.server.trigger_token
+        if token and not hmac.compare_digest(self.headers.get('Authorization', ''), 'Bearer ' + token):
+            self._respond(401, {'error': 'Unauthorized'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > TRIGGER_MAX_BODY_BYTES:
+            self._respond(413, {'error': 'Body too large'})
+            return
+        body = self.rfile.read(length) if length else b''
+
+        if self.path.rstrip('/') == '/sync':
+            self.server.triggers.request_sync()
+            LOG.info('Received trigger to sync now')
+            self._respond(202, {'sync': True})
+
+        elif self.path.rstrip('/') == '/videos':
+            try:
+                video_ids = json.loads(body)
+                if isinstance(video_ids, dict):
+                    video_ids = video_ids['videoIds']
+                video_ids = [str(uuid.UUID(video_id)) for video_id in video_ids]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self._respond(400, {'error': 'Expected a json list of video ids, or {"videoIds": [...]}'})
+                return
+            self.server.triggers.add_video_ids(video_ids)
+            LOG.info('Received trigger to sync %i videos', len(video_ids))
+            self._respond(202, {'videoIds': video_ids})
+
+        else:
+            self._respond(404, {'error': 'Not found'})
+
+    def _respond(self, status, body):
+        """
+        Send a json response
+        """
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_trigger_server(config, triggers):
+    """
+    Start listening for triggers on the configured address and port, in the background
+    """
+
+    server = ThreadingHTTPServer((config.trigger_address, config.trigger_port), TriggerRequestHandler)
+    server.daemon_threads = True
+    server.triggers = triggers
+    server.trigger_token = config.trigger_token
+
+    threading.Thread(target=server.serve_forever, name='trigger-server', daemon=True).start()
+    LOG.info('Listening for sync triggers on %s:%i', *server.server_address)
+
+    return server
@@ -0,0 +1,61 @@
+"""
+Fixtures for testing target implementations against local stand-ins for their APIs.
+"""
+
+# Standard Library Imports
+from http.server import ThreadingHTTPServer
+import os
+import threading
+
+# Third party
+import pytest
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+IMPLEMENTATIONS_DIR = os.path.join(DIR, '..', 'src', 'panoptoindexconnector', 'implementations')
+
+
+@pytest.fixture
+def start_stand_in_server():
+    """
+    Start a local server answering with a stand-in request handler, shut down after the test.
+    Stand-ins keep what they record in class attributes, which reset() empties before the server starts.
+    """
+
+    servers = []
+
+    def start(handler_class):
+        handler_class.reset()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def get_stand_in_config(monkeypatch, tmp_path):
+    """
+    Get the example config of an implementation pointed at a stand-in server, with settings overridden.
+    The local state store is kept out of the home directory.
+    """
+
+    from panoptoindexconnector.connector_config import ConnectorConfig
+
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('USERPROFILE', str(tmp_path))
+
+    def get_config(implementation_name, server, **settings):
+        config = ConnectorConfig(os.path.join(IMPLEMENTATIONS_DIR, implementation_name + '.yaml'))
+        # pylint: disable=protected-access
+        config._yaml_config['target_address'] = 'http://%s:%i' % server.server_address
+        config._yaml_config.update(settings)
+        return config
+
+    return get_config
@@ -0,0 +1,135 @@
+"""
+Tests for feeding Attivio through one ingest session, against a local stand-in for the Attivio ingest API.
+"""
+
+# Standard Library Imports
+from http.server import BaseHTTPRequestHandler
+import json
+import logging
+import os
+
+# Third party
+import pytest
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+class StandInAttivio(BaseHTTPRequestHandler):
+    """
+    Records ingest api calls and hands out sessions, which can be forgotten to simulate a restart
+    """
+
+    requests = []
+    sessions = set()
+    failures = []
+
+    @classmethod
+    def reset(cls):
+        cls.requests = []
+        cls.sessions = set()
+        cls.failures = []
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        _, _, _, operation, *session = self.path.split('/')
+        StandInAttivio.requests.append((operation, body))
+
+        if StandInAttivio.failures and operation != 'connect':
+            self._respond(*StandInAttivio.failures.pop(0))
+        elif operation == 'connect':
+            session_id = 'session-%i' % len(StandInAttivio.requests)
+            StandInAttivio.sessions.add(session_id)
+            self._respond(200, session_id)
+        elif session and session[0] in StandInAttivio.sessions:
+            self._respond(200, {})
+        else:
+            self._respond(404, {'message': 'Unknown session'})
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+@pytest.fixture
+def get_config(start_stand_in_server, get_stand_in_config):
+    server = start_stand_in_server(StandInAttivio)
+    return lambda: get_stand_in_config('attivio', server, batch_size=2)
+
+
+def test_attivio_session_feeds_batches(get_config):
+
+    from panoptoindexconnector.implementations import attivio_implementation as implementation
+
+    config = get_config()
+
+    implementation.initialize(config)
+    for index in range(3):
+        implementation.push_to_target({'id': 'video-%i' % index, 'fields': {}, 'permissions': []}, config)
+    implementation.delete_from_target('video-2', config)
+    implementation.delete_from_target('video-3', config)
+    implementation.flush(config)
+
+    operations = [operation for operation, _ in StandInAttivio.requests]
+    assert operations == ['connect', 'feedDocuments', 'delete', 'commit']
+    assert [document['id'] for document in StandInAttivio.requests[1][1]] == ['video-0', 'video-1']
+    # The delete replaced the queued feed of the same document
+    assert StandInAttivio.requests[2][1] == ['video-2', 'video-3']
+
+    # Attivio restarting loses the session; what was not committed is fed again to a new one
+    implementation.push_to_target({'id': 'video-4', 'fields': {}, 'permissions': []}, config)
+    implementation.push_to_target({'id': 'video-5', 'fields': {}, 'permissions': []}, config)
+    StandInAttivio.sessions.clear()
+    implementation.push_to_target({'id': 'video-6', 'fields': {}, 'permissions': []}, config)
+    implementation.flush(config)
+    implementation.teardown(config)
+
+    operations = [operation for operation, _ in StandInAttivio.requests[4:]]
+    assert operations == ['feedDocuments', 'feedDocuments', 'connect', 'feedDocuments', 'feedDocuments',
+                          'commit', 'disconnect']
+    assert [document['id'] for document in StandInAttivio.requests[7][1]] == ['video-4', 'video-5']
+    assert [document['id'] for document in StandInAttivio.requests[8][1]] == ['video-6']
+
+
+def test_attivio_session_lost_by_status(get_config):
+
+    import requests
+    from panoptoindexconnector.implementations import attivio_implementation as implementation
+
+    config = get_config()
+    try:
+        implementation.initialize(config)
+
+        # An expired session is refused; the feed goes again to a new session
+        StandInAttivio.failures = [(401, {'message': 'Unauthorized'})]
+        implementation.push_to_target({'id': 'video-0', 'fields': {}, 'permissions': []}, config)
+        implementation.push_to_target({'id': 'video-1', 'fields': {}, 'permissions': []}, config)
+        operations = [operation for operation, _ in StandInAttivio.requests]
+        assert operations == ['connect', 'feedDocuments', 'connect', 'feedDocuments']
+
+        # Other errors fail the feed without reconnecting, whatever they say
+        StandInAttivio.failures = [(500, {'message': 'Error while ingesting to session'})]
+        implementation.push_to_target({'id': 'video-2', 'fields': {}, 'permissions': []}, config)
+        with pytest.raises(requests.exceptions.HTTPError):
+            implementation.push_to_target({'id': 'video-3', 'fields': {}, 'permissions': []}, config)
+        operations = [operation for operation, _ in StandInAttivio.requests[4:]]
+        assert operations == ['feedDocuments']
+    finally:
+        implementation.teardown(config)
@@ -0,0 +1,315 @@
+"""
+Tests for sync passes, resyncs, reconciliation, audits and the spool, against stand-ins for Panopto and the targets.
+"""
+
+# Standard Library Imports
+from datetime import datetime, timedelta
+import logging
+import os
+import types
+
+# Third party
+import pytest
+
+# The connector reads its version with pywin32
+pytest.importorskip('win32api')
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+# Updates are listed this many at a time
+PAGE_SIZE = 2
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+class StandInPanopto:
+    """
+    Serves the updates listing and video content of videos held in memory, as the search index sync API would
+    """
+
+    def __init__(self, monkeypatch):
+        from panoptoindexconnector import connector
+        self.videos = {}
+        self.content_requests = []
+        monkeypatch.setattr(connector, 'renew_oauth_token_if_needed', lambda *_: ('token', datetime.max))
+        monkeypatch.setattr(connector, 'get_ids_to_update', self.get_ids_to_update)
+        monkeypatch.setattr(connector, 'get_video_content', self.get_video_content)
+
+    def update(self, video_id, minute, title=None, principals=None, deleted=False):
+        self.videos[video_id] = {
+            'UpdateTime': (datetime(2020, 1, 1) + timedelta(minutes=minute)).isoformat() + 'Z',
+            'Id': video_id,
+            'Deleted': deleted,
+            'VideoContent': None if deleted else {
+                'Title': title or video_id,
+                'Principals': principals or [{'Groupname': 'Public'}],
+            },
+        }
+
+    def get_ids_to_update(self, oauth_token, panopto_site_address, from_date, next_token):
+        from panoptoindexconnector.connector import parse_api_update_time
+        updates = sorted(
+            ({'VideoId': video_id, 'UpdateTime': video['UpdateTime']} for video_id, video in self.videos.items()
+             if parse_api_update_time(video['UpdateTime']) >= from_date),
+            key=lambda update: update['UpdateTime'])
+        start = int(next_token or 0)
+        end = start + PAGE_SIZE
+        return {'Updates': updates[start:end], 'NextToken': str(end) if end < len(updates) else None}
+
+    def get_video_content(self, oauth_token, panopto_site_address, video_id):
+        self.content_requests.append(video_id)
+        video = self.videos[video_id]
+        return {key: value for key, value in video.items() if key != 'UpdateTime'}
+
+
+def get_stand_in_target(monkeypatch, config):
+    """
+    An implementation module keeping documents in memory, which fails to push or delete while failing is set
+    """
+
+    from panoptoindexconnector import target_handler
+
+    target = types.ModuleType('stand_in_target')
+    target.documents = {}
+    target.pushes = []
+    target.deletes = []
+    target.failing = False
+    target.losing_deletes = False
+
+    def convert_to_target(panopto_content, config):
+        return {
+            'id': panopto_content['Id'],
+            'title': panopto_content['VideoContent']['Title'],
+            'principals': panopto_content['VideoContent']['Principals'],
+        }
+
+    def push_to_target(target_content, config):
+        if target.failing:
+            raise RuntimeError('target down')
+        target.documents[target_content['id']] = dict(target_content)
+        target.pushes.append(target_content['id'])
+
+    def delete_from_target(video_id, config):
+        if target.failing:
+            raise RuntimeError('target down')
+        target.deletes.append(video_id)
+        if not target.losing_deletes:
+            target.documents.pop(video_id, None)
+
+    def list_target_ids(config):
+        return list(target.documents)
+
+    def get_from_target(video_id, config):
+        return target.documents.get(video_id)
+
+    for function in (convert_to_target, push_to_target, delete_from_target, list_target_ids, get_from_target):
+        setattr(target, function.__name__, function)
+
+    monkeypatch.setitem(target_handler.TARGET_IMPLEMENTATION_MODULES, config.profile_name, target)
+    return target
+
+
+def get_config(monkeypatch, tmp_path, settings='', targets=None):
+    """
+    A profile syncing to stand-in targets, by name, or to one if no names are given
+    """
+
+    from panoptoindexconnector import spool
+    from panoptoindexconnector.connector_config import ConnectorConfig
+
+    # Keep the local state out of the home directory, and circuit breakers to the test
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('USERPROFILE', str(tmp_path))
+    monkeypatch.setattr(spool, 'CIRCUIT_BREAKERS', {})
+
+    config_path = tmp_path / 'campus.yaml'
+    config_path.write_text('''
+panopto_site_address: https://your.site.panopto.com
+panopto_oauth_credentials:
+    client_id: 123
+    client_secret: 456
+    grant_type: client_credentials
+target_implementation: stand_in_target
+target_address: http://stand-in.local
+sleep_seconds: 0
+%s
+''' % settings + ('targets:\n' + ''.join('    - name: %s\n' % name for name in targets) if targets else ''))
+    config = ConnectorConfig(str(config_path))
+
+    stand_in_targets = [get_stand_in_target(monkeypatch, target_config) for target_config in config.get_target_configs()]
+    return config, stand_in_targets
+
+
+def test_reconcile_deletes_orphans_and_syncs_missing_videos(monkeypatch, tmp_path):
+
+    from panoptoindexconnector import connector
+
+    panopto = StandInPanopto(monkeypatch)
+    config, (target,) = get_config(monkeypatch, tmp_path)
+    for index in range(4):
+        panopto.update('video-%i' % index, index)
+    connector.sync(config, connector.MIN_DATETIME)
+
+    # A document of a video no longer in Panopto, one whose delete the target lost, and a video the target missed
+    target.documents['gone'] = {'id': 'gone', 'title': 'gone', 'principals': []}
+    target.losing_deletes = True
+    panopto.update('video-1', 10, deleted=True)
+    connector.sync(config, datetime(2020, 1, 1, 0, 5))
+    target.losing_deletes = False
+    assert 'video-1' in target.documents
+    del target.documents['video-2']
+
+    target.deletes.clear()
+    target.pushes.clear()
+    assert connector.reconcile(config)
+
+    # Deleted videos stay in the updates listing, and are still not synced again
+    assert sorted(target.deletes) == ['gone', 'video-1']
+    assert target.pushes == ['video-2']
+    assert sorted(target.documents) == ['video-0', 'video-2', 'video-3']
+
+
+def test_videos_synced_by_id_record_their_principals(monkeypatch, tmp_path):
+
+    from panoptoindexconnector import connector
+    from panoptoindexconnector.state_store import get_state_store
+    from panoptoindexconnector.sync_lanes import PRINCIPALS_STATE_NAMESPACE
+
+    panopto = StandInPanopto(monkeypatch)
+    config, targets = get_config(monkeypatch, tmp_path, targets=['search', 'archive'])
+    panopto.update('video-0', 0, principals=[{'Groupname': 'Staff'}])
+    panopto.update('video-1', 1, deleted=True)
+
+    connector.sync_videos_by_id(config, ['video-0', 'video-1'])
+
+    # As a sync pass would, so a later loss of principals is told apart and synced ahead
+    for target, target_config in zip(targets, config.get_target_configs()):
+        assert target.pushes == ['video-0']
+        state_store = get_state_store(target_config)
+        assert state_store.get(PRINCIPALS_STATE_NAMESPACE, 'video-0') == ['Group:Panopto:Staff']
+        assert state_store.get(PRINCIPALS_STATE_NAMESPACE, 'video-1') is None
+
+
+def test_fan_out_fetches_once_and_keeps_syncing_past_a_failing_target(monkeypatch, tmp_path):
+
+    from panoptoindexconnector import connector
+
+    panopto = StandInPanopto(monkeypatch)
+    config, (search, archive) = get_config(monkeypatch, tmp_path, targets=['search', 'archive'])
+    for index in range(5):
+        panopto.update('video-%i' % index, index)
+    archive.failing = True
+
+    target_configs = config.get_target_configs()
+    results = connector.sync_targets(
+        config, target_configs, {target_config.profile_name: connector.MIN_DATETIME for target_config in target_configs})
+
+    # Each video is fetched once for both targets, and the failing target doesn't hold up the other
+    assert sorted(panopto.content_requests) == ['video-%i' % index for index in range(5)]
+    assert search.pushes == ['video-%i' % index for index in range(5)]
+    assert not archive.documents
+
+    search_result, archive_result = (results[target_config.profile_name] for target_config in target_configs)
+    assert search_result.complete and search_result.exception is None
+    assert not archive_result.complete and archive_result.exception is not None
+    assert archive_result.last_update_time == connector.MIN_DATETIME
+
+
+def test_resync_by_id_and_by_time_range(monkeypatch, tmp_path):
+
+    from panoptoindexconnector import connector
+
+    panopto = StandInPanopto(monkeypatch)
+    config, (target,) = get_config(monkeypatch, tmp_path)
+    for index in range(5):
+        panopto.update('video-%i' % index, index)
+    connector.sync(config, connector.MIN_DATETIME)
+
+    # Documents the target lost, which an incremental sync would not bring back
+    target.documents.clear()
+    target.pushes.clear()
+    panopto.content_requests.clear()
+    assert connector.resync(config, video_ids=['video-4', 'video-0'])
+    assert target.pushes == ['video-4', 'video-0']
+    assert panopto.content_requests == ['video-4', 'video-0']
+
+    # Only the updates in the range are fetched and synced again
+    target.pushes.clear()
+    panopto.content_requests.clear()
+    assert connector.resync(
+        config, since_time=datetime(2020, 1, 1, 0, 1, 30), until_time=datetime(2020, 1, 1, 0, 3, 30))
+    assert target.pushes == ['video-2', 'video-3']
+    assert panopto.content_requests == ['video-2', 'video-3']
+    assert sorted(target.documents) == ['video-0', 'video-2', 'video-3', 'video-4']
+
+
+def test_audit_syncs_drifted_documents_again(monkeypatch, tmp_path):
+
+    from panoptoindexconnector import connector
+
+    panopto = StandInPanopto(monkeypatch)
+    config, (target,) = get_config(monkeypatch, tmp_path, settings='audit_sample_size: 10')
+    for index in range(4):
+        panopto.update('video-%i' % index, index)
+    connector.sync(config, connector.MIN_DATETIME)
+
+    # The target skips content nobody it knows may see, as Microsoft Graph does
+    def resolve_to_target(target_contents, config):
+        for target_content in target_contents:
+            target_content['skip_sync'] = target_content['title'] == 'hidden'
+    target.resolve_to_target = resolve_to_target
+
+    # A document edited behind the connector's back, one the target lost, and one nobody may see any more
+    target.documents['video-0']['title'] = 'edited'
+    del target.documents['video-1']
+    panopto.update('video-2', 10, title='hidden')
+
+    target.pushes.clear()
+    assert connector.audit_target(config) == (4, 3)
+    assert sorted(target.pushes) == ['video-0', 'video-1']
+    assert target.deletes == ['video-2']
+    assert sorted(target.documents) == ['video-0', 'video-1', 'video-3']
+    assert target.documents['video-0']['title'] == 'video-0'
+
+
+def test_spool_drains_once_the_circuit_breaker_closes(monkeypatch, tmp_path):
+
+    from panoptoindexconnector import connector, spool
+    from panoptoindexconnector.custom_exceptions import CustomExceptions
+    from panoptoindexconnector.state_store import get_state_store
+    from panoptoindexconnector.sync_lanes import PRINCIPALS_STATE_NAMESPACE
+
+    now = [1000.0]
+    monkeypatch.setattr(spool.time, 'monotonic', lambda: now[0])
+
+    panopto = StandInPanopto(monkeypatch)
+    config, (target,) = get_config(monkeypatch, tmp_path, settings='spool: true\nspool_retry_seconds: 60')
+    for index in range(3):
+        panopto.update('video-%i' % index, index)
+
+    # Updates fetched while the target is down are spooled; the pass moves past them, but isn't complete
+    target.failing = True
+    last_update_time, exception = connector.sync(config, datetime(2019, 1, 1))
+    assert isinstance(exception, CustomExceptions.SyncIncompleteError)
+    assert last_update_time > datetime(2020, 1, 1, 0, 2)
+    assert not target.documents
+    assert get_state_store(config).get(PRINCIPALS_STATE_NAMESPACE, 'video-0') is None
+
+    # The breaker stays open for a while after the target is back, and spools what comes in meanwhile
+    target.failing = False
+    panopto.update('video-3', 3)
+    connector.sync(config, datetime(2020, 1, 1, 0, 2, 30))
+    assert not target.documents
+
+    # Once open long enough, the spool drains in order, and the principals are recorded as it does
+    now[0] += 60
+    panopto.update('video-4', 4)
+    _, exception = connector.sync(config, datetime(2020, 1, 1, 0, 3, 30))
+    assert exception is None
+    assert target.pushes == ['video-%i' % index for index in range(5)]
+    assert get_state_store(config).get(PRINCIPALS_STATE_NAMESPACE, 'video-0') == ['Group:Panopto:Public']
@@ -46,3 +46,88 @@ def test_attivio_conversion():
     attivio_content = implementation.convert_to_target(panopto_content, config)
 
     assert attivio_content[config.field_mapping['Id']] == panopto_content['Id']
+
+
+def test_microsoft_graph_principal_normalization():
+
+    # Configuration
+    from panoptoindexconnector.implementations import microsoft_graph_implementation as implementation
+    from panoptoindexconnector.connector_config import ConnectorConfig
+    graph_path = os.path.join(DIR, '..', 'src', 'panoptoindexconnector', 'implementations', 'microsoft_graph.yaml')
+    config = ConnectorConfig(graph_path)
+    config._yaml_config['panopto_id_provider_instance_name'] = 'MyAzureAD'  # pylint: disable=protected-access
+
+    group = {
+        'Groupname': 'Faculty',
+        'ExternalContexts': [
+            {'ExternalId': 'group-1', 'IdentityProviderName': 'myazuread'},
+            {'ExternalId': 'group-2', 'IdentityProviderName': 'OtherProvider'},
+        ]
+    }
+    panopto_content = {
+        'Id': 'de799c45-ccde-4187-80b8-ca383c540db5',
+        'VideoContent': {
+            'Id': 'de799c45-ccde-4187-80b8-ca383c540db5',
+            'Title': 'My title',
+            'Principals': [
+                {'Username': 'MyAzureAD\\jane@school.edu', 'IdentityProvider': 'MyAzureAD'},
+                {'Username': 'jane@school.edu', 'IdentityProvider': 'MyAzureAD'},
+                {'Username': 'panoptouser', 'IdentityProvider': 'Panopto'},
+                group,
+                dict(group),
+            ]
+        }
+    }
+
+    principals = implementation.normalize_principals(config, panopto_content)
+
+    assert not principals.has_public_or_all_users
+    assert principals.usernames == ['jane@school.edu']
+    assert principals.user_group_identifiers == ['group-1']
+
+    # Public access wins over any user or group
+    panopto_content['VideoContent']['Principals'].append({'Groupname': 'Public'})
+
+    assert implementation.normalize_principals(config, panopto_content).has_public_or_all_users
+
+
+def test_coveo_compressed_body_conversion():
+
+    # Configuration
+    import base64
+    import zlib
+    from panoptoindexconnector.implementations import coveo_implementation as implementation
+    from panoptoindexconnector.connector_config import ConnectorConfig
+    coveo_path = os.path.join(DIR, '..', 'src', 'panoptoindexconnector', 'implementations', 'coveo.yaml')
+    config = ConnectorConfig(coveo_path)
+    # pylint: disable=protected-access
+    config._yaml_config['compressed_body_fields'] = ['MachineTranscription', 'HumanTranscription', 'Presentation']
+
+    panopto_content = {
+        'Id': 'de799c45-ccde-4187-80b8-ca383c540db5',
+        'VideoContent' : {
+            'Title': 'My title',
+            'Language': 'English',
+            'Url': 'https://url.moo',
+            'ThumbnailUrl': 'http://url.moo',
+            'Summary': 'Just a dummy',
+            'MachineTranscription': 'We are robots ' * 1000,
+            'HumanTranscription': None,
+            'ScreenCapture': 'This is text',
+            'Presentation': 'I was extracted from a powerpoint',
+            'Principals': [
+            ]
+        }
+    }
+
+    coveo_content = implementation.convert_to_target(panopto_content, config)
+
+    # Body fields only go out compressed, the others stay as fields
+    assert 'panopto_machine_transcription' not in coveo_content
+    assert 'panopto_presentation' not in coveo_content
+    assert coveo_content['panopto_screen_capture'] == 'This is text'
+    assert coveo_content['compressionType'] == 'ZLIB'
+
+    body = zlib.decompress(base64.b64decode(coveo_content['compressedBinaryData'])).decode('utf-8')
+    assert body == panopto_content['VideoContent']['MachineTranscription'] + '\n\nI was extracted from a powerpoint'
+    assert len(coveo_content['compressedBinaryData']) < len(body) / 10
@@ -0,0 +1,275 @@
+"""
+Tests for batched Coveo pushes, against a local stand-in for the Coveo Push API.
+"""
+
+# Standard Library Imports
+from http.server import BaseHTTPRequestHandler
+import json
+import logging
+import os
+
+# Third party
+import pytest
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+class StandInCoveo(BaseHTTPRequestHandler):
+    """
+    Records requests, hands out file containers and keeps uploaded container contents
+    """
+
+    requests = []
+    containers = {}
+
+    @classmethod
+    def reset(cls):
+        cls.requests = []
+        cls.containers = {}
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _record(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        StandInCoveo.requests.append((self.command, self.path, dict(self.headers), body))
+        return body
+
+    def _respond(self, body=None):
+        data = json.dumps(body or {}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self._record()
+        if self.path.endswith('/files'):
+            file_id = 'file-%i' % len(StandInCoveo.containers)
+            StandInCoveo.containers[file_id] = None
+            self._respond({
+                'uploadUri': 'http://%s:%i/upload/%s' % (*self.server.server_address, file_id),
+                'fileId': file_id,
+                'requiredHeaders': {'Content-Type': 'application/octet-stream'},
+            })
+        else:
+            self._respond()
+
+    def do_PUT(self):
+        body = self._record()
+        if self.path.startswith('/upload/'):
+            StandInCoveo.containers[self.path.split('/')[-1]] = body
+        self._respond()
+
+    def do_DELETE(self):
+        self._record()
+        self._respond()
+
+
+@pytest.fixture
+def get_config(start_stand_in_server, get_stand_in_config):
+    server = start_stand_in_server(StandInCoveo)
+    return lambda **settings: get_stand_in_config('coveo', server, **dict({'skip_permissions': True}, **settings))
+
+
+def get_panopto_content(index):
+    return {
+        'Id': 'video-%i' % index,
+        'VideoContent': {
+            'Title': 'Video %i' % index,
+            'Language': 'English',
+            'Url': 'https://site.panopto.com/Panopto/Pages/Viewer.aspx?id=video-%i' % index,
+            'ThumbnailUrl': None,
+            'Summary': 'Summary',
+            'MachineTranscription': 'word ' * 200,
+            'HumanTranscription': None,
+            'ScreenCapture': None,
+            'Presentation': None,
+            'Principals': [],
+        }
+    }
+
+
+def test_coveo_batch_flushes_by_count(get_config):
+
+    from panoptoindexconnector.implementations import coveo_implementation as implementation
+
+    config = get_config(batch_size=2)
+
+    for index in range(3):
+        target_content = implementation.convert_to_target(get_panopto_content(index), config)
+        implementation.push_to_target(target_content, config)
+
+    # The first two documents went out as soon as the batch was full
+    assert len(StandInCoveo.containers) == 1
+
+    implementation.flush(config)
+
+    batches = [json.loads(body) for body in StandInCoveo.containers.values()]
+    assert [len(batch['addOrUpdate']) for batch in batches] == [2, 1]
+    assert batches[0]['addOrUpdate'][0]['documentId'].endswith('?id=video-0')
+
+    triggers = [path for method, path, _, _ in StandInCoveo.requests if '/documents/batch' in path]
+    assert len(triggers) == 2
+    assert 'fileId=file-0&orderingId=' in triggers[0]
+
+
+def test_coveo_batch_flushes_by_size(get_config):
+
+    from panoptoindexconnector.implementations import coveo_implementation as implementation
+
+    # Room for a little more than one document per container
+    config = get_config(batch_size=100, batch_max_bytes=1500)
+
+    for index in range(3):
+        target_content = implementation.convert_to_target(get_panopto_content(index), config)
+        implementation.push_to_target(target_content, config)
+    implementation.flush(config)
+
+    batches = [json.loads(body) for body in StandInCoveo.containers.values()]
+    assert [len(batch['addOrUpdate']) for batch in batches] == [1, 1, 1]
+
+    # Uploads only carry the headers the container requires, never the api key
+    uploads = [headers for method, path, headers, _ in StandInCoveo.requests if path.startswith('/upload/')]
+    assert all('Authorization' not in headers for headers in uploads)
+
+
+def test_coveo_batch_counts_replaced_entries_once(get_config):
+
+    from panoptoindexconnector.implementations import coveo_implementation as implementation
+
+    config = get_config(batch_size=100, batch_max_bytes=1500)
+
+    # Pushing the same document again replaces its entry, which leaves room in the container
+    target_content = implementation.convert_to_target(get_panopto_content(0), config)
+    for _ in range(3):
+        implementation.push_to_target(target_content, config)
+    implementation.flush(config)
+
+    batches = [json.loads(body) for body in StandInCoveo.containers.values()]
+    assert [len(batch['addOrUpdate']) for batch in batches] == [1]
+    assert implementation.PENDING_BATCH['size'] == 0
+
+
+def test_coveo_batch_registers_identities_once(get_config):
+
+    from panoptoindexconnector.implementations import coveo_implementation as implementation
+
+    config = get_config(batch_size=10, skip_permissions=False)
+
+    def push_with_principals(index):
+        panopto_content = get_panopto_content(index)
+        panopto_content['VideoContent']['Principals'] = [
+            {'Username': 'jane', 'Email': 'jane@school.edu'},
+            {'Groupname': 'Faculty'},
+            {'Username': 'student%i' % index, 'Email': 'student%i@school.edu' % index},
+        ]
+        target_content = implementation.convert_to_target(panopto_content, config)
+        implementation.push_to_target(target_content, config)
+
+    for index in range(3):
+        push_with_principals(index)
+    implementation.flush(config)
+
+    identity_batches = [path for method, path, _, _ in StandInCoveo.requests if '/permissions/batch' in path]
+    assert len(identity_batches) == 1
+    assert '/providers/acoveoorganization-securityprovider/' in identity_batches[0]
+
+    # Identities went into the first container, documents into the second
+    identities = json.loads(StandInCoveo.containers['file-0'])
+    names = sorted(member['identity']['name'] for member in identities['members'])
+    assert names == ['Faculty', 'jane@school.edu', 'student0@school.edu', 'student1@school.edu',
+                     'student2@school.edu']
+    assert len(json.loads(StandInCoveo.containers['file-1'])['addOrUpdate']) == 3
+
+    # Identities already registered are remembered, so later pushes register only new ones
+    push_with_principals(3)
+    implementation.flush(config)
+
+    identities = json.loads(StandInCoveo.containers['file-2'])
+    assert [member['identity']['name'] for member in identities['members']] == ['student3@school.edu']
+
+
+def test_coveo_rebuild_deletes_older_documents(get_config):
+
+    from panoptoindexconnector.implementations import coveo_implementation as implementation
+
+    config = get_config(batch_size=1)
+
+    implementation.begin_rebuild(config)
+    for index in range(2):
+        target_content = implementation.convert_to_target(get_panopto_content(index), config)
+        implementation.push_to_target(target_content, config)
+    # A video deleted after the rebuild pushed it is newer than the cleanup, so is deleted by itself
+    implementation.delete_from_target('video-1', config)
+
+    # A rebuild resumed after a failed pass keeps the ordering id it started from
+    implementation.begin_rebuild(config)
+    implementation.complete_rebuild(config)
+
+    statuses = [path for method, path, _, _ in StandInCoveo.requests if '/status?' in path]
+    assert all(path.endswith('statusType=REBUILD') for path in statuses)
+
+    pushes = [path for method, path, _, _ in StandInCoveo.requests if method == 'PUT']
+    ordering_ids = [int(path.split('orderingId=')[-1]) for path in pushes]
+    assert len(ordering_ids) == 2 and ordering_ids[0] < ordering_ids[1]
+
+    deletes = [path for method, path, _, _ in StandInCoveo.requests if method == 'DELETE']
+    assert len(deletes) == 2
+    assert '?id=video-1&orderingId=' in deletes[0] and int(deletes[0].split('orderingId=')[-1]) > ordering_ids[1]
+    assert '/documents/olderthan?orderingId=' in deletes[1]
+    assert int(deletes[1].split('orderingId=')[-1]) < ordering_ids[0]
+
+
+def test_coveo_batch_deletes_pushed_document_id(get_config):
+
+    from panoptoindexconnector.implementations import coveo_implementation as implementation
+
+    config = get_config(batch_size=10)
+
+    for index in range(2):
+        target_content = implementation.convert_to_target(get_panopto_content(index), config)
+        implementation.push_to_target(target_content, config)
+    implementation.flush(config)
+
+    # A queued delete replaces the queued push of the same document
+    target_content = implementation.convert_to_target(get_panopto_content(0), config)
+    implementation.push_to_target(target_content, config)
+    implementation.delete_from_target('video-0', config)
+    # Videos without a recorded document id fall back to both viewer url forms
+    implementation.delete_from_target('video-5', config)
+    implementation.flush(config)
+
+    batch = json.loads(StandInCoveo.containers['file-1'])
+    assert batch['addOrUpdate'] == []
+    deleted = [entry['documentId'].split('?')[-1] for entry in batch['delete']]
+    assert deleted == ['id=video-0', 'id=video-5', 'pid=video-5']
+
+    assert not [path for method, path, _, _ in StandInCoveo.requests if method == 'DELETE']
+
+
+def test_coveo_initializes_lazily(get_config):
+
+    from panoptoindexconnector.target_handler import TargetHandler
+
+    handler = TargetHandler(get_config())
+    assert handler.lazy_initialization
+
+    # A pass with nothing to sync never initialized, so has nothing to flush or tear down
+    handler.flush()
+    handler.teardown()
+    assert not StandInCoveo.requests
+
+    handler.initialize()
+    handler.teardown()
+    statuses = [path.split('statusType=')[-1] for method, path, _, _ in StandInCoveo.requests]
+    assert statuses == ['INCREMENTAL', 'IDLE']
@@ -0,0 +1,399 @@
+"""
+Tests for syncing to Microsoft Graph connections, against a stand-in for the Graph API in place of requests.
+"""
+
+# Standard Library Imports
+import json
+import logging
+import os
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+class StandInResponse:
+
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._body = body
+        self.text = json.dumps(body)
+        self.ok = status_code < 400
+
+    def json(self):
+        if self._body is None:
+            raise ValueError('No json body')
+        return self._body
+
+    def raise_for_status(self):
+        import requests
+        if not self.ok:
+            raise requests.exceptions.HTTPError('%i error' % self.status_code, response=self)
+
+
+class StandInGraph:
+    """
+    Keeps one connection in memory, answering requests and JSON batches the way Graph does. Items pushed while
+    items_remaining is 0 are refused for tenant quota, and items in throttle_once are throttled the first time.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.threads = set()
+        self.response_seconds = 0
+        self.connection_state = 'ready'
+        self.schema = True
+        self.items = {}
+        self.items_remaining = None
+        self.throttle_once = set()
+        self.users = {'jane@school.edu': 'user-jane'}
+        self.groups = {'group-1': 'aad-group-1'}
+
+    def get(self, url, headers=None, params=None):  # pylint: disable=unused-argument
+        return self._handle('GET', url, params=params)
+
+    def put(self, url, headers=None, json=None):  # pylint: disable=unused-argument,redefined-outer-name
+        return self._handle('PUT', url, body=json)
+
+    def post(self, url, headers=None, json=None):  # pylint: disable=unused-argument,redefined-outer-name
+        return self._handle('POST', url, body=json)
+
+    def delete(self, url, headers=None):  # pylint: disable=unused-argument
+        return self._handle('DELETE', url)
+
+    @property
+    def batches(self):
+        return [body['requests'] for method, url, body in self.requests if url.endswith('/$batch')]
+
+    def _handle(self, method, url, body=None, params=None):
+        self.requests.append((method, url, body))
+        self.threads.add(threading.current_thread().name)
+        threading.Event().wait(self.response_seconds)
+        if url.endswith('/$batch'):
+            responses = []
+            for request in body['requests']:
+                status_code, response_body, headers = self._route(
+                    request['method'], request['url'], request.get('body'))
+                responses.append({'id': request['id'], 'status': status_code, 'body': response_body,
+                                  'headers': headers})
+            return StandInResponse(200, {'responses': responses})
+        return StandInResponse(*self._route(method, urlsplit(url).path[len('/v1.0'):], body, params))
+
+    def _route(self, method, url, body, params=None):
+        path = urlsplit(url).path
+        query = {key: values[0] for key, values in parse_qs(urlsplit(url).query).items()}
+        query.update(params or {})
+        parts = path.strip('/').split('/')
+
+        if parts[0] in ('users', 'groups'):
+            directory = self.users if parts[0] == 'users' else self.groups
+            identifier = query['$filter'].split(' eq ')[1].strip("'")
+            return 200, {'value': [{'id': directory[identifier]}] if identifier in directory else []}, {}
+        if parts[0] == 'operations':
+            return 200, {'status': 'completed'}, {}
+        if parts[:2] != ['external', 'connections']:
+            return 404, {}, {}
+
+        if len(parts) == 2 and method == 'POST':
+            self.connection_state, self.schema = 'draft', False
+            return 201, {'id': body['id']}, {}
+        if len(parts) == 3:
+            return (404, {}, {}) if self.connection_state is None else (200, {'state': self.connection_state}, {})
+        if parts[3] == 'schema' and method == 'POST':
+            self.schema, self.connection_state = True, 'ready'
+            return 202, {}, {'Location': 'https://graph.microsoft.com/v1.0/operations/1'}
+        if parts[3] == 'schema':
+            return (200, {}, {}) if self.schema else (404, {}, {})
+        if parts[3] == 'quota':
+            return (404, {}, {}) if self.items_remaining is None else (200, {'itemsRemaining': self.items_remaining}, {})
+
+        item_id = parts[4]
+        if self.connection_state is None:
+            return 404, {'error': {'code': 'NotFound'}}, {}
+        if method == 'GET':
+            return (200, self.items[item_id], {}) if item_id in self.items else (404, {}, {})
+        if method == 'DELETE':
+            return (200, {}, {}) if self.items.pop(item_id, None) is not None else (404, {}, {})
+        if item_id in self.throttle_once:
+            self.throttle_once.discard(item_id)
+            return 429, {'error': {'code': 'TooManyRequests'}}, {'Retry-After': '0'}
+        if item_id not in self.items and self.items_remaining == 0:
+            error = {'code': 'Forbidden', 'innerError': {'code': 'TenantQuotaExceeded', 'message': 'Quota reached'}}
+            return 403, {'error': error}, {}
+        if item_id not in self.items and self.items_remaining is not None:
+            self.items_remaining -= 1
+        self.items[item_id] = body
+        return 200, {}, {}
+
+
+def get_config(monkeypatch, tmp_path, implementation, **settings):
+    from panoptoindexconnector.connector_config import ConnectorConfig
+    graph_path = os.path.join(DIR, '..', 'src', 'panoptoindexconnector', 'implementations', 'microsoft_graph.yaml')
+    config = ConnectorConfig(graph_path)
+    # pylint: disable=protected-access
+    config._yaml_config['panopto_id_provider_instance_name'] = 'MyAzureAD'
+    config._yaml_config.update(settings)
+    # Keep the local state store out of the home directory, and answer requests from the stand-in
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('USERPROFILE', str(tmp_path))
+    graph = StandInGraph()
+    patch_implementation(monkeypatch, implementation, graph)
+    return config, graph
+
+
+def patch_implementation(monkeypatch, implementation, graph):
+    monkeypatch.setattr(implementation, 'requests', graph)
+    monkeypatch.setattr(implementation, 'get_access_token', lambda config: 'token')
+    monkeypatch.setattr(implementation.time, 'sleep', lambda seconds: None)
+
+
+def get_panopto_content(video_id, principals=None):
+    return {
+        'Id': video_id,
+        'VideoContent': {
+            'Id': video_id,
+            'Title': 'Video %s' % video_id,
+            'Url': 'https://site.panopto.com/Panopto/Pages/Viewer.aspx?id=%s' % video_id,
+            'ThumbnailUrl': None,
+            'Folder': 'Lectures',
+            'Summary': 'Summary',
+            'MachineTranscription': 'word ' * 20,
+            'HumanTranscription': None,
+            'ScreenCapture': None,
+            'Presentation': None,
+            'Principals': principals if principals is not None else [{'Groupname': 'Public'}],
+        }
+    }
+
+
+def test_microsoft_graph_batches_item_requests(monkeypatch, tmp_path):
+
+    from panoptoindexconnector.implementations import microsoft_graph_implementation as implementation
+
+    config, graph = get_config(monkeypatch, tmp_path, implementation)
+    implementation.initialize(config)
+
+    # Pushes and deletes go out 20 to a batch, the item urls relative to the Graph version root
+    graph.items['video-gone'] = {}
+    graph.throttle_once = {'video-03'}
+    for index in range(24):
+        implementation.push_to_target(
+            implementation.convert_to_target(get_panopto_content('video-%02i' % index), config), config)
+    implementation.delete_from_target('video-gone', config)
+    assert not implementation.flush(config)
+
+    first_batch, throttled_batch, last_batch = graph.batches
+    assert [request['id'] for request in first_batch] == [str(index) for index in range(20)]
+    assert first_batch[0]['method'] == 'PUT'
+    assert first_batch[0]['url'] == '/external/connections/sampleConnectionId/items/video-00'
+    assert first_batch[0]['body']['acl'][0]['type'] == 'everyone'
+    assert first_batch[0]['headers'] == {'Content-Type': 'application/json'}
+
+    # The throttled request alone was sent again
+    assert [request['url'].rsplit('/', 1)[1] for request in throttled_batch] == ['video-03']
+    assert [(request['method'], request['url'].rsplit('/', 1)[1]) for request in last_batch][-2:] == [
+        ('PUT', 'video-23'), ('DELETE', 'video-gone')]
+    assert sorted(graph.items) == ['video-%02i' % index for index in range(24)]
+
+    # A connection gone missing fails the items and is verified again on the next sync
+    graph.connection_state = None
+    implementation.push_to_target(implementation.convert_to_target(get_panopto_content('video-00'), config), config)
+    assert implementation.flush(config) == ['video-00']
+    assert implementation.get_state_store(config).get(
+        implementation.STATE_NAMESPACE, implementation.get_connection_ready_key(config)) is None
+
+    # A new item refused for tenant quota within a batch is deferred, and no more new items are admitted
+    graph.connection_state = 'ready'
+    graph.items_remaining = 0
+    implementation.push_to_target(implementation.convert_to_target(get_panopto_content('video-new'), config), config)
+    assert not implementation.flush(config)
+    assert graph.batches[-1][0]['url'].endswith('/items/video-new')
+    assert implementation.get_items_remaining(config) == 0
+    assert [content_id for content_id, _ in implementation.get_state_store(config).entries(
+        implementation.get_deferred_items_namespace(config))] == ['video-new']
+
+
+def test_microsoft_graph_item_index(monkeypatch, tmp_path):
+
+    from panoptoindexconnector.implementations import microsoft_graph_implementation as implementation
+
+    config, graph = get_config(monkeypatch, tmp_path, implementation, batch_size=1)
+    implementation.initialize(config)
+
+    def get_item_requests(method):
+        return [url.rsplit('/', 1)[1] for request_method, url, _ in graph.requests
+                if request_method == method and '/items/' in url]
+
+    # Nobody in the directory can see these, so they must not be in the connection
+    unknown_user = [{'Username': 'nobody@school.edu', 'IdentityProvider': 'MyAzureAD'}]
+
+    # An item the index knows nothing about is looked up once, then known to be absent
+    for _ in range(2):
+        target_content = implementation.convert_to_target(get_panopto_content('video-a', unknown_user), config)
+        implementation.resolve_to_target([target_content], config)
+        assert target_content['skip_sync']
+    assert get_item_requests('GET') == ['video-a']
+    assert not get_item_requests('DELETE')
+
+    # An item pushed is known to be present, so it is deleted without looking it up
+    implementation.push_to_target(implementation.convert_to_target(get_panopto_content('video-b'), config), config)
+    implementation.resolve_to_target(
+        [implementation.convert_to_target(get_panopto_content('video-b', unknown_user), config)], config)
+    assert get_item_requests('GET') == ['video-a']
+    assert get_item_requests('DELETE') == ['video-b'] and 'video-b' not in graph.items
+    assert implementation.is_item_in_target(config, 'video-b') is False
+
+    # A connection created by the connector is tracked from the start, so nothing is looked up
+    config, graph = get_config(
+        monkeypatch, tmp_path, implementation, batch_size=1, target_connection=dict(config.target_connection, id='new'))
+    graph.connection_state = None
+    implementation.initialize(config)
+    implementation.resolve_to_target(
+        [implementation.convert_to_target(get_panopto_content('video-c', unknown_user), config)], config)
+    assert not get_item_requests('GET')
+
+
+def test_microsoft_graph_resolves_across_workers(monkeypatch, tmp_path):
+
+    from panoptoindexconnector.implementations import microsoft_graph_implementation as implementation
+    from panoptoindexconnector.target_handler import TargetHandler
+
+    config, graph = get_config(monkeypatch, tmp_path, implementation, resolve_workers=3)
+    graph.users.update({'student-%i@school.edu' % index: 'user-student-%i' % index for index in range(0, 9, 2)})
+    graph.response_seconds = 0.05
+    handler = TargetHandler(config)
+    patch_implementation(monkeypatch, handler._implementation_module, graph)  # pylint: disable=protected-access
+
+    # Converting makes no requests; users and groups are resolved together per worker, in batches
+    target_contents = [
+        handler.convert_to_target(get_panopto_content('video-%i' % index, [
+            {'Username': 'jane@school.edu', 'IdentityProvider': 'MyAzureAD'},
+            {'Username': 'student-%i@school.edu' % index, 'IdentityProvider': 'MyAzureAD'},
+            {'Groupname': 'Faculty', 'ExternalContexts': [
+                {'ExternalId': 'group-1', 'IdentityProviderName': 'MyAzureAD'}]},
+        ]))
+        for index in range(9)
+    ]
+    assert not graph.requests
+
+    handler.resolve_to_target(target_contents)
+
+    assert len(graph.threads) > 1
+    # Each worker had several users to look up, so looked them up in a batch
+    assert not [url for _, url, _ in graph.requests if '/users' in url]
+    assert any(request['url'].startswith('/users') for batch in graph.batches for request in batch)
+    for index, target_content in enumerate(target_contents):
+        expected_acl = ['user-jane'] + (['user-student-%i' % index] if index % 2 == 0 else []) + ['aad-group-1']
+        assert [acl['value'] for acl in target_content['acl']] == expected_acl
+        assert 'unresolvedPrincipals' not in target_content
+
+
+def test_microsoft_graph_connection_readiness_cache(monkeypatch, tmp_path):
+
+    import builtins
+    from panoptoindexconnector.implementations import microsoft_graph_implementation as implementation
+
+    config, graph = get_config(monkeypatch, tmp_path, implementation)
+    monkeypatch.setattr(implementation, 'SCHEMA_HASH', {'mtime': None, 'hash': None})
+    opened_paths = []
+    monkeypatch.setattr(implementation, 'open', lambda path, *args: opened_paths.append(path) or builtins.open(
+        path, *args), raising=False)
+
+    def get_connection_checks():
+        return [url for method, url, _ in graph.requests if method == 'GET' and url.endswith('/sampleConnectionId')]
+
+    # A connection with its schema still provisioning is checked again on every sync until it is ready
+    graph.connection_state = 'draft'
+    implementation.initialize(config)
+    implementation.initialize(config)
+    assert len(get_connection_checks()) == 2
+
+    # As is one over its limit
+    graph.connection_state = 'limitExceeded'
+    implementation.initialize(config)
+    assert len(get_connection_checks()) == 3
+
+    # Once ready, it is not checked again while the schema is the same
+    graph.connection_state = 'ready'
+    implementation.initialize(config)
+    implementation.initialize(config)
+    assert len(get_connection_checks()) == 4
+
+    # The schema file is only read once
+    assert opened_paths == [implementation.get_schema_path()]
+
+
+def test_microsoft_graph_quota_admission_and_deferral(monkeypatch, tmp_path):
+
+    from panoptoindexconnector.implementations import microsoft_graph_implementation as implementation
+
+    config, graph = get_config(monkeypatch, tmp_path, implementation, batch_size=1, quota_refresh_seconds=0)
+    state_store = implementation.get_state_store(config)
+    deferred_namespace = implementation.get_deferred_items_namespace(config)
+
+    def push(video_id):
+        implementation.push_to_target(implementation.convert_to_target(get_panopto_content(video_id), config), config)
+
+    # New items are admitted while there is quota left, the rest are deferred without a request
+    graph.items_remaining = 2
+    implementation.initialize(config)
+    for index in range(6):
+        push('video-%i' % index)
+    assert sorted(graph.items) == ['video-0', 'video-1']
+    assert [content_id for content_id, _ in state_store.entries(deferred_namespace)] == [
+        'video-%i' % index for index in range(2, 6)]
+    assert not [url for method, url, _ in graph.requests if method == 'PUT' and url.endswith('/video-5')]
+
+    # Updates of items already in the connection still go ahead
+    push('video-0')
+    assert [url for method, url, _ in graph.requests if method == 'PUT'][-1].endswith('/video-0')
+
+    # Once quota is freed, deferred items are pushed as far as it allows, reading no more than that at a time
+    entries_limits = []
+    entries = state_store.entries
+    monkeypatch.setattr(state_store, 'entries', lambda namespace, limit=None: entries_limits.append(limit) or entries(
+        namespace, limit=limit))
+    graph.items_remaining = 2
+    implementation.initialize(config)
+    assert sorted(graph.items) == ['video-0', 'video-1', 'video-2', 'video-3']
+    assert entries_limits == [2, 1]
+    assert [content_id for content_id, _ in entries(deferred_namespace)] == ['video-4', 'video-5']
+
+    # And without a known quota, until the backlog is through
+    graph.items_remaining = None
+    implementation.initialize(config)
+    assert sorted(graph.items) == ['video-%i' % index for index in range(6)]
+    assert not entries(deferred_namespace)
+
+
+def test_microsoft_graph_token_cache_per_profile(monkeypatch, tmp_path):
+
+    import shutil
+    from panoptoindexconnector.connector_config import ConnectorConfig
+    from panoptoindexconnector.implementations import microsoft_graph_implementation as implementation
+
+    monkeypatch.setattr(implementation, 'APP_TEMP_DIR', str(tmp_path))
+    graph_path = os.path.join(DIR, '..', 'src', 'panoptoindexconnector', 'implementations', 'microsoft_graph.yaml')
+    configs = []
+    for profile_name in ('campus', 'medical'):
+        shutil.copy(graph_path, str(tmp_path / (profile_name + '.yaml')))
+        configs.append(ConnectorConfig(str(tmp_path / (profile_name + '.yaml'))))
+
+    for config in configs:
+        token_cache = implementation.load_token_cache(config)
+        token_cache.has_state_changed = True
+        implementation.save_token_cache(config, token_cache)
+    assert implementation.get_token_cache_path(configs[0]) != implementation.get_token_cache_path(configs[1])
+
+    # A profile tearing down removes its own cache, not that of a profile still syncing
+    implementation.teardown(configs[0])
+    assert not os.path.exists(implementation.get_token_cache_path(configs[0]))
+    assert os.path.exists(implementation.get_token_cache_path(configs[1]))
@@ -0,0 +1,356 @@
+"""
+Tests for bulk indexing to OpenSearch, against a local stand-in for the OpenSearch REST API.
+"""
+
+# Standard Library Imports
+from http.server import BaseHTTPRequestHandler
+import json
+import logging
+import os
+
+# Third party
+import pytest
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+class StandInOpenSearch(BaseHTTPRequestHandler):
+    """
+    Keeps one index in memory; bulk items for ids in reject_once are rejected for load the first time
+    and items for ids in reject_always fail for good
+    """
+
+    requests = []
+    index = None
+    documents = {}
+    settings = {}
+    reject_once = set()
+    reject_always = set()
+    fail_scrolls = False
+
+    @classmethod
+    def reset(cls):
+        cls.requests = []
+        cls.index = None
+        cls.documents = {}
+        cls.settings = {'refresh_interval': '5s'}
+        cls.reject_once = set()
+        cls.reject_always = set()
+        cls.fail_scrolls = False
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _respond(self, status, body=None):
+        data = json.dumps(body or {}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _record(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        StandInOpenSearch.requests.append((self.command, self.path, body))
+        return body
+
+    def do_HEAD(self):
+        self._record()
+        self._respond(200 if StandInOpenSearch.index is not None else 404)
+
+    def do_GET(self):
+        self._record()
+        if '/_doc/' in self.path:
+            document_id = self.path.rsplit('/', 1)[1]
+            if document_id in StandInOpenSearch.documents:
+                self._respond(200, {'_id': document_id, '_source': StandInOpenSearch.documents[document_id]})
+            else:
+                self._respond(404, {'_id': document_id, 'found': False})
+            return
+        self._respond(200, {'panopto-videos': {'settings': {'index': StandInOpenSearch.settings}}})
+
+    def do_DELETE(self):
+        self._record()
+        self._respond(200)
+
+    def do_PUT(self):
+        body = json.loads(self._record())
+        if self.path.endswith('/_settings'):
+            StandInOpenSearch.settings.update(body['index'])
+        else:
+            StandInOpenSearch.index = body
+        self._respond(200)
+
+    def do_POST(self):
+        body = self._record()
+        if '/_search' in self.path:
+            # Scroll ids are the offset of the next hits
+            request = json.loads(body)
+            if 'scroll_id' in request and StandInOpenSearch.fail_scrolls:
+                self._respond(500, {'error': 'search_phase_execution_exception'})
+                return
+            offset = int(request.get('scroll_id', 0))
+            size = 2
+            document_ids = sorted(StandInOpenSearch.documents)[offset:offset + size]
+            hits = {'hits': [{'_id': i} for i in document_ids]}
+            # Nothing to scroll through has no scroll
+            if StandInOpenSearch.documents:
+                self._respond(200, {'_scroll_id': str(offset + size), 'hits': hits})
+            else:
+                self._respond(200, {'hits': hits})
+            return
+        if not self.path.endswith('/_bulk'):
+            self._respond(200)
+            return
+
+        lines = [json.loads(line) for line in body.splitlines()]
+        items = []
+        while lines:
+            operation, action = next(iter(lines.pop(0).items()))
+            document_id = action['_id']
+            document = lines.pop(0) if operation in ('index', 'update') else None
+            if document_id in StandInOpenSearch.reject_once:
+                StandInOpenSearch.reject_once.discard(document_id)
+                items.append({operation: {'_id': document_id, 'status': 429, 'error': 'rejected'}})
+            elif document_id in StandInOpenSearch.reject_always:
+                items.append({operation: {'_id': document_id, 'status': 400, 'error': 'mapper_parsing_exception'}})
+            elif operation == 'index':
+                StandInOpenSearch.documents[document_id] = document
+                items.append({operation: {'_id': document_id, 'status': 201}})
+            elif operation == 'update' and document_id in StandInOpenSearch.documents:
+                StandInOpenSearch.documents[document_id].update(document['doc'])
+                items.append({operation: {'_id': document_id, 'status': 200}})
+            elif operation == 'update':
+                items.append({operation: {'_id': document_id, 'status': 404, 'error': 'document_missing_exception'}})
+            else:
+                status = 200 if StandInOpenSearch.documents.pop(document_id, None) else 404
+                items.append({operation: {'_id': document_id, 'status': status}})
+
+        self._respond(200, {'errors': any(item[next(iter(item))]['status'] >= 300 for item in items), 'items': items})
+
+
+@pytest.fixture
+def get_config(monkeypatch, start_stand_in_server, get_stand_in_config):
+    from panoptoindexconnector.implementations import opensearch_implementation
+    server = start_stand_in_server(StandInOpenSearch)
+    # Keep retries quick
+    monkeypatch.setattr(opensearch_implementation, 'OPENSEARCH_BULK_RETRY_SECONDS', 0)
+
+    def get(**settings):
+        config = get_stand_in_config('opensearch', server, **settings)
+        # pylint: disable=protected-access
+        config._yaml_config['target_credentials']['username'] = None
+        return config
+
+    return get
+
+
+def get_panopto_content(index):
+    return {
+        'Id': 'video-%i' % index,
+        'VideoContent': {
+            'Title': 'Video %i' % index,
+            'Language': 'English',
+            'Url': 'https://site.panopto.com/Panopto/Pages/Viewer.aspx?id=video-%i' % index,
+            'ThumbnailUrl': None,
+            'Summary': 'Summary',
+            'MachineTranscription': 'word ' * 200,
+            'HumanTranscription': None,
+            'ScreenCapture': None,
+            'Presentation': None,
+            'Principals': [
+                {'Username': 'jane', 'IdentityProvider': 'MyAzureAD'},
+                {'Groupname': 'Faculty', 'IdentityProvider': None},
+            ],
+        }
+    }
+
+
+def test_opensearch_bulk_retries_rejected_items(get_config):
+
+    from panoptoindexconnector.implementations import opensearch_implementation as implementation
+
+    config = get_config(batch_size=3)
+
+    implementation.initialize(config)
+    assert StandInOpenSearch.index['mappings']['properties']['principals'] == {'type': 'keyword'}
+
+    StandInOpenSearch.reject_once.add('video-1')
+    StandInOpenSearch.reject_always.add('video-2')
+    for index in range(3):
+        target_content = implementation.convert_to_target(get_panopto_content(index), config)
+        implementation.push_to_target(target_content, config)
+
+    # The batch went out once full; the item rejected for load was sent again and the bad one logged
+    bulks = [body for method, path, body in StandInOpenSearch.requests if path.endswith('/_bulk')]
+    assert len(bulks) == 2
+    assert len(bulks[1].splitlines()) == 2
+    assert sorted(StandInOpenSearch.documents) == ['video-0', 'video-1']
+    assert StandInOpenSearch.documents['video-0']['principals'] == ['User:MyAzureAD:jane', 'Group:Panopto:Faculty']
+
+    # Deletes join the bulk requests; deleting what is not there is fine
+    implementation.delete_from_target('video-0', config)
+    implementation.delete_from_target('video-9', config)
+    implementation.flush(config)
+
+    assert sorted(StandInOpenSearch.documents) == ['video-1']
+
+
+def test_opensearch_bulk_counts_replaced_actions_once(get_config):
+
+    from panoptoindexconnector.implementations import opensearch_implementation as implementation
+
+    config = get_config(batch_size=100)
+    implementation.initialize(config)
+    implementation.push_to_target(implementation.convert_to_target(get_panopto_content(0), config), config)
+    document_bytes = implementation.PENDING_BULK['size']
+
+    # Room for two documents per bulk request
+    config._yaml_config['batch_max_bytes'] = 2 * document_bytes + 10  # pylint: disable=protected-access
+
+    # Pushing the same video again replaces its queued action, and its size
+    for _ in range(2):
+        implementation.push_to_target(implementation.convert_to_target(get_panopto_content(0), config), config)
+    implementation.push_to_target(implementation.convert_to_target(get_panopto_content(1), config), config)
+    assert implementation.PENDING_BULK['size'] == 2 * document_bytes
+    assert not [path for method, path, body in StandInOpenSearch.requests if path.endswith('/_bulk')]
+
+    implementation.flush(config)
+    assert sorted(StandInOpenSearch.documents) == ['video-0', 'video-1']
+
+
+def test_opensearch_rebuild_defers_refresh(get_config):
+
+    from panoptoindexconnector.implementations import opensearch_implementation as implementation
+
+    config = get_config()
+
+    implementation.initialize(config)
+    implementation.begin_rebuild(config)
+    assert StandInOpenSearch.settings['refresh_interval'] == '-1'
+
+    # A rebuild resumed after a failed pass restores the interval from before it started
+    implementation.begin_rebuild(config)
+    target_content = implementation.convert_to_target(get_panopto_content(0), config)
+    implementation.push_to_target(target_content, config)
+    implementation.complete_rebuild(config)
+
+    assert StandInOpenSearch.settings['refresh_interval'] == '5s'
+    assert 'video-0' in StandInOpenSearch.documents
+    assert StandInOpenSearch.requests[-1][1].endswith('/_refresh')
+
+
+def test_opensearch_partial_updates(get_config):
+
+    from panoptoindexconnector.target_handler import TargetHandler
+
+    config = get_config()
+    handler = TargetHandler(config)
+    handler.initialize()
+
+    panopto_content = get_panopto_content(0)
+    handler.push_to_target(handler.convert_to_target(panopto_content), config, video_id='video-0')
+    handler.flush()
+
+    # Unchanged content is not sent again
+    handler.push_to_target(handler.convert_to_target(panopto_content), config, video_id='video-0')
+    handler.flush()
+    bulks = [body for method, path, body in StandInOpenSearch.requests if path.endswith('/_bulk')]
+    assert len(bulks) == 1
+
+    # A permission change sends only the principals, leaving the transcript where it is
+    panopto_content['VideoContent']['Principals'].pop(0)
+    handler.push_to_target(handler.convert_to_target(panopto_content), config, video_id='video-0')
+    handler.flush()
+    action, partial_document = [json.loads(line) for line in StandInOpenSearch.requests[-1][2].splitlines()]
+    assert action == {'update': {'_index': 'panopto-videos', '_id': 'video-0'}}
+    assert partial_document == {'doc': {'principals': ['Group:Panopto:Faculty']}}
+    assert StandInOpenSearch.documents['video-0']['machine_transcription'].startswith('word')
+
+    # A document removed from the index behind the connector's back is indexed again in full
+    del StandInOpenSearch.documents['video-0']
+    panopto_content['VideoContent']['Title'] = 'Renamed'
+    handler.push_to_target(handler.convert_to_target(panopto_content), config, video_id='video-0')
+    handler.flush()
+    bulks = [body for method, path, body in StandInOpenSearch.requests if path.endswith('/_bulk')]
+    assert [next(iter(json.loads(bulk.splitlines()[0]))) for bulk in bulks[-2:]] == ['update', 'index']
+    assert StandInOpenSearch.documents['video-0']['machine_transcription'].startswith('word')
+    assert StandInOpenSearch.documents['video-0']['title'] == 'Renamed'
+
+    # A document the index rejects is not recorded as synced, so the same content is sent again in full
+    StandInOpenSearch.reject_always = {'video-0'}
+    panopto_content['VideoContent']['Title'] = 'Rejected'
+    handler.push_to_target(handler.convert_to_target(panopto_content), config, video_id='video-0')
+    handler.flush()
+    assert 'update' in json.loads(StandInOpenSearch.requests[-1][2].splitlines()[0])
+    StandInOpenSearch.reject_always = set()
+    handler.push_to_target(handler.convert_to_target(panopto_content), config, video_id='video-0')
+    handler.flush()
+    assert 'index' in json.loads(StandInOpenSearch.requests[-1][2].splitlines()[0])
+    assert StandInOpenSearch.documents['video-0']['title'] == 'Rejected'
+
+    # A rebuild pushes everything in full regardless
+    handler.begin_rebuild()
+    handler.push_to_target(handler.convert_to_target(panopto_content), config, video_id='video-0')
+    handler.flush()
+    assert 'index' in json.loads(StandInOpenSearch.requests[-1][2].splitlines()[0])
+
+
+def test_opensearch_lists_target_ids(get_config):
+
+    import pytest
+    import requests
+    from panoptoindexconnector.implementations import opensearch_implementation as implementation
+
+    config = get_config()
+    StandInOpenSearch.documents = {'video-%i' % index: {} for index in range(5)}
+
+    assert list(implementation.list_target_ids(config)) == ['video-%i' % index for index in range(5)]
+    assert StandInOpenSearch.requests[-1][0] == 'DELETE'
+
+    # A scroll which fails raises its own error, and the scroll is still cleared
+    StandInOpenSearch.fail_scrolls = True
+    with pytest.raises(requests.exceptions.HTTPError):
+        list(implementation.list_target_ids(config))
+    assert StandInOpenSearch.requests[-1][0] == 'DELETE'
+
+    # An empty index has no scroll to clear
+    StandInOpenSearch.documents = {}
+    assert not list(implementation.list_target_ids(config))
+    assert StandInOpenSearch.requests[-1][0] == 'POST'
+
+
+def test_opensearch_documents_read_back_for_audits(get_config):
+
+    from panoptoindexconnector.target_handler import has_drifted, TargetHandler
+
+    config = get_config()
+    handler = TargetHandler(config)
+    handler.initialize()
+
+    target_content = handler.convert_to_target(get_panopto_content(0))
+    handler.push_to_target(target_content, config, video_id='video-0')
+    handler.flush()
+
+    assert handler.can_get_from_target
+    assert not has_drifted(target_content, handler.get_from_target('video-0'))
+
+    # Edited behind the connector's back, missing, or left behind after a delete
+    StandInOpenSearch.documents['video-0']['principals'] = ['Group:Panopto:Public']
+    assert has_drifted(target_content, handler.get_from_target('video-0'))
+    assert has_drifted(target_content, handler.get_from_target('video-1'))
+    assert has_drifted(None, handler.get_from_target('video-0'))
+
+    # Content skipped for sync is expected to be gone
+    skipped_content = dict(target_content, skip_sync=True)
+    assert has_drifted(skipped_content, handler.get_from_target('video-0'))
+    assert not has_drifted(skipped_content, handler.get_from_target('video-1'))
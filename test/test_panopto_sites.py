@@ -0,0 +1,39 @@
+"""
+Tests for what profiles syncing from the same Panopto site share.
+"""
+
+# Standard Library Imports
+import logging
+import os
+import time
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+def test_panopto_site_rate_budget():
+
+    from panoptoindexconnector.panopto_sites import get_panopto_site
+
+    site = get_panopto_site('https://budget.site.panopto.com/')
+
+    # Addresses of the same site share it
+    assert get_panopto_site('https://Budget.site.panopto.com') is site
+
+    # The lowest limit of the profiles syncing from the site holds
+    site.limit_rate(None)
+    assert site.requests_per_second is None
+    site.limit_rate(50)
+    site.limit_rate(100)
+    assert site.requests_per_second == 50
+
+    start = time.monotonic()
+    for _ in range(6):
+        site.wait_for_budget()
+    assert time.monotonic() - start >= 0.1
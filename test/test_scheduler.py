@@ -0,0 +1,57 @@
+"""
+Tests for the adaptive scheduling of sync passes.
+"""
+
+# Standard Library Imports
+from datetime import timedelta
+import logging
+import os
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+def test_adaptive_schedule():
+
+    from panoptoindexconnector.connector_config import ConnectorConfig
+    from panoptoindexconnector.custom_exceptions import CustomExceptions
+    from panoptoindexconnector.scheduler import AdaptiveSchedule
+
+    debug_path = os.path.join(DIR, '..', 'src', 'panoptoindexconnector', 'implementations', 'debug.yaml')
+    config = ConnectorConfig(debug_path)
+    # pylint: disable=protected-access
+    config._yaml_config.update({
+        'polling_seconds': 3600,
+        'polling_minimum_seconds': 600,
+        'polling_maximum_seconds': 14400,
+        'polling_retry_minimum': 300,
+    })
+
+    schedule = AdaptiveSchedule(config)
+
+    # Busy passes shorten the interval down to the minimum
+    assert schedule.get_next_interval(None, 250, True) == timedelta(seconds=1800)
+    assert schedule.get_next_interval(None, 100, True) == timedelta(seconds=900)
+    assert schedule.get_next_interval(None, 100, True) == timedelta(seconds=600)
+
+    # Some updates keep it; none lengthen it up to the maximum
+    assert schedule.get_next_interval(None, 5, True) == timedelta(seconds=600)
+    for _ in range(6):
+        interval = schedule.get_next_interval(None, 0, True)
+    assert interval == timedelta(seconds=14400)
+
+    # Failures back off exponentially, with jitter, up to the maximum
+    backoffs = [schedule.get_next_interval(ValueError(), 0, False) for _ in range(8)]
+    assert timedelta(seconds=240) <= backoffs[0] <= timedelta(seconds=360)
+    assert timedelta(seconds=480) <= backoffs[1] <= timedelta(seconds=720)
+    assert backoffs[-1] <= timedelta(seconds=14400 * 1.2)
+
+    # A pass which did not get through everything comes back soon, without counting as a failure
+    assert schedule.get_next_interval(CustomExceptions.SyncIncompleteError(), 300, False) == timedelta(seconds=300)
+    assert schedule.interval == timedelta(seconds=7200)
@@ -0,0 +1,137 @@
+"""
+Tests for the durable spool between fetching and pushing, and the circuit breaker pausing pushes.
+"""
+
+# Standard Library Imports
+import logging
+import os
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+def test_spool_survives_reopening(tmp_path):
+
+    from panoptoindexconnector.spool import Spool
+
+    directory = str(tmp_path / 'spool')
+    spool = Spool(directory, segment_bytes=200)
+    assert spool.empty
+
+    spool.append([('video-%i' % index, {'title': 'Video %i' % index}) for index in range(5)])
+    spool.append([('video-0', None)])
+
+    converted_videos, position = spool.read(2)
+    assert converted_videos == [('video-0', {'title': 'Video 0'}), ('video-1', {'title': 'Video 1'})]
+    spool.acknowledge(position)
+
+    # Reopened after a crash which cut a write short, the spool carries on after what was acknowledged
+    with open(os.path.join(directory, sorted(os.listdir(directory))[-1]), 'a') as file_handle:
+        file_handle.write('["video-9", {"tit')
+    spool = Spool(directory, segment_bytes=200)
+
+    converted_videos, position = spool.read(10)
+    assert [video_id for video_id, _ in converted_videos] == ['video-2', 'video-3', 'video-4', 'video-0']
+    assert converted_videos[-1] == ('video-0', None)
+    spool.acknowledge(position)
+
+    assert spool.empty and spool.size == 0
+    assert not os.listdir(directory)
+
+
+def test_spool_compacts_to_latest_records(tmp_path, monkeypatch):
+
+    from panoptoindexconnector import spool as spool_module
+
+    monkeypatch.setattr(spool_module, 'SPOOL_COMPACT_SEGMENTS', 2)
+    spool = spool_module.Spool(str(tmp_path / 'spool'), segment_bytes=1)
+
+    # Each append starts a segment, and the third compacts the first two, where the second round replaced the first
+    for round_index in range(3):
+        spool.append([('video-%i' % index, {'round': round_index}) for index in range(3)])
+    spool.append([('video-1', None)])
+
+    converted_videos, _ = spool.read(100)
+    assert converted_videos == [
+        ('video-%i' % index, {'round': round_index}) for round_index in (1, 2) for index in range(3)
+    ] + [('video-1', None)]
+
+
+def test_spool_discards_videos_pushed_directly(tmp_path):
+
+    from panoptoindexconnector.spool import Spool
+
+    directory = str(tmp_path / 'spool')
+    spool = Spool(directory, segment_bytes=100)
+    spool.append([('video-%i' % index, {'round': 0}, ['User:Panopto:jane']) for index in range(3)])
+    spool.append([('video-1', None, None)])
+
+    converted_videos, position = spool.read(1)
+    spool.acknowledge(position)
+
+    # Videos a resync pushed since are not put back by the spool; the acknowledged record stays pushed
+    spool.discard(['video-0', 'video-1'])
+    converted_videos, position = Spool(directory).read(10)
+    assert converted_videos == [('video-2', {'round': 0}, ['User:Panopto:jane'])]
+
+    spool.discard(['video-2'])
+    assert spool.empty and not os.listdir(directory)
+    spool.append([('video-3', None, None)])
+    assert spool.read(10)[0] == [('video-3', None, None)]
+
+
+def test_spool_shared_with_another_process(tmp_path):
+
+    from panoptoindexconnector.spool import Spool
+
+    # Each process opens the spool itself, e.g. the connector and a resync run alongside it
+    directory = str(tmp_path / 'spool')
+    connector_spool = Spool(directory, segment_bytes=100)
+    resync_spool = Spool(directory, segment_bytes=100)
+
+    connector_spool.append([('video-%i' % index, {'round': 0}, []) for index in range(3)])
+    converted_videos, position = connector_spool.read(2)
+
+    # The resync rewrites the spool while the connector pushes what it read, and the connector appends after it
+    resync_spool.discard(['video-2'])
+    connector_spool.append([('video-3', None, None)])
+    assert resync_spool.size == connector_spool.size > 0
+
+    # What was read before the rewrite is not acknowledged, so it is pushed again rather than lost
+    connector_spool.acknowledge(position)
+    converted_videos, position = resync_spool.read(10)
+    assert [video_id for video_id, _, _ in converted_videos] == ['video-0', 'video-1', 'video-3']
+
+    resync_spool.acknowledge(position)
+    assert connector_spool.empty and not os.listdir(directory)
+
+
+def test_circuit_breaker_backs_off(monkeypatch):
+
+    from panoptoindexconnector import spool as spool_module
+
+    now = [1000.0]
+    monkeypatch.setattr(spool_module.time, 'monotonic', lambda: now[0])
+    breaker = spool_module.CircuitBreaker('profile', 30)
+
+    assert breaker.closed and breaker.allows_attempt()
+
+    # Open for 30 seconds, then 60 after failing again
+    breaker.record_failure(RuntimeError('down'))
+    assert not breaker.allows_attempt()
+    now[0] += 30
+    assert breaker.allows_attempt() and not breaker.closed
+    breaker.record_failure(RuntimeError('still down'))
+    now[0] += 59
+    assert not breaker.allows_attempt()
+    now[0] += 1
+    assert breaker.allows_attempt()
+
+    breaker.record_success()
+    assert breaker.closed
@@ -0,0 +1,97 @@
+"""
+Tests for the local state store kept between sync passes.
+"""
+
+# Standard Library Imports
+import logging
+import os
+import time
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+def test_state_store_sets(tmp_path):
+
+    from panoptoindexconnector.state_store import StateStore
+
+    store = StateStore(str(tmp_path / 'state.db'))
+
+    store.add('items', 'de799c45-ccde-4187-80b8-ca383c540db5', 'not-a-guid')
+    store.add('other', 'de799c45-ccde-4187-80b8-ca383c540db5')
+
+    assert store.contains('items', 'DE799C45-CCDE-4187-80B8-CA383C540DB5')
+    assert store.contains('items', 'not-a-guid')
+    assert store.count('items') == 2
+
+    store.discard('items', 'de799c45-ccde-4187-80b8-ca383c540db5')
+
+    assert not store.contains('items', 'de799c45-ccde-4187-80b8-ca383c540db5')
+    assert store.contains('other', 'de799c45-ccde-4187-80b8-ca383c540db5')
+
+    # Members persist after reopening the store
+    store.close()
+    store = StateStore(str(tmp_path / 'state.db'))
+
+    assert store.contains('items', 'not-a-guid')
+
+
+def test_state_store_values(tmp_path):
+
+    from panoptoindexconnector.state_store import StateStore
+
+    store = StateStore(str(tmp_path / 'state.db'))
+
+    assert store.get('values', 'missing', default=3) == 3
+
+    store.set('values', 'key', {'nested': [1, 2]})
+
+    assert store.get('values', 'key') == {'nested': [1, 2]}
+    assert store.get('values', 'key', default='stale', max_age=60) == {'nested': [1, 2]}
+
+    time.sleep(0.01)
+    assert store.get('values', 'key', default='stale', max_age=0) == 'stale'
+
+    store.delete('values', 'key')
+
+    assert store.get('values', 'key') is None
+
+
+def test_state_store_difference(tmp_path):
+
+    from panoptoindexconnector.state_store import StateStore
+
+    store = StateStore(str(tmp_path / 'state.db'))
+
+    video_ids = ['%08x-0000-4000-8000-000000000000' % index for index in range(2500)]
+    store.add('panopto', *video_ids)
+    store.add('target', *video_ids[:2000:2], 'f0000000-0000-4000-8000-000000000000')
+
+    # Compared in batches, sorted
+    assert list(store.difference('target', 'panopto', batch_size=100)) == ['f0000000-0000-4000-8000-000000000000']
+    missing = list(store.difference('panopto', 'target', batch_size=100))
+    assert missing == sorted(video_ids[1:2000:2] + video_ids[2000:])
+    assert list(store.intersection('target', 'panopto', batch_size=100)) == video_ids[:2000:2]
+
+    for index in range(250):
+        store.set('values', 'key-%04i' % index, index)
+    assert list(store.keys('values', batch_size=100)) == ['key-%04i' % index for index in range(250)]
+
+
+def test_state_store_members_read_back(tmp_path):
+
+    from panoptoindexconnector.state_store import StateStore
+
+    store = StateStore(str(tmp_path / 'state.db'))
+
+    # A 16 character id is not mistaken for a GUID
+    store.add('items', 'de799c45-ccde-4187-80b8-ca383c540db5')
+    store.add('items', 'sixteen-chars-id')
+    assert store.contains('items', 'de799c45-ccde-4187-80b8-ca383c540db5')
+    assert sorted(store.difference('items', 'none')) == ['de799c45-ccde-4187-80b8-ca383c540db5', 'sixteen-chars-id']
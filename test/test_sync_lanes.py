@@ -0,0 +1,93 @@
+"""
+Tests for syncing deletes and permission removals ahead of other updates.
+"""
+
+# Standard Library Imports
+from datetime import datetime
+import logging
+import os
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+def get_update(video_id, minute, principals=None, deleted=False):
+    video_content_response = {
+        'Id': video_id,
+        'Deleted': deleted,
+        'VideoContent': None if deleted else {'Principals': principals or []},
+    }
+    return video_id, datetime(2020, 1, 1, 0, minute), video_content_response
+
+
+def test_sync_window_takes_priority_updates_first(tmp_path):
+
+    from panoptoindexconnector.state_store import StateStore
+    from panoptoindexconnector.sync_lanes import record_synced_updates, SyncWindow
+
+    store = StateStore(str(tmp_path / 'state.db'))
+    jane = {'Username': 'jane', 'IdentityProvider': 'MyAzureAD'}
+    faculty = {'Groupname': 'Faculty', 'IdentityProvider': None}
+
+    # Last synced with both principals
+    record_synced_updates(store, [get_update('revoked', 0, [jane, faculty]), get_update('shared', 0, [jane])])
+
+    window = SyncWindow(store)
+    window.add_page([get_update('a', 1, [jane]), get_update('gone', 2, deleted=True)], False)
+    window.add_page([get_update('b', 3), get_update('shared', 4, [jane, faculty])], False)
+    window.add_page([get_update('revoked', 5, [jane]), get_update('a', 6, deleted=True)], True)
+
+    # The delete and the permission removal of the last page go first; the later delete of 'a' replaces its push
+    assert [update[0] for update in window.take_priority_updates()] == ['gone', 'revoked', 'a']
+    assert not window.take_priority_updates()
+
+    # The rest follows page by page, each page moving the watermark past all of its updates
+    updates, last_update_time, update_count, is_last_page = window.take_page()
+    assert updates == [] and last_update_time == datetime(2020, 1, 1, 0, 2) and update_count == 2
+    assert not is_last_page
+
+    updates, last_update_time, update_count, is_last_page = window.take_page()
+    assert [update[0] for update in updates] == ['b', 'shared']
+    assert last_update_time == datetime(2020, 1, 1, 0, 4) and not is_last_page
+
+    updates, last_update_time, update_count, is_last_page = window.take_page()
+    assert updates == [] and is_last_page and not window
+
+    # Deleted videos are forgotten, so a video shared again is not a permission removal
+    record_synced_updates(store, [get_update('a', 6, deleted=True)])
+    assert store.get('connector:principals', 'a') is None
+
+
+def test_sync_window_takes_triggered_updates_first(tmp_path):
+
+    from panoptoindexconnector.state_store import StateStore
+    from panoptoindexconnector.sync_lanes import SyncWindow
+
+    window = SyncWindow(StateStore(str(tmp_path / 'state.db')))
+    window.add_page([get_update('a', 1), get_update('gone', 2, deleted=True)], False)
+    window.add_page([get_update('b', 3), get_update('c', 4)], False)
+    assert [update[0] for update in window.take_priority_updates()] == ['gone']
+    window.take_page()
+
+    # A trigger arriving mid-pass goes ahead of the pages waiting, replacing the update of 'b' fetched before it
+    window.add_triggered_updates([get_update('b', 30), get_update('z', 30)])
+    assert len(window) == 2
+    assert [update[:2] for update in window.take_priority_updates()] == [
+        ('b', datetime(2020, 1, 1, 0, 30)), ('z', datetime(2020, 1, 1, 0, 30))]
+
+    # Without moving the watermark past the page left
+    updates, last_update_time, update_count, _ = window.take_page()
+    assert [update[0] for update in updates] == ['c']
+    assert last_update_time == datetime(2020, 1, 1, 0, 4) and update_count == 2 and not window
+
+    # A page fetched after a trigger replaces its update in turn
+    window.add_triggered_updates([get_update('d', 30)])
+    window.add_page([get_update('d', 40)], True)
+    assert not window.take_priority_updates()
+    assert [update[1] for update in window.take_page()[0]] == [datetime(2020, 1, 1, 0, 40)]
@@ -0,0 +1,110 @@
+"""
+Tests for profiles which sync to several targets.
+"""
+
+# Standard Library Imports
+import logging
+import os
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+def test_target_configs(tmp_path):
+
+    from panoptoindexconnector.connector_config import ConnectorConfig
+    from panoptoindexconnector.target_handler import TargetHandler
+
+    config_path = tmp_path / 'campus.yaml'
+    config_path.write_text('''
+panopto_site_address: https://your.site.panopto.com
+panopto_oauth_credentials:
+    username: myconnectoruser
+    password: panoptosecret
+sleep_seconds: 1
+targets:
+    - name: primary
+      target_implementation: coveo_implementation
+      target_credentials:
+          api_key: coveosecret
+    - name: secondary
+      target_implementation: coveo_implementation
+      sleep_seconds: 0
+''')
+    config = ConnectorConfig(str(config_path))
+
+    primary, secondary = config.get_target_configs()
+
+    assert (primary.profile_name, secondary.profile_name) == ('campus.primary', 'campus.secondary')
+    assert primary.panopto_site_address == secondary.panopto_site_address == 'https://your.site.panopto.com'
+    assert (primary.sleep_seconds, secondary.sleep_seconds) == (1, 0)
+
+    # Credentials of the targets are hidden too
+    assert 'panoptosecret' not in str(config) and 'coveosecret' not in str(config)
+
+    # Targets with the same implementation don't share its module state
+    # pylint: disable=protected-access
+    primary_module = TargetHandler(primary)._implementation_module
+    secondary_module = TargetHandler(secondary)._implementation_module
+    assert primary_module is not secondary_module
+    assert primary_module.PENDING_BATCH is not secondary_module.PENDING_BATCH
+    assert TargetHandler(primary)._implementation_module is primary_module
+
+    # Profiles without targets are their own only target
+    coveo_path = os.path.join(DIR, '..', 'src', 'panoptoindexconnector', 'implementations', 'coveo.yaml')
+    config = ConnectorConfig(coveo_path)
+    assert config.get_target_configs() == [config]
+    assert config.profile_name == 'coveo'
+
+
+def test_profiles_syncing_together_keep_their_own_queues(tmp_path):
+
+    import threading
+    from panoptoindexconnector.connector_config import ConnectorConfig
+    from panoptoindexconnector.target_handler import TargetHandler
+
+    handlers = []
+    for profile_name in ('campus', 'medical'):
+        config_path = tmp_path / (profile_name + '.yaml')
+        config_path.write_text('''
+panopto_site_address: https://%s.panopto.com
+target_implementation: opensearch_implementation
+target_address: http://localhost:9200
+target_credentials:
+    index: %s-videos
+batch_size: 1000
+field_mapping:
+    Id: id
+    Info: {}
+    Metadata: {}
+''' % (profile_name, profile_name))
+        handlers.append(TargetHandler(ConnectorConfig(str(config_path))))
+
+    # Both profiles queue pushes at the same time, as the daemon's workers would
+    barrier = threading.Barrier(len(handlers))
+
+    def queue_pushes(handler):
+        barrier.wait()
+        for index in range(200):
+            # pylint: disable=protected-access
+            handler.push_to_target({'id': '%s-%i' % (handler._config.profile_name, index)}, handler._config)
+
+    threads = [threading.Thread(target=queue_pushes, args=(handler,)) for handler in handlers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # pylint: disable=protected-access
+    for handler in handlers:
+        queued_ids = [document_id for document_id, _, _ in handler._implementation_module.PENDING_BULK['actions']]
+        assert queued_ids == ['%s-%i' % (handler._config.profile_name, index) for index in range(200)]
+        assert all(
+            lines[0]['index']['_index'] == handler._config.profile_name + '-videos'
+            for _, lines, _ in handler._implementation_module.PENDING_BULK['actions'])
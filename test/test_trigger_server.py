@@ -0,0 +1,58 @@
+"""
+Tests for the local HTTP listener triggering syncs on demand.
+"""
+
+# Standard Library Imports
+import logging
+import os
+
+# Third party
+import requests
+
+
+# Global constants
+DIR = os.path.dirname(os.path.realpath(__file__))
+LOG = logging.getLogger(__name__)
+
+
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+
+def test_trigger_server():
+
+    from panoptoindexconnector.connector_config import ConnectorConfig
+    from panoptoindexconnector.trigger_server import start_trigger_server, SyncTriggers
+
+    debug_path = os.path.join(DIR, '..', 'src', 'panoptoindexconnector', 'implementations', 'debug.yaml')
+    config = ConnectorConfig(debug_path)
+    # pylint: disable=protected-access
+    config._yaml_config['trigger_port'] = 0
+    config._yaml_config['trigger_token'] = 'hunter2'
+    assert 'hunter2' not in ConnectorConfig._get_securely_displayble_config(config._yaml_config)
+
+    triggers = SyncTriggers()
+    server = start_trigger_server(config, triggers)
+    try:
+        url = 'http://%s:%i' % server.server_address
+        headers = {'Authorization': 'Bearer hunter2'}
+        video_id = 'de799c45-ccde-4187-80b8-ca383c540db5'
+
+        assert not triggers.wait(0.01)
+        assert requests.post(url + '/sync', timeout=5).status_code == 401
+        assert requests.post(url + '/videos', json=['not-an-id'], headers=headers, timeout=5).status_code == 400
+
+        assert requests.post(url + '/videos', json=[video_id], headers=headers, timeout=5).status_code == 202
+        assert requests.post(
+            url + '/videos', json={'videoIds': [video_id.upper()]}, headers=headers, timeout=5).status_code == 202
+
+        assert triggers.wait(5)
+        assert triggers.take() == ([video_id], False)
+
+        # A pass under way takes the video ids, leaving the sync now signal for after it
+        assert requests.post(url + '/sync', headers=headers, timeout=5).status_code == 202
+        assert requests.post(url + '/videos', json=[video_id], headers=headers, timeout=5).status_code == 202
+        assert triggers.take_video_ids() == [video_id]
+        assert triggers.take() == ([], True)
+    finally:
+        server.shutdown()